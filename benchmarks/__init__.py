@@ -0,0 +1,25 @@
+"""Micro-benchmarks of hot paths, run as ``python -m benchmarks.<name>``.
+
+They need the same environment as ``manage.py`` (e.g. DJANGO_SECRET_KEY).
+"""
+import os
+import time
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'minzam.settings')
+    import django
+    django.setup()
+
+
+def timed(label, func, repeat=3):
+    """Runs ``func`` ``repeat`` times, prints and returns the best time in seconds."""
+    best = min(_time(func) for _ in range(repeat))
+    print(f'{label}: {best:.3f}s')
+    return best
+
+
+def _time(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
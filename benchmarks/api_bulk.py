@@ -0,0 +1,62 @@
+"""Creating, updating and deleting N tagged bookmarks (default 1000): one bulk batch vs. one object at a time.
+
+Run it against a scratch database:
+``DATABASE_URL=sqlite:////tmp/bench.sqlite3 python -m benchmarks.api_bulk [items]``.
+Everything it writes is rolled back at the end.
+"""
+import sys
+
+from benchmarks import setup_django, timed
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from main_app import bulk
+from main_app.models import Bookmark, Tag
+
+ITEMS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+
+def items(tag_ids):
+    return [{'title': f'bookmark {i}', 'url': f'https://example.com/{i}', 'tags': tag_ids} for i in range(ITEMS)]
+
+
+def one_by_one(user, tag_ids):
+    """What the form views do for every object."""
+    created = []
+    for item in items(tag_ids):
+        bookmark = Bookmark.objects.create(title=item['title'], descr='', url=item['url'], user=user)
+        bookmark.tags.set(item['tags'])
+        created.append(bookmark)
+    for bookmark in created:
+        bookmark.title += ' (edited)'
+        bookmark.save()
+    for bookmark in created:
+        bookmark.delete()
+
+
+def batched(user, tag_ids):
+    ids = [result['id'] for result in bulk.create(user, 'bookmarks', items(tag_ids))]
+    bulk.update(user, 'bookmarks', [{'id': pk, 'title': 'edited'} for pk in ids])
+    bulk.delete(user, 'bookmarks', ids)
+
+
+def run(label, func):
+    def once():
+        sid = transaction.savepoint()
+        user = User.objects.create_user('bulk-benchmark')
+        Tag.objects.bulk_create([Tag(name=f'tag {i}', user=user) for i in range(3)])
+        func(user, list(Tag.objects.filter(user=user).values_list('pk', flat=True)))
+        transaction.savepoint_rollback(sid)
+    return timed(label, once)
+
+
+if __name__ == '__main__':
+    with transaction.atomic():
+        print(f'{ITEMS} bookmarks created, updated and deleted')
+        before = run('one at a time', one_by_one)
+        after = run('bulk batches', batched)
+        print(f'speedup: {before / after:.1f}x')
+        transaction.set_rollback(True)
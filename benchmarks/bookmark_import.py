@@ -0,0 +1,64 @@
+"""Bookmark import throughput on a generated N-entry Netscape export (default 100k).
+
+Compares the streaming importer with saving the first few thousand entries one
+at a time, as the bookmark form does. Run it against a scratch database:
+``DATABASE_URL=sqlite:////tmp/bench.sqlite3 python -m benchmarks.bookmark_import [entries]``.
+Everything it writes is rolled back at the end.
+"""
+import io
+import sys
+
+from benchmarks import setup_django, timed
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from main_app import importers
+from main_app.models import Bookmark, Tag
+
+ENTRIES = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+FOLDERS = 50
+ONE_BY_ONE = min(ENTRIES, 2_000)
+
+
+def export(entries):
+    lines = ['<!DOCTYPE NETSCAPE-Bookmark-file-1>', '<DL><p>']
+    per_folder = -(-entries // FOLDERS)
+    for folder in range(FOLDERS):
+        lines += [f'<DT><H3>folder {folder}</H3>', '<DL><p>']
+        for i in range(folder * per_folder, min((folder + 1) * per_folder, entries)):
+            lines.append(f'<DT><A HREF="https://example.com/{i}?utm_source=bench" ADD_DATE="1">page {i}</A>')
+            lines.append(f'<DD>description of page {i}')
+        lines.append('</DL><p>')
+    lines.append('</DL><p>')
+    return '\n'.join(lines).encode()
+
+
+def one_by_one(user, data):
+    entries = importers.parse(io.TextIOWrapper(io.BytesIO(data), encoding='utf-8'))
+    for _, entry in zip(range(ONE_BY_ONE), entries):
+        bookmark = Bookmark.objects.create(title=entry.title, descr=entry.descr, url=entry.url, user=user)
+        bookmark.tags.set([Tag.objects.get_or_create(name=name, user=user)[0] for name in entry.folders])
+
+
+def run(label, func, entries):
+    """Times ``func`` on a fresh user inside a savepoint that is rolled back after each run."""
+    def once():
+        sid = transaction.savepoint()
+        func(User.objects.create_user('import-benchmark'))
+        transaction.savepoint_rollback(sid)
+    best = timed(label, once, repeat=1)
+    print(f'  {entries / best:,.0f} entries/s')
+    return entries / best
+
+
+if __name__ == '__main__':
+    data = export(ENTRIES)
+    print(f'{ENTRIES} entries, {len(data) / 1e6:.1f} MB')
+    with transaction.atomic():
+        before = run(f'one by one ({ONE_BY_ONE} entries)', lambda user: one_by_one(user, data), ONE_BY_ONE)
+        after = run('streaming import', lambda user: importers.import_bookmarks(user, io.BytesIO(data)), ENTRIES)
+        print(f'speedup: {after / before:.1f}x')
+        transaction.set_rollback(True)
@@ -0,0 +1,69 @@
+"""Export of N bookmarks (default 100k): streaming rows vs. building the whole file in memory.
+
+Reports time to the first line, total time and peak Python memory. Run it
+against a scratch database:
+``DATABASE_URL=sqlite:////tmp/bench.sqlite3 python -m benchmarks.export [rows]``.
+Everything it writes is rolled back at the end.
+"""
+import sys
+import time
+import tracemalloc
+
+from benchmarks import setup_django
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from main_app import exporters
+from main_app.models import Bookmark, Tag
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+CHUNK = 5_000
+
+
+def populate(user):
+    Tag.objects.bulk_create([Tag(name=f'tag {i}', user=user) for i in range(20)])
+    tags = list(Tag.objects.filter(user=user))
+    Through = Bookmark.tags.through
+    for start in range(0, ROWS, CHUNK):
+        Bookmark.objects.bulk_create([
+            Bookmark(title=f'bookmark {i}', descr='description ' * 10, url=f'https://example.com/{i}', user=user)
+            for i in range(start, min(start + CHUNK, ROWS))
+        ])
+        ids = Bookmark.objects.filter(user=user).order_by('-pk').values_list('pk', flat=True)[:CHUNK]
+        Through.objects.bulk_create([Through(bookmark_id=pk, tag_id=tags[pk % 20].pk) for pk in ids])
+
+
+def naive(user):
+    """Every row and its tags loaded up front, as a plain list-and-join export would."""
+    lines = []
+    for bookmark in Bookmark.objects.filter(user=user).prefetch_related('tags'):
+        lines.append(f'{bookmark.pk},{bookmark.title},{bookmark.url},{",".join(t.name for t in bookmark.tags.all())}\n')
+    return iter([''.join(lines)])
+
+
+def measure(label, make_lines):
+    started = time.perf_counter()
+    lines = make_lines()
+    first = next(lines)
+    first_byte = time.perf_counter() - started
+    size = len(first) + sum(len(line) for line in lines)
+    total = time.perf_counter() - started
+    # a second run under tracemalloc, which would distort the timings
+    tracemalloc.start()
+    for _ in make_lines():
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{label}: first byte {first_byte:.3f}s, total {total:.3f}s, {size / 1e6:.1f} MB out, peak {peak / 1e6:.1f} MB')
+
+if __name__ == '__main__':
+    with transaction.atomic():
+        user = User.objects.create_user('export-benchmark')
+        populate(user)
+        print(f'{ROWS} bookmarks')
+        measure('load everything', lambda: naive(user))
+        measure('streaming csv', lambda: exporters.export_lines(user, 'bookmarks', 'csv'))
+        transaction.set_rollback(True)
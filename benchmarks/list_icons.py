@@ -0,0 +1,38 @@
+"""Render cost of the update/delete icons on a 1,000-row list: reverse() per row vs. precomputed links."""
+from benchmarks import setup_django, timed
+
+setup_django()
+
+from django.template import Context, Template
+from django.urls import reverse
+from django.utils.safestring import mark_safe
+
+from main_app.models import Task
+from main_app.templatetags.svg_icons import ICONS
+
+ROWS = 1_000
+
+TEMPLATE = '{% load svg_icons %}{% for task in tasks %}<tr><td>{{ task.name }}</td><td>{% update_icon task %}{% delete_icon task %}</td></tr>{% endfor %}'
+
+
+def per_row_reverse(obj, action):
+    name = obj.__class__.__name__.lower()
+    url = reverse(f'{name}-{action}', kwargs={f'{name}_id': obj.id})
+    return mark_safe(f'<a href="{url}" class="svgicon">{ICONS[action]}</a>')
+
+
+def render(template, tasks):
+    return lambda: template.render(Context({'tasks': tasks}))
+
+
+if __name__ == '__main__':
+    tasks = [Task(id=i, name=f'task {i}') for i in range(1, ROWS + 1)]
+    precomputed = Template(TEMPLATE)
+    library = precomputed.engine.template_libraries['svg_icons']
+    library.simple_tag(lambda obj: per_row_reverse(obj, 'update'), name='old_update')
+    library.simple_tag(lambda obj: per_row_reverse(obj, 'delete'), name='old_delete')
+    baseline = Template(TEMPLATE.replace('{% update_icon task %}{% delete_icon task %}', '{% old_update task %}{% old_delete task %}'))
+    assert render(baseline, tasks)() == render(precomputed, tasks)()
+    before = timed(f'reverse() per row, {ROWS} rows', render(baseline, tasks), repeat=5)
+    after = timed(f'precomputed links, {ROWS} rows', render(precomputed, tasks), repeat=5)
+    print(f'speedup: {before / after:.1f}x')
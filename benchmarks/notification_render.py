@@ -0,0 +1,34 @@
+"""Render cost of 10k task reminders: per-message template lookup vs. precompiled templates."""
+from benchmarks import setup_django, timed
+
+setup_django()
+
+from django.template import loader
+
+from main_app.task_notifier import MessageBuilder
+
+REMINDERS = 10_000
+
+
+def contexts():
+    for i in range(REMINDERS):
+        url = f'https://minzam.herokuapp.com/task/{i}'
+        yield {'tasks': [{'name': f'task {i}', 'url': url}], 'task_name': f'task {i}', 'task_url': url}
+
+
+def render_to_string():
+    for context in contexts():
+        loader.render_to_string('task_notification_body.txt', context)
+        loader.render_to_string('task_notification_body.html', context)
+
+
+def precompiled():
+    builder = MessageBuilder('https://minzam.herokuapp.com')
+    for context in contexts():
+        builder.render(context)
+
+
+if __name__ == '__main__':
+    before = timed(f'render_to_string, {REMINDERS} reminders', render_to_string)
+    after = timed(f'precompiled templates, {REMINDERS} reminders', precompiled)
+    print(f'speedup: {before / after:.1f}x')
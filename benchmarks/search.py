@@ -0,0 +1,65 @@
+"""Search latency over N bookmarks (default 1M): indexed backend vs. an icontains scan.
+
+Run it against a scratch database: ``DATABASE_URL=sqlite:////tmp/bench.sqlite3 python -m benchmarks.search [rows]``.
+Everything it writes is rolled back at the end.
+"""
+import random
+import sys
+
+from benchmarks import setup_django, timed
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+
+from main_app import search
+from main_app.models import Bookmark
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+CHUNK = 5_000
+LETTERS = 'ابتثجحخدذرزسشصضطظعغفقكلمنهوي'
+
+
+def vocabulary(size=20_000, seed=1):
+    rng = random.Random(seed)
+    return [''.join(rng.choice(LETTERS) for _ in range(rng.randint(3, 7))) for _ in range(size)]
+
+
+def populate(user, words):
+    rng = random.Random(2)
+    for start in range(0, ROWS, CHUNK):
+        chunk = [
+            Bookmark(
+                title=' '.join(rng.choices(words, k=4)),
+                descr=' '.join(rng.choices(words, k=20)),
+                url=f'https://example.com/{i}',
+                user=user,
+            )
+            for i in range(start, min(start + CHUNK, ROWS))
+        ]
+        Bookmark.objects.bulk_create(chunk)
+        search.index_objects(Bookmark.objects.filter(user=user).order_by('-pk')[:len(chunk)])
+        print(f'\rindexed {start + len(chunk)}/{ROWS}', end='', file=sys.stderr)
+    print(file=sys.stderr)
+
+
+def scan(user, query):
+    condition = Q()
+    for term in query.split():
+        condition &= Q(title__icontains=term) | Q(descr__icontains=term)
+    return list(Bookmark.objects.filter(condition, user=user).order_by('-pk')[:50])
+
+
+if __name__ == '__main__':
+    words = vocabulary()
+    queries = [words[10], f'{words[20]} {words[30]}', words[-1]]
+    with transaction.atomic():
+        user = User.objects.create_user('search-benchmark')
+        populate(user, words)
+        print(f'backend: {search.get_backend().name}, {ROWS} bookmarks')
+        before = timed('icontains scan', lambda: [scan(user, q) for q in queries])
+        after = timed('search index', lambda: [search.search(user, q) for q in queries])
+        print(f'speedup: {before / after:.1f}x')
+        transaction.set_rollback(True)
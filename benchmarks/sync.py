@@ -0,0 +1,51 @@
+"""Catching up on 20 changes in an account of N bookmarks (default 100k): refetching the list vs. delta sync.
+
+Run it against a scratch database:
+``DATABASE_URL=sqlite:////tmp/bench.sqlite3 python -m benchmarks.sync [rows]``.
+Everything it writes is rolled back at the end.
+"""
+import sys
+
+from benchmarks import setup_django, timed
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from main_app import bulk, changes, exporters
+from main_app.models import Bookmark
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+CHUNK = 5_000
+
+
+def populate(user):
+    for start in range(0, ROWS, CHUNK):
+        Bookmark.objects.bulk_create([
+            Bookmark(title=f'bookmark {i}', descr='', url=f'https://example.com/{i}', user=user)
+            for i in range(start, min(start + CHUNK, ROWS))
+        ])
+
+
+def refetch(user):
+    after = 0
+    while True:
+        rows = exporters.page(user, 'bookmarks', after, bulk.MAX_BATCH)
+        if not rows:
+            return
+        after = rows[-1]['id']
+
+
+if __name__ == '__main__':
+    with transaction.atomic():
+        user = User.objects.create_user('sync-benchmark')
+        populate(user)
+        token = changes.head(user)
+        ids = list(Bookmark.objects.filter(user=user).values_list('pk', flat=True)[:20])
+        bulk.update(user, 'bookmarks', [{'id': pk, 'title': 'edited'} for pk in ids])
+        print(f'{ROWS} bookmarks, {len(ids)} edited')
+        before = timed('refetch every page', lambda: refetch(user))
+        after = timed('sync since token', lambda: changes.since(user, token, bulk.MAX_BATCH))
+        print(f'speedup: {before / after:.0f}x')
+        transaction.set_rollback(True)
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Bookmark, Task, Tag
+from .models import ApiToken, Bookmark, Task, Tag, Notification
 
 @admin.register(Bookmark)
 class BookmarkAdmin(admin.ModelAdmin):
@@ -16,3 +16,13 @@ class TaskAdmin(admin.ModelAdmin):
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ('name', 'user')
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('task', 'status', 'attempts', 'available_at', 'sent_at')
+    list_filter = ['status']
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ('user', 'name', 'created')
+    readonly_fields = ('key_hash',)
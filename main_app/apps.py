@@ -5,3 +5,6 @@ class MainAppConfig(AppConfig):
     name = 'main_app'
     verbose_name = 'منظام'
 
+    def ready(self):
+        from . import signals
+
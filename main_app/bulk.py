@@ -0,0 +1,355 @@
+"""Batch create, update and delete of a user's bookmarks, tasks and tags, for the JSON API.
+
+Each batch is a list of items, applied in one transaction with bulk queries:
+bulk_create/bulk_update for the objects, bulk inserts for their tags. Every
+item gets a result of its own, in input order, so that one invalid item
+does not reject the rest of the batch. Bulk queries bypass the model
+signals, so counters, the search index, the notifier and the change log
+are updated here.
+"""
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import changes, counters, search, task_notifier
+from .models import Bookmark, Notification, Tag, Task, url_hash
+
+MAX_BATCH = 1000
+KINDS = {
+    'bookmarks': Bookmark,
+    'tasks': Task,
+    'tags': Tag,
+}
+# the fields a client may set, and which of them must be given on create
+FIELDS = {
+    Bookmark: {'title': True, 'url': True, 'descr': False, 'tags': False},
+    Task: {'name': True, 'descr': False, 'priority': True, 'due_date': True, 'tags': False},
+    Tag: {'name': True},
+}
+DEFAULTS = {'descr': ''}
+# the largest values of an IntegerField and of a (BigAutoField) id on every supported database
+MAX_INTEGER = 2147483647
+MAX_ID = 9223372036854775807
+
+
+class BatchError(Exception):
+    """A batch that cannot be applied at all, as opposed to an invalid item."""
+
+
+def _error(errors, **extra):
+    return {'status': 'error', 'errors': errors, **extra}
+
+
+def _messages(error):
+    return {field: [str(message) for message in messages] for field, messages in error.message_dict.items()}
+
+
+def _is_id(value):
+    # bool is an int subclass, but true is not an id
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _lookup(ids):
+    # ids past the column's range are not found, rather than an error of the database
+    return [pk for pk in ids if _is_id(pk) and 0 < pk <= MAX_ID]
+
+
+def _check_batch(items):
+    if not isinstance(items, list):
+        raise BatchError('expected a JSON array')
+    if len(items) > MAX_BATCH:
+        raise BatchError(f'at most {MAX_BATCH} items per request')
+
+
+class _Items:
+    """Validates the items of one batch against a model, collecting per-item results."""
+
+    def __init__(self, user, model, size):
+        self.user = user
+        self.model = model
+        self.results = [None] * size
+        self._tag_ids = None
+
+    def tag_ids(self):
+        # one query for the whole batch
+        if self._tag_ids is None:
+            self._tag_ids = set(Tag.objects.filter(user=self.user).values_list('pk', flat=True))
+        return self._tag_ids
+
+    def apply(self, obj, item, creating):
+        """Copies the item's fields onto ``obj``; returns the tag ids given (or None) and the changed fields."""
+        fields = FIELDS[self.model]
+        errors = {}
+        if not isinstance(item, dict):
+            raise ValidationError({'__all__': ['expected a JSON object']})
+        unknown = item.keys() - fields.keys() - {'id'}
+        for name in unknown:
+            errors[name] = ['unknown field']
+        changed = []
+        tags = None
+        for name, required in fields.items():
+            if name not in item:
+                if creating and required:
+                    errors[name] = ['This field is required.']
+                elif creating and name in DEFAULTS:
+                    setattr(obj, name, DEFAULTS[name])
+                continue
+            value = item[name]
+            if name == 'tags':
+                if not isinstance(value, list) or not all(map(_is_id, value)):
+                    errors[name] = ['expected a list of tag ids']
+                elif set(value) - self.tag_ids():
+                    errors[name] = [f'unknown tag ids: {sorted(set(value) - self.tag_ids())}']
+                else:
+                    tags = set(value)
+                continue
+            if name == 'due_date':
+                try:
+                    value = parse_datetime(value) if isinstance(value, str) else None
+                except ValueError:  # well formed, but out of range
+                    value = None
+                if value is None:
+                    errors[name] = ['expected an ISO 8601 date and time']
+                    continue
+                if timezone.is_naive(value):
+                    value = timezone.make_aware(value)
+            if name == 'priority' and not (_is_id(value) and 1 <= value <= MAX_INTEGER):
+                errors[name] = [f'expected an integer from 1 to {MAX_INTEGER}']
+                continue
+            setattr(obj, name, value)
+            changed.append(name)
+        exclude = [field.name for field in self.model._meta.fields if field.name not in changed]
+        # as on the forms, a description may be empty
+        if getattr(obj, 'descr', None) == '':
+            exclude.append('descr')
+        try:
+            obj.clean_fields(exclude=exclude)
+        except ValidationError as e:
+            errors.update({name: messages for name, messages in _messages(e).items() if name not in errors})
+        if errors:
+            raise ValidationError(errors)
+        return tags, changed
+
+
+def _set_tags(model, objects_tags, replace):
+    """Inserts the through rows of ``objects_tags`` ({object: tag ids}) in bulk, first dropping the old ones if ``replace``.
+
+    Returns the (object id, tag id) pairs added and removed.
+    """
+    if not objects_tags:
+        return set(), set()
+    through = model.tags.through
+    source = f'{model._meta.model_name}_id'
+    pairs = {(obj.pk, tag_id) for obj, tag_ids in objects_tags.items() for tag_id in tag_ids}
+    old = set()
+    if replace:
+        old_rows = through.objects.filter(**{f'{source}__in': [obj.pk for obj in objects_tags]})
+        old = set(old_rows.values_list(source, 'tag_id'))
+        old_rows.delete()
+    through.objects.bulk_create([through(**{source: pk, 'tag_id': tag_id}) for pk, tag_id in pairs])
+    return pairs - old, old - pairs
+
+
+def _record(user, model, objects, tagging=(set(), set())):
+    """Logs the batch in the change log; called after the counters are adjusted, see main_app.changes."""
+    name = model._meta.model_name
+    changes.record(user.pk, name, [obj.pk for obj in objects], changes.SAVE)
+    for pairs, action in zip(tagging, (changes.ADD, changes.REMOVE)):
+        if pairs:
+            object_ids, tag_ids = zip(*sorted(pairs))
+            changes.record(user.pk, f'{name}_tag', list(object_ids), action, list(tag_ids))
+
+
+def _check_urls(user, bookmarks):
+    """Rejects bookmarks whose URL another of the user's bookmarks has, or an earlier item of the batch.
+
+    Checking against the URLs as they are before the batch keeps every row of
+    the bulk UPDATE within the unique constraint.
+    """
+    wanted = {}
+    for index, bookmark in bookmarks.items():
+        bookmark.url_hash = url_hash(bookmark.url)
+        wanted.setdefault(bookmark.url_hash, []).append(index)
+    existing = dict(Bookmark.objects.filter(user=user, url_hash__in=list(wanted)).values_list('url_hash', 'pk'))
+    rejected = {}
+    for digest, indexes in wanted.items():
+        owner = existing.get(digest)
+        taken = False
+        for index in indexes:
+            if taken or owner not in (None, bookmarks[index].pk):
+                rejected[index] = _error({'url': ['a bookmark with this URL already exists']}, id=owner)
+            else:
+                taken = True
+    return rejected
+
+
+def _added(objects):
+    """Assigns the ids of just bulk created objects, which only PostgreSQL returns."""
+    if not objects or objects[0].pk is not None:
+        return
+    model = type(objects[0])
+    # the transaction holds SQLite's write lock, so these are the newest ids, in insert order
+    ids = model.objects.filter(user=objects[0].user).order_by('-pk').values_list('pk', flat=True)[:len(objects)]
+    for obj, pk in zip(objects, reversed(list(ids))):
+        obj.pk = pk
+
+
+def _notify_on_commit(notify, tasks):
+    """Runs ``notify`` on each task once the batch commits, as the signals do for single tasks."""
+    def run():
+        for task in tasks:
+            notify(task)
+    transaction.on_commit(run)
+
+
+def _after_write(model, user, objects):
+    if model is not Tag:
+        search.index_objects(objects)
+    if model is Task:
+        _notify_on_commit(task_notifier.task_changed, objects)
+
+
+@transaction.atomic
+def create(user, kind, items):
+    model = KINDS[kind]
+    _check_batch(items)
+    batch = _Items(user, model, len(items))
+    new = {}
+    tags = {}
+    for index, item in enumerate(items):
+        obj = model(user=user)
+        try:
+            tags[index] = batch.apply(obj, item, creating=True)[0]
+        except ValidationError as e:
+            batch.results[index] = _error(_messages(e))
+        else:
+            new[index] = obj
+    if model is Bookmark:
+        for index, result in _check_urls(user, new).items():
+            batch.results[index] = result
+            del new[index]
+
+    objects = list(new.values())
+    model.objects.bulk_create(objects)
+    _added(objects)
+    tagging = _set_tags(model, {new[index]: tags[index] for index in new if tags[index]}, replace=False)
+    if model is Task:
+        counters.adjust(user.pk, tasks=len(objects), pending_reminders=len(objects), task_version=1)
+    else:
+        counters.adjust(user.pk, **{kind: len(objects)})
+    _record(user, model, objects, tagging)
+    _after_write(model, user, objects)
+    for index, obj in new.items():
+        batch.results[index] = {'status': 'created', 'id': obj.pk}
+    return batch.results
+
+
+def _ids(items):
+    return [item.get('id') if isinstance(item, dict) else item for item in items]
+
+
+@transaction.atomic
+def update(user, kind, items):
+    model = KINDS[kind]
+    _check_batch(items)
+    batch = _Items(user, model, len(items))
+    ids = _ids(items)
+    found = model.objects.select_for_update().filter(user=user, pk__in=_lookup(ids)).in_bulk()
+    changed = {}
+    fields = set()
+    tags = {}
+    seen = set()
+    rescheduled = 0
+    for index, (item, pk) in enumerate(zip(items, ids)):
+        if not _is_id(pk):
+            batch.results[index] = _error({'id': ['expected an integer']})
+            continue
+        if pk not in found:
+            batch.results[index] = {'status': 'not_found', 'id': pk}
+            continue
+        if pk in seen:
+            batch.results[index] = _error({'id': ['given more than once']}, id=pk)
+            continue
+        seen.add(pk)
+        obj = found[pk]
+        due_date = getattr(obj, 'due_date', None)
+        try:
+            tags[index], item_fields = batch.apply(obj, item, creating=False)
+        except ValidationError as e:
+            batch.results[index] = _error(_messages(e), id=pk)
+            continue
+        if model is Task and obj.due_date != due_date and obj.notified:
+            # as on the form: a new due date gets a new reminder
+            obj.notified = False
+            fields.add('notified')
+            rescheduled += 1
+        changed[index] = obj
+        fields.update(item_fields)
+    if model is Bookmark and 'url' in fields:
+        for index, result in _check_urls(user, changed).items():
+            batch.results[index] = {**result, 'id': changed[index].pk}
+            del changed[index]
+        fields.add('url_hash')
+
+    objects = list(changed.values())
+    if objects:
+        # bulk_update does not apply auto_now
+        now = timezone.now()
+        for obj in objects:
+            obj.updated = now
+        model.objects.bulk_update(objects, fields | {'updated'}, batch_size=500)
+    tagging = _set_tags(model, {changed[index]: tags[index] for index in changed if tags[index] is not None}, replace=True)
+    if model is Task:
+        counters.adjust(user.pk, overdue=-rescheduled, pending_reminders=rescheduled, task_version=1)
+    else:
+        counters.adjust(user.pk)
+    _record(user, model, objects, tagging)
+    _after_write(model, user, objects)
+    for index, obj in changed.items():
+        batch.results[index] = {'status': 'updated', 'id': obj.pk}
+    return batch.results
+
+
+def _delete_rows(table, ids, column='id'):
+    # plain DELETEs: the ORM would send the per-object delete signals this batch replaces
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({", ".join(["%s"] * len(chunk))})', chunk)
+
+
+@transaction.atomic
+def delete(user, kind, items):
+    model = KINDS[kind]
+    _check_batch(items)
+    ids = _ids(items)
+    only = ['id', 'user'] + (['notified'] if model is Task else [])
+    found = model.objects.select_for_update().filter(user=user, pk__in=_lookup(ids)).only(*only).in_bulk()
+    objects = list(found.values())
+    pks = list(found)
+    if model is Tag:
+        for tagged in (Bookmark, Task):
+            _delete_rows(tagged.tags.through._meta.db_table, pks, 'tag_id')
+    else:
+        search.remove_objects(objects)
+        _delete_rows(model.tags.through._meta.db_table, pks, f'{model._meta.model_name}_id')
+    if model is Task:
+        _delete_rows(Notification._meta.db_table, pks, 'task_id')
+    _delete_rows(model._meta.db_table, pks)
+
+    if model is Task:
+        overdue = sum(task.notified for task in objects)
+        counters.adjust(user.pk, tasks=-len(objects), overdue=-overdue,
+                        pending_reminders=overdue - len(objects), task_version=1)
+        _notify_on_commit(task_notifier.task_deleted, objects)
+    else:
+        counters.adjust(user.pk, **{kind: -len(objects)})
+    # the tombstone of an object also stands for its tag assignments
+    changes.record(user.pk, model._meta.model_name, pks, changes.DELETE)
+    return [
+        _error({'id': ['expected an integer']}) if not _is_id(pk)
+        else {'status': 'deleted', 'id': pk} if pk in found
+        else {'status': 'not_found', 'id': pk}
+        for pk in ids
+    ]
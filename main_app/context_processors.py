@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from .counters import request_counters
+
+
+def data_version(request):
+    """The user's data version, which keys their cached page fragments; only queried when a template uses it."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {
+        'data_version': SimpleLazyObject(lambda: request_counters(request).version),
+        'FRAGMENT_CACHE_TIMEOUT': settings.FRAGMENT_CACHE_TIMEOUT,
+    }
@@ -0,0 +1,111 @@
+"""Per-user counters of bookmarks, tasks, tags, overdue tasks and pending reminders.
+
+Rows are adjusted by signals, and by the notifier when it marks tasks as
+notified, in the same transaction as the change. A missing row is rebuilt
+from a full count the first time it is read or adjusted. Every adjustment
+also bumps the row's version and modified time, which key the user's cached
+page fragments and HTTP validators; changes to tasks also bump task_version,
+which validates the calendar feed.
+"""
+from django.db.models import Case, Count, F, Q, Value, When
+from django.utils import timezone
+
+
+def recount(user_id):
+    """Rebuilds a user's counters from scratch."""
+    from .models import Bookmark, Tag, Task, UserCounters, initial_data_version
+
+    tasks = Task.objects.filter(user_id=user_id).aggregate(
+        total=Count('id'),
+        overdue=Count('id', filter=Q(notified=True)),
+    )
+    counters, _ = UserCounters.objects.update_or_create(user_id=user_id, defaults={
+        'bookmarks': Bookmark.objects.filter(user_id=user_id).count(),
+        'tags': Tag.objects.filter(user_id=user_id).count(),
+        'tasks': tasks['total'],
+        'overdue': tasks['overdue'],
+        'pending_reminders': tasks['total'] - tasks['overdue'],
+        'version': initial_data_version(),
+        'task_version': initial_data_version(),
+        'modified': timezone.now(),
+    })
+    return counters
+
+
+def get_counters(user):
+    from .models import UserCounters
+
+    try:
+        return UserCounters.objects.get(user=user)
+    except UserCounters.DoesNotExist:
+        return recount(user.pk)
+
+
+def request_counters(request):
+    """The counters of the request's user, loaded at most once per request."""
+    if not hasattr(request, '_user_counters'):
+        request._user_counters = get_counters(request.user)
+    return request._user_counters
+
+
+def adjust(user_id, **deltas):
+    """Adds ``deltas`` to a user's counters and bumps their version with a single UPDATE."""
+    from .models import UserCounters
+
+    if user_id is None:
+        return
+    deltas = {name: F(name) + delta for name, delta in deltas.items() if delta}
+    deltas['version'] = F('version') + 1
+    deltas['modified'] = timezone.now()
+    if not UserCounters.objects.filter(user_id=user_id).update(**deltas):
+        # the recount already includes the change being counted
+        recount(user_id)
+
+
+def _task_state(notified):
+    return 'overdue' if notified else 'pending_reminders'
+
+
+def task_saved(task, created):
+    if task.user_id is None:
+        pass
+    elif created:
+        adjust(task.user_id, tasks=1, task_version=1, **{_task_state(task.notified): 1})
+    else:
+        loaded = getattr(task, '_loaded_notified', None)
+        if loaded is None:
+            # saved without being loaded first: there is nothing to compare against
+            recount(task.user_id)
+        elif loaded != task.notified:
+            adjust(task.user_id, task_version=1, **{_task_state(loaded): -1, _task_state(task.notified): 1})
+        else:
+            adjust(task.user_id, task_version=1)
+    task._loaded_notified = task.notified
+
+
+def task_deleted(task):
+    adjust(task.user_id, tasks=-1, task_version=1, **{_task_state(task.notified): -1})
+
+
+def tasks_notified(Task, ids):
+    """Moves the tasks marked notified in bulk by the notifier from pending to overdue.
+
+    One UPDATE covers every user of the batch.
+    """
+    from .models import UserCounters
+
+    moved = dict(Task.objects.filter(pk__in=ids).exclude(user=None).order_by().values_list('user').annotate(Count('id')))
+    if not moved:
+        return
+    delta = Case(*[When(user_id=user_id, then=Value(count)) for user_id, count in moved.items()], default=Value(0))
+    updated = UserCounters.objects.filter(user_id__in=moved).update(
+        pending_reminders=F('pending_reminders') - delta,
+        overdue=F('overdue') + delta,
+        version=F('version') + 1,
+        task_version=F('task_version') + 1,
+        modified=timezone.now(),
+    )
+    if updated < len(moved):
+        existing = set(UserCounters.objects.filter(user_id__in=moved).values_list('user_id', flat=True))
+        for user_id in moved.keys() - existing:
+            recount(user_id)
@@ -0,0 +1,192 @@
+import json, logging, random, smtplib, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class MailDispatcher:
+    """Sends messages through one email backend connection that stays open for a whole drain.
+
+    Messages go out one send_messages() call at a time over the shared
+    connection, so a failure can be pinned to the message that caused it. A
+    dropped connection is reopened and the failed message retried once.
+    """
+
+    def __init__(self, connection=None):
+        self.connection = connection or get_connection(fail_silently=False)
+        self._opened = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._opened:
+            self.connection.close()
+
+    def _reconnect(self):
+        try:
+            self.connection.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.connection.open()
+
+    def send_one(self, message):
+        try:
+            return self.connection.send_messages([message]) == 1
+        except (smtplib.SMTPException, OSError) as ex:
+            logger.warning('failed to send email to %s: %r, reconnecting', message.to, ex)
+        try:
+            self._reconnect()
+            return self.connection.send_messages([message]) == 1
+        except (smtplib.SMTPException, OSError) as ex:
+            logger.error('failed to send email to %s: %r', message.to, ex)
+            return False
+
+    def send(self, messages):
+        """Returns a list telling which of ``messages`` were delivered."""
+        if messages and not self._opened:
+            self.connection.open()
+            self._opened = True
+        return [self.send_one(message) for message in messages]
+
+
+class CircuitBreaker:
+    """Stops calls to a failing service for a while.
+
+    Opens after ``threshold`` consecutive failures and lets a single trial call
+    through once ``cooldown`` seconds have passed.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # half-open: let one call through and wait for its result
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record(self, success):
+        with self._lock:
+            if success:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold:
+                    self.opened_at = time.monotonic()
+
+
+class TrustifiError(Exception):
+
+    def __init__(self, message, retryable=True, service_down=None):
+        super().__init__(message)
+        self.retryable = retryable
+        # whether the failure counts against the circuit breaker, rather than against this message
+        self.service_down = retryable if service_down is None else service_down
+
+
+class TrustifiDispatcher:
+    """Sends messages through the Trustifi API in parallel over a keep-alive session.
+
+    Transient failures (connection errors, timeouts, 429 and 5xx responses) are
+    retried with exponential backoff, and a circuit breaker stops hammering the
+    API while it is down. The dispatcher is meant to live for the whole process
+    so pooled connections and the breaker state carry over between drains.
+    """
+
+    def __init__(self, url=None, key=None, secret=None, concurrency=None, timeout=None,
+                 max_retries=None, backoff=None, breaker_threshold=None, breaker_cooldown=None):
+        self.url = url or settings.TRUSTIFI_URL
+        self.concurrency = concurrency or settings.TRUSTIFI_CONCURRENCY
+        self.timeout = timeout or settings.TRUSTIFI_TIMEOUT
+        self.max_retries = settings.TRUSTIFI_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.TRUSTIFI_BACKOFF if backoff is None else backoff
+        self.breaker = CircuitBreaker(breaker_threshold or settings.TRUSTIFI_BREAKER_THRESHOLD,
+                                      breaker_cooldown or settings.TRUSTIFI_BREAKER_COOLDOWN)
+        self.session = requests.Session()
+        self.session.mount(self.url, HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency))
+        self.session.headers.update({
+            'x-trustifi-key': key or settings.TRUSTIFI_KEY or '',
+            'x-trustifi-secret': secret or settings.TRUSTIFI_SECRET or '',
+            'Content-Type': 'application/json',
+        })
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def close(self):
+        self.session.close()
+
+    def _post(self, message):
+        payload = {
+            "recipients": [{"email": recipient} for recipient in message.to],
+            "title": message.subject,
+            "html": message.alternatives[0][0] if message.alternatives else message.body,
+        }
+        try:
+            response = self.session.post(self.url, data=json.dumps(payload), timeout=self.timeout)
+        except requests.RequestException as ex:
+            raise TrustifiError(repr(ex))
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TrustifiError(f'HTTP {response.status_code}')
+        if not response.ok:
+            # a rejected message (e.g. a bad recipient) says nothing of the service, but rejected credentials fail every message
+            raise TrustifiError(f'HTTP {response.status_code}: {response.text[:200]}', retryable=False,
+                                service_down=response.status_code in (401, 403))
+
+    def send_one(self, message):
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                logger.warning('not sending email to %s: Trustifi circuit is open', message.to)
+                return False
+            try:
+                self._post(message)
+            except TrustifiError as ex:
+                # the service answered a rejected message, which also closes a half-open circuit
+                self.breaker.record(not ex.service_down)
+                logger.warning('failed to send email to %s (attempt %d): %s', message.to, attempt + 1, ex)
+                if not ex.retryable:
+                    return False
+            else:
+                self.breaker.record(True)
+                return True
+            if attempt < self.max_retries:
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(1, 1.5))
+        return False
+
+    def send(self, messages):
+        """Returns a list telling which of ``messages`` were delivered."""
+        if len(messages) <= 1 or self.concurrency == 1:
+            return [self.send_one(message) for message in messages]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(self.send_one, messages))
+
+
+_trustifi_dispatcher = None
+
+
+def get_dispatcher():
+    global _trustifi_dispatcher
+    if settings.USE_TRUSTIFI:
+        if _trustifi_dispatcher is None:
+            _trustifi_dispatcher = TrustifiDispatcher()
+        return _trustifi_dispatcher
+    return MailDispatcher()
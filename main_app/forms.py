@@ -1,4 +1,5 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm, UsernameField
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -18,6 +19,20 @@ class BookmarkForm(forms.Form):
             self.fields['tags'].queryset = Tag.objects.filter(user=user)
 
 
+class BookmarkImportForm(forms.Form):
+
+    file = forms.FileField(label='ملف', help_text='ملف تصدير الإشارات المرجعية من المتصفح (HTML أو JSON)')
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if file.size > settings.BOOKMARK_IMPORT_MAX_SIZE:
+            raise ValidationError(
+                'الملف أكبر من %(limit)d ميغابايت، اطلب من مدير الموقع استيراده بالأمر import_bookmarks',
+                params={'limit': settings.BOOKMARK_IMPORT_MAX_SIZE // (1024 * 1024)},
+            )
+        return file
+
+
 class DateWidget(forms.DateInput):
     input_type = 'date'
 
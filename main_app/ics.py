@@ -0,0 +1,71 @@
+"""The iCalendar (RFC 5545) feed of a user's tasks, produced line by line.
+
+Each task is an event at its due date. Tasks are read with .iterator() so
+that the feed streams in constant memory, however many tasks there are.
+"""
+import datetime
+
+CHUNK_SIZE = 2000
+# part of the feed's ETag: bump it when the output for the same tasks changes
+FORMAT_VERSION = 1
+CONTENT_TYPE = 'text/calendar; charset=utf-8'
+
+
+def escape(text):
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n'))
+
+
+def fold(line):
+    """Splits a content line into lines of at most 75 octets, without cutting a UTF-8 sequence."""
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    start = 0
+    limit = 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # back off to the start of a character
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode())
+        start = end
+        limit = 74  # continuation lines start with a space
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _timestamp(value):
+    return value.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def feed_lines(user, task_url, chunk_size=CHUNK_SIZE):
+    """Yields the lines of the user's task calendar; ``task_url(pk)`` gives the absolute link of a task."""
+    from .models import Task
+
+    yield from map(fold, [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//minzam//tasks//AR',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape(f"مهام {user.get_username()}")}',
+    ])
+    tasks = (Task.objects.filter(user=user).order_by('pk')
+             .values_list('pk', 'name', 'descr', 'priority', 'due_date', 'created', 'updated'))
+    for pk, name, descr, priority, due_date, created, updated in tasks.iterator(chunk_size=chunk_size):
+        yield ''.join(map(fold, [
+            'BEGIN:VEVENT',
+            f'UID:task-{pk}@minzam',
+            f'DTSTAMP:{_timestamp(updated)}',
+            f'CREATED:{_timestamp(created)}',
+            f'LAST-MODIFIED:{_timestamp(updated)}',
+            f'DTSTART:{_timestamp(due_date)}',
+            f'SUMMARY:{escape(name)}',
+            f'DESCRIPTION:{escape(descr)}',
+            # iCalendar priorities run from 1 (highest) to 9, like the tasks' from 1 up
+            f'PRIORITY:{min(max(priority, 1), 9)}',
+            f'URL:{task_url(pk)}',
+            'END:VEVENT',
+        ]))
+    yield fold('END:VCALENDAR')
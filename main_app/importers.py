@@ -0,0 +1,343 @@
+"""Streaming import of browser bookmark exports.
+
+Netscape bookmark HTML (what every browser exports) and the JSON formats of
+Chrome and Firefox are parsed incrementally, a chunk of the file at a time.
+The folders a bookmark is in become its tags. Bookmarks are inserted in
+chunks with bulk_create. URLs the user already saved, or that appear twice
+in the file, are skipped, matched by url_hash().
+"""
+import io
+import json
+import logging
+import re
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.db import transaction
+
+from . import changes, counters, search
+from .models import MAX_NAME_LEN, Bookmark, Tag, url_hash
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+IMPORTED_SCHEMES = {'http', 'https', 'ftp', 'ftps'}
+URL_MAX_LENGTH = Bookmark._meta.get_field('url').max_length
+
+
+class InvalidImportFile(Exception):
+    pass
+
+
+class Entry:
+    __slots__ = ('title', 'url', 'descr', 'folders')
+
+    def __init__(self, title, url, descr='', folders=()):
+        self.title = title
+        self.url = url
+        self.descr = descr
+        self.folders = folders
+
+
+class NetscapeParser(HTMLParser):
+    """Collects the bookmarks of a Netscape bookmark file as it is fed."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.entries = []
+        self.folders = []
+        self.pending_folder = None
+        self.text = None
+        self.current = None
+        self.in_descr = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'h3':
+            # the toolbar and unfiled folders are browser roots, not user folders
+            is_root = 'personal_toolbar_folder' in attrs or 'unfiled_bookmarks_folder' in attrs
+            self.text = [] if not is_root else None
+            self.pending_folder = None
+        elif tag == 'dl':
+            self.folders.append(self.pending_folder)
+            self.pending_folder = None
+        elif tag == 'a':
+            self.in_descr = False
+            tags = [name.strip() for name in attrs.get('tags', '').split(',') if name.strip()]
+            folders = tuple(name for name in self.folders if name) + tuple(tags)
+            self.current = Entry('', attrs.get('href') or '', '', folders)
+            self.entries.append(self.current)
+            self.text = []
+        elif tag == 'dd':
+            self.in_descr = self.current is not None
+        elif tag == 'dt':
+            self.in_descr = False
+
+    def handle_endtag(self, tag):
+        if tag == 'h3':
+            self.pending_folder = ''.join(self.text).strip() if self.text is not None else None
+            self.text = None
+        elif tag == 'a' and self.current is not None:
+            self.current.title = ''.join(self.text or []).strip()
+            self.text = None
+        elif tag == 'dl':
+            if self.folders:
+                self.folders.pop()
+            self.in_descr = False
+            self.current = None
+
+    def handle_data(self, data):
+        if self.text is not None:
+            self.text.append(data)
+        elif self.in_descr:
+            self.current.descr += data
+
+
+def parse_netscape(stream):
+    parser = NetscapeParser()
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        # the last entry may still get its <DD> description from the next chunk
+        ready, parser.entries = parser.entries[:-1], parser.entries[-1:]
+        yield from ready
+    parser.close()
+    yield from parser.entries
+
+
+JSON_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<punct>[{}\[\]:,])
+      | "(?P<string>(?:[^"\\]|\\.)*)"
+      | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+      | (?P<literal>true|false|null)
+    )''', re.VERBOSE | re.DOTALL)
+LITERALS = {'true': True, 'false': False, 'null': None}
+
+
+def json_tokens(stream):
+    """Yields the tokens of a JSON document read a chunk at a time: punctuation as itself, values as ('value', v)."""
+    buffer = ''
+    eof = False
+    position = 0
+    while True:
+        match = JSON_TOKEN.match(buffer, position)
+        # a token that runs into the end of the buffer may continue in the next chunk
+        if not eof and (match is None or match.end() == len(buffer)):
+            chunk = stream.read(READ_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        if match is None:
+            if buffer[position:].strip():
+                raise InvalidImportFile(f'invalid JSON near {buffer[position:position + 40]!r}')
+            return
+        position = match.end()
+        if match.group('punct'):
+            yield match.group('punct')
+        elif match.group('string') is not None:
+            yield ('value', json.loads(f'"{match.group("string")}"', strict=False))
+        elif match.group('number'):
+            yield ('value', json.loads(match.group('number')))
+        else:
+            yield ('value', LITERALS[match.group('literal')])
+
+
+def _json_walk(stream, folder_names):
+    """Walks the objects of a Chrome or Firefox bookmark export.
+
+    Yields ('folder', ordinal, name) when a folder closes and ('entry', Entry)
+    for every bookmark. Folders are numbered in document order. With
+    ``folder_names`` (ordinal -> name from a previous walk) entries get their
+    folders by name even where the name comes after the children, as in
+    Chrome exports.
+    """
+    stack = []  # one dict per open object or list
+    folder_count = 0
+    key = None
+    for token in json_tokens(stream):
+        if token == '{':
+            parent = stack[-1] if stack else None
+            stack.append({
+                'kind': 'object', 'fields': {}, 'folder': None,
+                # Chrome keeps its root folders in the object under "roots"
+                'roots': key == 'roots',
+                'root': bool(parent and parent.get('roots')),
+            })
+            key = None
+        elif token == '[':
+            if key == 'children' and stack:
+                stack[-1]['folder'] = folder_count
+                folder_count += 1
+            stack.append({'kind': 'array'})
+            key = None
+        elif token in ('}', ']'):
+            frame = stack.pop()
+            if frame['kind'] == 'object':
+                fields = frame['fields']
+                if frame['folder'] is not None:
+                    if frame['root'] or 'root' in fields:
+                        name = None
+                    else:
+                        name = fields.get('name') or fields.get('title')
+                    yield ('folder', frame['folder'], name)
+                url = fields.get('url') or fields.get('uri')
+                if isinstance(url, str) and frame['folder'] is None:
+                    folders = tuple(
+                        folder_names.get(open_frame['folder'])
+                        for open_frame in stack
+                        if open_frame['kind'] == 'object' and open_frame['folder'] is not None
+                    )
+                    tags = [name.strip() for name in str(fields.get('tags') or '').split(',') if name.strip()]
+                    yield ('entry', Entry(
+                        str(fields.get('name') or fields.get('title') or ''),
+                        url,
+                        str(fields.get('description') or ''),
+                        tuple(name for name in folders if name) + tuple(tags),
+                    ))
+            key = None
+        elif token == ':':
+            pass
+        elif token == ',':
+            key = None
+        else:
+            value = token[1]
+            frame = stack[-1] if stack else None
+            if frame is None or frame['kind'] != 'object':
+                continue
+            if key is None:
+                key = value
+            else:
+                frame['fields'].setdefault(key, value)
+                key = None
+    if stack:
+        raise InvalidImportFile('the JSON document ends early')
+
+
+def parse_json(stream):
+    """Parses a JSON export in two streaming passes: folder names first, then the entries."""
+    names = {}
+    for event in _json_walk(stream, {}):
+        if event[0] == 'folder':
+            names[event[1]] = event[2]
+    stream.seek(0)
+    for event in _json_walk(stream, names):
+        if event[0] == 'entry':
+            yield event[1]
+
+
+def parse(stream):
+    """Picks the parser by the first character of the (seekable, text) stream."""
+    start = stream.read(512)
+    stream.seek(0)
+    if start.lstrip('\ufeff \t\r\n')[:1] in ('{', '['):
+        return parse_json(stream)
+    return parse_netscape(stream)
+
+
+class ImportResult:
+
+    def __init__(self):
+        self.read = 0
+        self.created = 0
+        self.skipped = 0
+
+    def __str__(self):
+        return f'{self.read} read, {self.created} created, {self.skipped} skipped'
+
+
+class BookmarkImporter:
+    """Inserts parsed entries for one user, ``chunk_size`` at a time."""
+
+    def __init__(self, user, chunk_size=1000, progress=None):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.result = ImportResult()
+        self.tags = dict(Tag.objects.filter(user=user).values_list('name', 'id'))
+
+    def run(self, entries):
+        chunk = []
+        for entry in entries:
+            self.result.read += 1
+            chunk.append(entry)
+            if len(chunk) == self.chunk_size:
+                self.insert(chunk)
+                chunk = []
+        if chunk:
+            self.insert(chunk)
+        return self.result
+
+    def insert(self, entries):
+        bookmarks = {}
+        for entry in entries:
+            url = entry.url.strip()
+            importable = len(url) <= URL_MAX_LENGTH and urlsplit(url).scheme.lower() in IMPORTED_SCHEMES
+            digest = url_hash(url) if importable else None
+            if digest is None or digest in bookmarks:
+                self.result.skipped += 1
+                continue
+            bookmark = Bookmark(
+                title=(entry.title or url)[:MAX_NAME_LEN],
+                descr=entry.descr.strip(),
+                url=url,
+                url_hash=digest,
+                user=self.user,
+            )
+            bookmark.folders = entry.folders
+            bookmarks[digest] = bookmark
+
+        with transaction.atomic():
+            existing = set(Bookmark.objects.filter(user=self.user, url_hash__in=list(bookmarks))
+                           .values_list('url_hash', flat=True))
+            self.result.skipped += len(existing)
+            new = [bookmark for digest, bookmark in bookmarks.items() if digest not in existing]
+            # ignore_conflicts covers a concurrent import of the same URLs
+            Bookmark.objects.bulk_create(new, ignore_conflicts=True)
+            ids = dict(Bookmark.objects.filter(user=self.user, url_hash__in=[b.url_hash for b in new])
+                       .values_list('url_hash', 'id'))
+            for bookmark in new:
+                bookmark.pk = ids.get(bookmark.url_hash)
+            tagged = self.add_tags(new)
+            counters.adjust(self.user.pk, bookmarks=len(new))
+            changes.record(self.user.pk, 'bookmark', [bookmark.pk for bookmark in new], changes.SAVE)
+            changes.record(self.user.pk, 'bookmark_tag', [pk for pk, _ in tagged], changes.ADD, [tag_id for _, tag_id in tagged])
+            search.index_objects(new)
+
+        self.result.created += len(new)
+        if self.progress:
+            self.progress(self.result)
+
+    def add_tags(self, bookmarks):
+        missing = {name[:MAX_NAME_LEN] for bookmark in bookmarks for name in bookmark.folders} - self.tags.keys()
+        if missing:
+            Tag.objects.bulk_create([Tag(name=name, user=self.user) for name in missing])
+            counters.adjust(self.user.pk, tags=len(missing))
+            created = dict(Tag.objects.filter(user=self.user, name__in=missing).values_list('name', 'id'))
+            changes.record(self.user.pk, 'tag', list(created.values()), changes.SAVE)
+            self.tags.update(created)
+        tagged = [
+            (bookmark.pk, tag_id)
+            for bookmark in bookmarks
+            for tag_id in {self.tags[name[:MAX_NAME_LEN]] for name in bookmark.folders}
+        ]
+        Through = Bookmark.tags.through
+        Through.objects.bulk_create([Through(bookmark_id=pk, tag_id=tag_id) for pk, tag_id in tagged], ignore_conflicts=True)
+        return tagged
+
+
+def import_bookmarks(user, file, chunk_size=1000, progress=None):
+    """Imports a bookmark export from a binary (e.g. uploaded) file; returns an ImportResult."""
+    stream = io.TextIOWrapper(file, encoding='utf-8', errors='replace')
+    try:
+        result = BookmarkImporter(user, chunk_size, progress).run(parse(stream))
+    finally:
+        stream.detach()
+        # the chunks count every bookmark they insert, but bulk_create(ignore_conflicts=True) does not
+        # tell which ones a concurrent import of the same URLs got to first
+        counters.recount(user.pk)
+    logger.info('imported bookmarks for %s: %s', user, result)
+    return result
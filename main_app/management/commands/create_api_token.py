@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.models import ApiToken
+
+
+class Command(BaseCommand):
+    help = 'Issues a JSON API token for a user and prints its key, which is not stored'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--name', default='', help='What the token is for')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'no user named {options["username"]!r}')
+        token, key = ApiToken.issue(user, options['name'])
+        self.stdout.write(key)
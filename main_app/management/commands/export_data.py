@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app import exporters
+
+
+class Command(BaseCommand):
+    help = "Streams a user's bookmarks, tasks or tags as CSV or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('kind', choices=exporters.KINDS)
+        parser.add_argument('--format', choices=list(exporters.FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write to (default: standard output)')
+        parser.add_argument('--chunk-size', type=int, default=exporters.CHUNK_SIZE, help='Rows read per query')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'no user named {options["username"]!r}')
+        lines = exporters.export_lines(user, options['kind'], options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.importers import InvalidImportFile, import_bookmarks
+
+
+class Command(BaseCommand):
+    help = 'Imports a browser bookmark export (Netscape HTML or Chrome/Firefox JSON) for a user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('file')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Bookmarks inserted per batch')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'no user named {options["username"]!r}')
+        with open(options['file'], 'rb') as file:
+            try:
+                result = import_bookmarks(
+                    user, file, options['chunk_size'],
+                    progress=lambda progress: self.stdout.write(str(progress)),
+                )
+            except InvalidImportFile as e:
+                raise CommandError(str(e))
+        self.stdout.write(f'done: {result}')
@@ -0,0 +1,17 @@
+import datetime
+import json
+
+from django.core.management.base import BaseCommand
+
+from main_app.task_notifier import notifier_metrics
+
+
+class Command(BaseCommand):
+    help = 'Prints the task notifier backlog and the metrics of its recent runs as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=3600, help='Seconds of recent runs to summarize')
+
+    def handle(self, *args, **options):
+        metrics = notifier_metrics(datetime.timedelta(seconds=options['window']))
+        self.stdout.write(json.dumps(metrics, indent=2))
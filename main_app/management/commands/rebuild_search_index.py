@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from main_app import search
+from main_app.models import Bookmark, Task
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the search index of every bookmark and task with the configured backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Objects indexed per batch')
+
+    def handle(self, *args, **options):
+        search.clear_index()
+        total = 0
+        for model in (Bookmark, Task):
+            chunk = []
+            for obj in model.objects.exclude(user=None).order_by('pk').iterator(chunk_size=options['chunk_size']):
+                chunk.append(obj)
+                if len(chunk) == options['chunk_size']:
+                    search.index_objects(chunk)
+                    total += len(chunk)
+                    chunk = []
+            search.index_objects(chunk)
+            total += len(chunk)
+        self.stdout.write(f'indexed {total} objects with the {search.get_backend().name} backend')
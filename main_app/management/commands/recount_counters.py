@@ -0,0 +1,15 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from main_app.counters import recount
+
+
+class Command(BaseCommand):
+    help = "Rebuilds every user's bookmark, task and tag counters from full counts"
+
+    def handle(self, *args, **options):
+        total = 0
+        for user_id in User.objects.values_list('pk', flat=True).iterator():
+            recount(user_id)
+            total += 1
+        self.stdout.write(f'recounted {total} users')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from main_app.models import Task
+from main_app.task_notifier import TaskScheduler, get_listener
+
+
+class Command(BaseCommand):
+    help = 'Queues the reminders of due tasks and delivers them from the notification outbox'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Task notifier started')
+        TaskScheduler(Task, listener=get_listener()).run()
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0015_task_claim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'بانتظار الإرسال'), ('sent', 'أرسل'), ('dead', 'فشل')], default='pending', max_length=10, verbose_name='الحالة')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='المحاولات')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('claim_token', models.UUIDField(blank=True, editable=False, null=True)),
+                ('claimed_until', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='main_app.task')),
+            ],
+            options={
+                'ordering': ['available_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.16 on 2026-10-18 11:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0016_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotifierRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField(db_index=True)),
+                ('duration', models.FloatField(help_text='seconds')),
+                ('queued', models.PositiveIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('lag_avg', models.FloatField(blank=True, null=True)),
+                ('lag_max', models.FloatField(blank=True, null=True)),
+                ('backlog', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started'],
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 3.2.16 on 2026-10-18 11:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# must match main_app.search.PG_VECTOR so that the planner uses the index
+PG_VECTOR = "setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', body), 'B')"
+
+
+def create_fulltext_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX searchdocument_vector_idx ON main_app_searchdocument USING GIN (({PG_VECTOR}))')
+    elif connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE main_app_search_fts USING fts5(title, body, user_id UNINDEXED, tokenize='unicode61')"
+            )
+        except Exception:
+            pass  # SQLite built without FTS5, search falls back to the token index
+
+
+def drop_fulltext_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS searchdocument_vector_idx')
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS main_app_search_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main_app', '0018_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('bookmark', 'إشارة مرجعية'), ('task', 'مهمة')], max_length=8)),
+                ('object_id', models.PositiveIntegerField()),
+                ('title', models.TextField()),
+                ('body', models.TextField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='main_app.searchdocument')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['user', 'term'], name='searchtoken_user_term_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchdocument',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='searchdocument_object_uniq'),
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
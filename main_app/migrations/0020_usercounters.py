@@ -0,0 +1,26 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('main_app', '0019_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCounters',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to='auth.user')),
+                ('bookmarks', models.IntegerField(default=0)),
+                ('tasks', models.IntegerField(default=0)),
+                ('tags', models.IntegerField(default=0)),
+                ('overdue', models.IntegerField(default=0)),
+                ('pending_reminders', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:08
+
+from django.db import migrations, models
+import main_app.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0020_usercounters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercounters',
+            name='version',
+            field=models.BigIntegerField(default=main_app.models.initial_data_version),
+        ),
+    ]
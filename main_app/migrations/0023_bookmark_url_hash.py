@@ -0,0 +1,110 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:12
+
+import hashlib
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.db import migrations, models
+
+# copies of main_app.models.normalize_url() and url_hash() as they were when this migration was written
+TRACKING_PARAM = re.compile(r'^(utm_\w+|fbclid|gclid|dclid|msclkid|yclid|igshid|mc_cid|mc_eid|_ga)$', re.IGNORECASE)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+FTS_TABLE = 'main_app_search_fts'
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f'[{host}]'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{port}'
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f'{parts.username}:{parts.password}'
+        host = f'{userinfo}@{host}'
+    if scheme == 'http':
+        scheme = 'https'
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                             if not TRACKING_PARAM.match(key)))
+    return urlunsplit((scheme, host, parts.path.rstrip('/'), query, parts.fragment))
+
+
+def url_hash(url):
+    if not url or not url.strip():
+        return None
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+
+def backfill_url_hashes(apps, schema_editor):
+    # the oldest bookmark of each URL keeps it, later duplicates are merged into it
+    Bookmark = apps.get_model('main_app', 'Bookmark')
+    kept = {}
+    duplicates = {}  # duplicate id -> id of the bookmark kept
+    users = set()
+    batch = []
+    for bookmark in Bookmark.objects.order_by('id').only('id', 'user_id', 'url').iterator(chunk_size=1000):
+        key = (bookmark.user_id, url_hash(bookmark.url))
+        if key[1] is None:
+            continue
+        # bookmarks without a user never conflict: NULLs are distinct in the constraint
+        if key in kept and key[0] is not None:
+            duplicates[bookmark.id] = kept[key]
+            users.add(key[0])
+            continue
+        kept[key] = bookmark.id
+        bookmark.url_hash = key[1]
+        batch.append(bookmark)
+        if len(batch) == 1000:
+            Bookmark.objects.bulk_update(batch, ['url_hash'])
+            batch = []
+    Bookmark.objects.bulk_update(batch, ['url_hash'])
+    merge_duplicates(apps, schema_editor, duplicates, users)
+
+
+def merge_duplicates(apps, schema_editor, duplicates, users):
+    """Moves the tags of each duplicate bookmark to the one kept, then deletes the duplicate and its search document."""
+    Bookmark = apps.get_model('main_app', 'Bookmark')
+    SearchDocument = apps.get_model('main_app', 'SearchDocument')
+    UserCounters = apps.get_model('main_app', 'UserCounters')
+    Through = Bookmark.tags.through
+    connection = schema_editor.connection
+    fts = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    ids = list(duplicates)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        tagged = Through.objects.filter(bookmark_id__in=chunk).values_list('bookmark_id', 'tag_id')
+        Through.objects.bulk_create([Through(bookmark_id=duplicates[pk], tag_id=tag_id) for pk, tag_id in tagged],
+                                    ignore_conflicts=True)
+        documents = list(SearchDocument.objects.filter(kind='bookmark', object_id__in=chunk).values_list('id', flat=True))
+        if fts and documents:
+            with connection.cursor() as cursor:
+                cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in documents])
+        SearchDocument.objects.filter(id__in=documents).delete()
+        Bookmark.objects.filter(id__in=chunk).delete()
+    # recounted from scratch, with a new version, on their next request
+    UserCounters.objects.filter(user_id__in=users).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0022_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookmark',
+            name='url_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_url_hashes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='bookmark',
+            constraint=models.UniqueConstraint(fields=('user', 'url_hash'), name='bookmark_user_url_uniq'),
+        ),
+    ]
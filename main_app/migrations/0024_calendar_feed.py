@@ -0,0 +1,29 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+import main_app.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('main_app', '0023_bookmark_url_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarFeed',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='calendar_feed', serialize=False, to='auth.user')),
+                ('token', models.CharField(default=main_app.models.new_feed_token, max_length=64, unique=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='usercounters',
+            name='task_version',
+            field=models.BigIntegerField(default=main_app.models.initial_data_version),
+        ),
+    ]
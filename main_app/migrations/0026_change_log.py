@@ -0,0 +1,32 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main_app', '0025_api_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('bookmark', 'bookmark'), ('task', 'task'), ('tag', 'tag'), ('bookmark_tag', 'bookmark tag'), ('task_tag', 'task tag')], max_length=12)),
+                ('object_id', models.IntegerField()),
+                ('tag_id', models.IntegerField(null=True)),
+                ('action', models.CharField(choices=[('save', 'save'), ('delete', 'delete'), ('add', 'add'), ('remove', 'remove')], max_length=6)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['user', 'id'], name='change_user_seq_idx'),
+        ),
+    ]
@@ -1,3 +1,9 @@
+import hashlib
+import re
+import secrets
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.urls import reverse
@@ -10,9 +16,13 @@ MAX_NAME_LEN = 255
 class Tag(models.Model):
     name = models.CharField(verbose_name='اسم', max_length=MAX_NAME_LEN)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    updated = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['user', 'name'], name='tag_user_name_idx'),
+        ]
 
     def get_absolute_url(self):
         return reverse('tag-detail', args=[str(self.id)])
@@ -21,17 +31,73 @@ class Tag(models.Model):
         return self.name
 
 
+# query parameters that only track where a link was clicked
+TRACKING_PARAM = re.compile(r'^(utm_\w+|fbclid|gclid|dclid|msclkid|yclid|igshid|mc_cid|mc_eid|_ga)$', re.IGNORECASE)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """Canonical form of a URL for deduplication.
+
+    The scheme and host are lowercased, http is treated as https, and default
+    ports, trailing slashes and tracking parameters are dropped. The remaining
+    query parameters are sorted.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f'[{host}]'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{port}'
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f'{parts.username}:{parts.password}'
+        host = f'{userinfo}@{host}'
+    if scheme == 'http':
+        scheme = 'https'
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                             if not TRACKING_PARAM.match(key)))
+    return urlunsplit((scheme, host, parts.path.rstrip('/'), query, parts.fragment))
+
+
+def url_hash(url):
+    """SHA-256 of the normalized URL, or None for an empty one."""
+    if not url or not url.strip():
+        return None
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+
 class Bookmark(models.Model):
 
     title = models.CharField(verbose_name='عنوان', max_length=MAX_NAME_LEN)
     descr = models.TextField(verbose_name='وصف')
     url = models.URLField(verbose_name='رابط')
+    # identifies the bookmark's URL up to normalization, see url_hash()
+    url_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
     tags = models.ManyToManyField(Tag, verbose_name='وسوم', blank=True)
     created = models.DateTimeField(null=True, auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['user', 'title'], name='bookmark_user_title_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'url_hash'], name='bookmark_user_url_uniq'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.url_hash = url_hash(self.url)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'url' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'url_hash'}
+        super().save(*args, **kwargs)
 
     def get_absolute_url(self):
         return reverse('bookmark-detail', args=[str(self.id)])
@@ -55,12 +121,28 @@ class Task(models.Model):
     priority = models.IntegerField(verbose_name='أولوية')
     tags = models.ManyToManyField(Tag, verbose_name='وسوم', blank=True)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     due_date = models.DateTimeField(validators=[ensure_future_date])
     notified = models.BooleanField(verbose_name='تم التنبيه', default=False)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    # lease taken by the notifier worker that is sending the task's reminder
+    claim_token = models.UUIDField(null=True, blank=True, editable=False)
+    claimed_until = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['due_date', 'priority']
+        indexes = [
+            models.Index(fields=['user', '-due_date', 'priority'], name='task_user_due_idx'),
+            # tasks whose reminder has not been queued yet, scanned by the notifier
+            models.Index(fields=['due_date'], condition=models.Q(notified=False), name='task_pending_due_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # lets the counters tell whether a save moved the task between pending and overdue
+        instance._loaded_notified = instance.__dict__.get('notified')
+        return instance
 
     def get_absolute_url(self):
         return reverse('task-detail', args=[str(self.id)])
@@ -68,3 +150,198 @@ class Task(models.Model):
     def __str__(self):
         return self.name
 
+
+
+class Notification(models.Model):
+    """A task reminder waiting in the outbox to be delivered by the notifier worker."""
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (PENDING, 'بانتظار الإرسال'),
+        (SENT, 'أرسل'),
+        (DEAD, 'فشل'),
+    ]
+
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='notifications')
+    status = models.CharField(verbose_name='الحالة', max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(verbose_name='المحاولات', default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # lease taken by the notifier worker that is delivering the notification
+    claim_token = models.UUIDField(null=True, blank=True, editable=False)
+    claimed_until = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ['available_at']
+        indexes = [
+            models.Index(fields=['available_at'], condition=models.Q(status='pending'), name='notification_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.task_id} ({self.status})'
+
+
+class NotifierRun(models.Model):
+    """Metrics of one run of the task notifier, kept for the notifier_stats command and endpoint."""
+
+    started = models.DateTimeField(db_index=True)
+    duration = models.FloatField(help_text='seconds')
+    queued = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # seconds between a task's due date and the delivery of its reminder
+    lag_avg = models.FloatField(null=True, blank=True)
+    lag_max = models.FloatField(null=True, blank=True)
+    backlog = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-started']
+
+    def __str__(self):
+        return f'{self.started}: {self.sent} sent, {self.failed} failed'
+
+
+def initial_data_version():
+    # time based, so that a rebuilt counters row never reuses the version of cached fragments
+    return time.time_ns() // 1000
+
+
+class UserCounters(models.Model):
+    """Per-user totals kept up to date by ``main_app.counters`` so that pages never need COUNT(*)."""
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='counters')
+    bookmarks = models.IntegerField(default=0)
+    tasks = models.IntegerField(default=0)
+    tags = models.IntegerField(default=0)
+    # tasks whose due date has come and whose reminder has been queued
+    overdue = models.IntegerField(default=0)
+    # tasks still waiting for their reminder
+    pending_reminders = models.IntegerField(default=0)
+    # bumped on every change to the user's data, keys their cached page fragments
+    version = models.BigIntegerField(default=initial_data_version)
+    # time of the last change to the user's data, including deletions
+    modified = models.DateTimeField(default=timezone.now)
+    # bumped on every change to the user's tasks, validates their calendar feed
+    task_version = models.BigIntegerField(default=initial_data_version)
+
+    def __str__(self):
+        return f'{self.user}: {self.bookmarks} bookmarks, {self.tasks} tasks, {self.tags} tags'
+
+
+def new_feed_token():
+    return secrets.token_urlsafe(32)
+
+
+class CalendarFeed(models.Model):
+    """The secret token in the URL of a user's task calendar, which calendar apps fetch without a session."""
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='calendar_feed')
+    token = models.CharField(max_length=64, unique=True, default=new_feed_token)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.user} calendar feed'
+
+
+def api_key_hash(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class ApiToken(models.Model):
+    """A key for scripted clients of the JSON API; only its hash is stored."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100, blank=True)
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def issue(cls, user, name=''):
+        """Creates a token and returns it with its key, which cannot be recovered later."""
+        key = secrets.token_urlsafe(32)
+        return cls.objects.create(user=user, name=name, key_hash=api_key_hash(key)), key
+
+    def __str__(self):
+        return f'{self.user}: {self.name or self.pk}'
+
+
+class Change(models.Model):
+    """One entry of a user's change log, see ``main_app.changes``; the id is the sync sequence."""
+
+    KIND_CHOICES = [
+        ('bookmark', 'bookmark'),
+        ('task', 'task'),
+        ('tag', 'tag'),
+        ('bookmark_tag', 'bookmark tag'),
+        ('task_tag', 'task tag'),
+    ]
+    ACTION_CHOICES = [
+        ('save', 'save'),
+        ('delete', 'delete'),
+        ('add', 'add'),
+        ('remove', 'remove'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    # the tag of a tag assignment
+    tag_id = models.IntegerField(null=True)
+    action = models.CharField(max_length=6, choices=ACTION_CHOICES)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='change_user_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.id}: {self.action} {self.kind} {self.object_id}'
+
+
+class SearchDocument(models.Model):
+    """The normalized text of a bookmark or task, as indexed by ``main_app.search``."""
+
+    BOOKMARK = 'bookmark'
+    TASK = 'task'
+    KIND_CHOICES = [
+        (BOOKMARK, 'إشارة مرجعية'),
+        (TASK, 'مهمة'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    # title/name, ranked above the rest of the text
+    title = models.TextField()
+    body = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='searchdocument_object_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
+
+
+class SearchToken(models.Model):
+    """One row of the inverted index: a normalized term of a search document."""
+
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='tokens')
+    # copied from the document so that a lookup is a single (user, term) index range
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    term = models.CharField(max_length=64)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'term'], name='searchtoken_user_term_idx'),
+        ]
+
+    def __str__(self):
+        return self.term
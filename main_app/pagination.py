@@ -0,0 +1,119 @@
+import base64
+import json
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _json_default(value):
+    # unlike DjangoJSONEncoder, keep full microsecond precision so that seeking is exact
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+class CountedPaginator(Paginator):
+    """A Paginator that is given its count, e.g. from the user's counters, instead of running COUNT(*)."""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count = count
+
+
+class KeysetPage:
+    """A page of a KeysetPaginator, with opaque cursors to its neighbours instead of page numbers."""
+
+    is_keyset = True
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class KeysetPaginator:
+    """Pages through a queryset by seeking past the last row of the previous page.
+
+    Rows are ordered by ``ordering`` with the primary key as a tiebreaker, and a
+    page is fetched with a WHERE on those keys instead of an OFFSET, so deep
+    pages cost the same as the first one and no COUNT(*) is needed.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keys = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        if self.keys[-1][0] not in ('id', 'pk'):
+            self.keys.append(('id', False))
+        self.fields = [queryset.model._meta.get_field(name) for name, _ in self.keys]
+
+    def _order_by(self, reverse):
+        return [f"{'-' if descending != reverse else ''}{name}" for name, descending in self.keys]
+
+    def _seek(self, values, reverse):
+        """Matches the rows that come after ``values``, or before them if ``reverse``."""
+        condition = Q()
+        for i, (name, descending) in enumerate(self.keys):
+            lookup = 'lt' if descending != reverse else 'gt'
+            ties = {previous: values[j] for j, (previous, _) in enumerate(self.keys[:i])}
+            condition |= Q(**ties, **{f'{name}__{lookup}': values[i]})
+        return condition
+
+    def _key(self, obj):
+        return [getattr(obj, field.attname) for field in self.fields]
+
+    def encode_cursor(self, direction, obj):
+        data = json.dumps([direction, self._key(obj)], default=_json_default)
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            direction, values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            if direction not in ('next', 'previous') or len(values) != len(self.fields):
+                raise ValueError(cursor)
+            return direction, [field.to_python(value) for field, value in zip(self.fields, values)]
+        except Exception as ex:
+            raise InvalidCursor(cursor) from ex
+
+    def page(self, cursor=None):
+        backwards = False
+        queryset = self.queryset
+        if cursor:
+            direction, values = self.decode_cursor(cursor)
+            backwards = direction == 'previous'
+            queryset = queryset.filter(self._seek(values, reverse=backwards))
+
+        rows = list(queryset.order_by(*self._order_by(backwards))[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, bool(cursor)
+
+        next_cursor = self.encode_cursor('next', rows[-1]) if has_next and rows else None
+        previous_cursor = self.encode_cursor('previous', rows[0]) if has_previous and rows else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
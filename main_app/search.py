@@ -0,0 +1,269 @@
+"""Per-user full-text search over bookmarks and tasks.
+
+Every bookmark and task has a SearchDocument holding its normalized text. The
+document is kept up to date by signals and indexed by one of three backends:
+a GIN expression index on PostgreSQL, an FTS5 table on SQLite, or an inverted
+index of SearchToken rows that works on any database. SEARCH_BACKEND chooses
+one explicitly, and 'auto' picks the best that is available. After switching
+backends, run ``manage.py rebuild_search_index``.
+"""
+import re
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, transaction
+
+
+# harakat, Quranic annotation marks, superscript alef and tatweel
+TASHKEEL = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+})
+WORD = re.compile(r'\w+')
+MAX_TERM_LEN = 64
+TITLE_WEIGHT = 3
+
+# must match PG_VECTOR in migration 0019 so that the planner uses the index
+PG_VECTOR = "setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', body), 'B')"
+FTS_TABLE = 'main_app_search_fts'
+
+
+def normalize(text):
+    """Strips tashkeel, unifies alef/hamza, ta marbuta and ya variants, and casefolds."""
+    return TASHKEEL.sub('', text).translate(LETTERS).casefold()
+
+
+def tokenize(text):
+    return [term[:MAX_TERM_LEN] for term in WORD.findall(normalize(text))]
+
+
+def _fields(obj):
+    from .models import SearchDocument, Task
+
+    if isinstance(obj, Task):
+        return SearchDocument.TASK, obj.name, [obj.descr]
+    return SearchDocument.BOOKMARK, obj.title, [obj.descr, obj.url]
+
+
+def make_document(obj):
+    from .models import SearchDocument
+
+    kind, title, rest = _fields(obj)
+    return SearchDocument(
+        user_id=obj.user_id,
+        kind=kind,
+        object_id=obj.pk,
+        title=' '.join(tokenize(title)),
+        body=' '.join(term for text in rest for term in tokenize(text)),
+    )
+
+
+class TokenBackend:
+    """Inverted index in the SearchToken table; ranks by summed term weights."""
+
+    name = 'tokens'
+
+    def index(self, documents):
+        from .models import SearchToken
+
+        tokens = []
+        for document in documents:
+            weights = Counter(document.body.split())
+            for term in document.title.split():
+                weights[term] += TITLE_WEIGHT
+            tokens.extend(
+                SearchToken(document=document, user_id=document.user_id, term=term, weight=weight)
+                for term, weight in weights.items()
+            )
+        SearchToken.objects.bulk_create(tokens, batch_size=1000)
+
+    def remove(self, document_ids):
+        pass  # tokens go with their documents
+
+    def clear(self):
+        from .models import SearchToken
+
+        SearchToken.objects.all().delete()
+
+    def search(self, user, terms, limit):
+        from django.db.models import Count, Sum
+        from .models import SearchToken
+
+        rows = (
+            SearchToken.objects.filter(user=user, term__in=terms)
+            .values('document')
+            .annotate(score=Sum('weight'), matched=Count('term', distinct=True))
+            .filter(matched=len(terms))
+            .order_by('-score', '-document')[:limit]
+        )
+        return [(row['document'], row['score']) for row in rows]
+
+
+class FTS5Backend:
+    """SQLite FTS5 table keyed by the document id, ranked with bm25."""
+
+    name = 'fts5'
+
+    def index(self, documents):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, title, body, user_id) VALUES (%s, %s, %s, %s)',
+                [(document.id, document.title, document.body, document.user_id) for document in documents],
+            )
+
+    def remove(self, document_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in document_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    def search(self, user, terms, limit):
+        match = ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, bm25({FTS_TABLE}, {TITLE_WEIGHT}.0, 1.0) AS rank FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s AND user_id = %s ORDER BY rank, rowid DESC LIMIT %s',
+                [match, user.pk, limit],
+            )
+            return [(pk, -rank) for pk, rank in cursor.fetchall()]
+
+
+class PostgresBackend:
+    """PostgreSQL full text search over a GIN index on the document's weighted tsvector."""
+
+    name = 'postgres'
+
+    def index(self, documents):
+        pass  # the expression index follows the document rows
+
+    def remove(self, document_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, user, terms, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id, ts_rank({PG_VECTOR}, query) AS rank "
+                f"FROM main_app_searchdocument, plainto_tsquery('simple', %s) query "
+                f"WHERE user_id = %s AND {PG_VECTOR} @@ query ORDER BY rank DESC, id DESC LIMIT %s",
+                [' '.join(terms), user.pk, limit],
+            )
+            return cursor.fetchall()
+
+
+BACKENDS = {backend.name: backend for backend in (TokenBackend, FTS5Backend, PostgresBackend)}
+
+
+@lru_cache(maxsize=None)
+def _backend(name, vendor, database):
+    if name != 'auto':
+        return BACKENDS[name]()
+    if vendor == 'postgresql':
+        return PostgresBackend()
+    if vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+        return FTS5Backend()
+    return TokenBackend()
+
+
+def get_backend():
+    return _backend(settings.SEARCH_BACKEND, connection.vendor, connection.settings_dict['NAME'])
+
+
+def index_objects(objects):
+    """(Re)indexes bookmarks and tasks in bulk; objects without a user are skipped."""
+    from .models import SearchDocument
+
+    documents = [make_document(obj) for obj in objects if obj.user_id is not None]
+    if not documents:
+        return
+    backend = get_backend()
+    with transaction.atomic():
+        by_kind = {}
+        for document in documents:
+            by_kind.setdefault(document.kind, []).append(document.object_id)
+        for kind, ids in by_kind.items():
+            _delete_documents(backend, SearchDocument.objects.filter(kind=kind, object_id__in=ids))
+        SearchDocument.objects.bulk_create(documents, batch_size=1000)
+        if documents[0].pk is None:
+            # only PostgreSQL returns the ids of bulk inserted rows
+            ids = {}
+            for kind, object_ids in by_kind.items():
+                for pk, object_id in SearchDocument.objects.filter(kind=kind, object_id__in=object_ids).values_list('id', 'object_id'):
+                    ids[(kind, object_id)] = pk
+            for document in documents:
+                document.pk = ids[(document.kind, document.object_id)]
+        backend.index(documents)
+
+
+def clear_index():
+    """Drops every search document, e.g. before a rebuild or after switching backends."""
+    from .models import SearchDocument
+
+    with transaction.atomic():
+        for backend in (get_backend(), TokenBackend()):
+            backend.clear()
+        # no per-row cascade: the tokens are already gone
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SearchDocument._meta.db_table}')
+
+
+def remove_objects(objects):
+    from .models import SearchDocument, Task
+
+    by_kind = {}
+    for obj in objects:
+        kind = SearchDocument.TASK if isinstance(obj, Task) else SearchDocument.BOOKMARK
+        by_kind.setdefault(kind, []).append(obj.pk)
+    for kind, ids in by_kind.items():
+        _delete_documents(get_backend(), SearchDocument.objects.filter(kind=kind, object_id__in=ids))
+
+
+def remove_user(user):
+    """Drops a user's documents before the user is deleted: the cascade would not reach the FTS5 table."""
+    from .models import SearchDocument
+
+    _delete_documents(get_backend(), SearchDocument.objects.filter(user=user))
+
+
+def _delete_documents(backend, queryset):
+    ids = list(queryset.values_list('id', flat=True))
+    if ids:
+        backend.remove(ids)
+        queryset.model.objects.filter(id__in=ids).delete()
+
+
+def search(user, query, limit=50):
+    """Returns the user's bookmarks and tasks matching every term of ``query``, best first."""
+    from .models import Bookmark, SearchDocument, Task
+
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+    ranked = get_backend().search(user, terms, limit)
+    documents = SearchDocument.objects.in_bulk([pk for pk, _ in ranked])
+
+    wanted = {SearchDocument.BOOKMARK: [], SearchDocument.TASK: []}
+    for document in documents.values():
+        wanted[document.kind].append(document.object_id)
+    objects = {
+        SearchDocument.BOOKMARK: Bookmark.objects.filter(user=user).in_bulk(wanted[SearchDocument.BOOKMARK]),
+        SearchDocument.TASK: Task.objects.filter(user=user).in_bulk(wanted[SearchDocument.TASK]),
+    }
+
+    results = []
+    for pk, score in ranked:
+        document = documents.get(pk)
+        obj = document and objects[document.kind].get(document.object_id)
+        if obj is not None:
+            obj.search_score = score
+            obj.search_kind = document.get_kind_display()
+            results.append(obj)
+    return results
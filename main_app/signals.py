@@ -0,0 +1,99 @@
+import copy
+
+from django.db import transaction
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from . import changes, counters, search, task_notifier
+from .models import Bookmark, Tag, Task
+
+
+@receiver(post_save, sender=Task)
+def rearm_task_notifier(sender, instance, using, **kwargs):
+    # once committed: a scheduler that loads the task any sooner would not see it, or see it rolled back
+    task = copy.copy(instance)
+    transaction.on_commit(lambda: task_notifier.task_changed(task), using=using)
+
+
+@receiver(post_delete, sender=Task)
+def disarm_task_notifier(sender, instance, using, **kwargs):
+    # a copy, since delete() clears the instance's pk before the commit
+    task = copy.copy(instance)
+    transaction.on_commit(lambda: task_notifier.task_deleted(task), using=using)
+
+
+@receiver(post_save, sender=Bookmark)
+@receiver(post_save, sender=Task)
+def update_search_index(sender, instance, **kwargs):
+    search.index_objects([instance])
+
+
+@receiver(post_delete, sender=Bookmark)
+@receiver(post_delete, sender=Task)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_objects([instance])
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_from_search_index(sender, instance, **kwargs):
+    search.remove_user(instance)
+
+
+@receiver(post_save, sender=Bookmark)
+@receiver(post_save, sender=Tag)
+def count_saved(sender, instance, created, **kwargs):
+    counters.adjust(instance.user_id, **{f'{sender._meta.model_name}s': int(created)})
+
+
+@receiver(post_delete, sender=Bookmark)
+@receiver(post_delete, sender=Tag)
+def count_deleted(sender, instance, **kwargs):
+    counters.adjust(instance.user_id, **{f'{sender._meta.model_name}s': -1})
+
+
+@receiver(post_save, sender=Task)
+def count_task_saved(sender, instance, created, **kwargs):
+    counters.task_saved(instance, created)
+
+
+@receiver(post_delete, sender=Task)
+def count_task_deleted(sender, instance, **kwargs):
+    counters.task_deleted(instance)
+
+
+@receiver(m2m_changed, sender=Bookmark.tags.through)
+@receiver(m2m_changed, sender=Task.tags.through)
+def bump_data_version(sender, instance, action, **kwargs):
+    # instance is the bookmark or task, or the tag for reverse changes: both belong to the user
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        counters.adjust(instance.user_id)
+
+
+# the change log receivers come last: they must run after the counters are adjusted, see main_app.changes
+
+@receiver(post_save, sender=Bookmark)
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=Tag)
+def log_saved(sender, instance, **kwargs):
+    changes.record(instance.user_id, sender._meta.model_name, [instance.pk], changes.SAVE)
+
+
+@receiver(post_delete, sender=Bookmark)
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=Tag)
+def log_deleted(sender, instance, **kwargs):
+    changes.record(instance.user_id, sender._meta.model_name, [instance.pk], changes.DELETE)
+
+
+@receiver(m2m_changed, sender=Bookmark.tags.through)
+@receiver(m2m_changed, sender=Task.tags.through)
+def log_tagging(sender, instance, action, model, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # post_clear does not say what was cleared
+        field = 'tags' if isinstance(instance, (Bookmark, Task)) else f'{model._meta.model_name}_set'
+        instance._cleared_pks = set(getattr(instance, field).values_list('pk', flat=True))
+    elif action == 'post_clear':
+        changes.record_tagging(instance, model, instance._cleared_pks, changes.REMOVE)
+    elif action in ('post_add', 'post_remove') and pk_set:
+        changes.record_tagging(instance, model, pk_set, changes.ADD if action == 'post_add' else changes.REMOVE)
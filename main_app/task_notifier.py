@@ -1,67 +1,495 @@
-import sys, datetime, threading, json
+import datetime, functools, logging, threading, heapq, select, time, uuid
 
 from django.utils import timezone
+from django.db import connections, transaction
+from django.db.models import Avg, Count, F, Max, Min, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
 from django.conf import settings
-from django.core.mail import send_mail
-from django.template import loader
+from django.core.mail import EmailMultiAlternatives
+from django.template import Context, loader
 
-import requests
+from . import changes, counters
+from .dispatchers import get_dispatcher
 
-def send_email_via_trustifi(subject, html_body, recipient):
+logger = logging.getLogger(__name__)
 
-    payload = {
-        "recipients": [
-            {
-                "email": recipient
-            }
-        ],
-        "title": subject,
-        "html": html_body,
-    }
+# PostgreSQL NOTIFY channel on which task changes are published to notifier schedulers
+TASK_CHANNEL = 'minzam_tasks'
+
+
+def claim_rows(queryset, limit, lease):
+    """Claims up to ``limit`` rows of ``queryset`` for this worker.
+
+    A claim is a lease stamped on the claim_token and claimed_until columns,
+    and rows whose lease has run out can be claimed again. Where the database
+    supports SKIP LOCKED (PostgreSQL) concurrent workers lock disjoint rows;
+    elsewhere (SQLite) a single UPDATE ... WHERE id IN (SELECT ... LIMIT)
+    statement decides which worker gets which rows.
+
+    Returns the claim token and the ids of the claimed rows.
+    """
+    model = queryset.model
+    now = timezone.now()
+    token = uuid.uuid4()
+    unclaimed = Q(claimed_until__isnull=True) | Q(claimed_until__lte=now)
+    candidates = queryset.filter(unclaimed).values('id')[:limit]
+    claim = {'claim_token': token, 'claimed_until': now + lease}
+
+    if connections[queryset.db].features.has_select_for_update_skip_locked:
+        with transaction.atomic(using=queryset.db):
+            ids = [row['id'] for row in candidates.select_for_update(skip_locked=True)]
+            model.objects.filter(pk__in=ids).update(**claim)
+        return token, ids
+
+    model.objects.filter(unclaimed, pk__in=Subquery(candidates)).update(**claim)
+    return token, list(model.objects.filter(claim_token=token).values_list('id', flat=True))
+
+
+def claim_groups(queryset, token, ids, lease, field):
+    """Extends the claim ``token`` on ``ids`` to the unclaimed rows of ``queryset`` with the same ``field`` values.
+
+    This keeps groups of rows, such as one user's reminders, from being split
+    between batches or workers. The UPDATE only takes rows that are still
+    unclaimed, so it never steals another worker's claim.
+
+    Returns the ids of all the rows claimed with ``token``.
+    """
+    model = queryset.model
+    now = timezone.now()
+    unclaimed = Q(claimed_until__isnull=True) | Q(claimed_until__lte=now)
+    groups = model.objects.filter(pk__in=ids).values(field)
+    rest = queryset.filter(unclaimed, **{f'{field}__in': Subquery(groups)}).order_by().values('id')
+    model.objects.filter(unclaimed, pk__in=Subquery(rest)).update(claim_token=token, claimed_until=now + lease)
+    return list(model.objects.filter(claim_token=token).values_list('id', flat=True))
+
+
+def digest_windows(Task, Notification, task_ids, now):
+    """Maps the given tasks to the time their reminders should go out in digest mode.
+
+    The first reminder of a user opens a window of NOTIFICATION_DIGEST_WINDOW
+    seconds, and reminders queued for the same user before it closes join it,
+    so they all go out in one email.
+    """
+    users = dict(Task.objects.filter(pk__in=task_ids).values_list('id', 'user_id'))
+    open_windows = dict(Notification.objects.filter(status=Notification.PENDING, attempts=0, claim_token__isnull=True,
+                                                    task__user_id__in=set(users.values()))
+                                            .values_list('task__user_id')
+                                            .annotate(Min('available_at')))
+    window_end = now + datetime.timedelta(seconds=settings.NOTIFICATION_DIGEST_WINDOW)
+    return {task_id: open_windows.get(user_id, window_end) for task_id, user_id in users.items()}
+
+
+def enqueue_due_tasks(Task, now, batch_size, lease=None):
+    """Moves the tasks due by ``now`` into the notification outbox.
+
+    Each batch is claimed, queued and marked as notified in one transaction, so
+    a crash can neither lose a reminder nor queue it twice.
+    """
+    from .models import Notification
+
+    lease = lease or datetime.timedelta(seconds=settings.TASK_NOTIFIER_LEASE)
+    due = Task.objects.filter(notified=False, due_date__lte=now).order_by('due_date', 'id')
+    queued = 0
+    while True:
+        with transaction.atomic():
+            _, ids = claim_rows(due, batch_size, lease)
+            if not ids:
+                return queued
+            available_at = digest_windows(Task, Notification, ids, now) if settings.NOTIFICATION_DIGEST_WINDOW else {}
+            Notification.objects.bulk_create([Notification(task_id=task_id, available_at=available_at.get(task_id, now))
+                                              for task_id in ids])
+            Task.objects.filter(pk__in=ids).update(notified=True, claim_token=None, claimed_until=None, updated=now)
+            counters.tasks_notified(Task, ids)
+            changes.tasks_saved(Task, ids)
+        queued += len(ids)
+
+
+@functools.lru_cache(maxsize=None)
+def notification_templates():
+    """Loads and compiles the text and HTML notification templates once per process."""
+    return tuple(loader.get_template(name).template
+                 for name in ('task_notification_body.txt', 'task_notification_body.html'))
 
-    headers = {
-    'x-trustifi-key': settings.TRUSTIFI_KEY,
-    'x-trustifi-secret': settings.TRUSTIFI_SECRET,
-    'Content-Type': 'application/json'
-    }
 
-    response = requests.request('POST', 'https://be.trustifi.com/api/i/v1/email', headers = headers, data = json.dumps(payload))
-    print(response.json())
+class MessageBuilder:
+    """Builds reminder emails from the precompiled notification templates.
 
+    One builder is meant to be reused for a whole drain: its template context is
+    set up once and each message only pushes its own variables onto it.
+    """
 
-def send_task_notifications(Task):
-    domain = settings.BASE_URL
+    def __init__(self, domain):
+        self.domain = domain
+        self.text_template, self.html_template = notification_templates()
+        self.context = Context(autoescape=True)
 
-    for task in Task.objects.filter(notified=False, due_date__lte=timezone.now()):
-        url = f"{domain}{task.get_absolute_url()}"
-        subject = f'منظام - حان آوان مهمتك "{task.name}"'
-        context = {'task_name': task.name, 'task_url': url}
-        text_body = loader.render_to_string('task_notification_body.txt', context)
-        html_body = loader.render_to_string('task_notification_body.html', context)
-        recipient = task.user.email
-        print(f'- sending email to "{task.user.email}" about task "{task.name}"')
-        if settings.USE_TRUSTIFI:
-            send_email_via_trustifi(subject, html_body, recipient)
+    def render(self, context):
+        with self.context.push(context):
+            return self.text_template.render(self.context), self.html_template.render(self.context)
+
+    def build(self, tasks):
+        """Builds the reminder email of one or more tasks of the same user."""
+        context = {'tasks': [{'name': task.name, 'url': f"{self.domain}{task.get_absolute_url()}"} for task in tasks]}
+        if len(tasks) == 1:
+            subject = f'منظام - حان آوان مهمتك "{tasks[0].name}"'
+            context.update(task_name=tasks[0].name, task_url=context['tasks'][0]['url'])
         else:
-            send_mail(subject, text_body, None, [recipient], fail_silently=False, html_message=html_body)
+            subject = f'منظام - حان آوان {len(tasks)} من مهامك'
+        text_body, html_body = self.render(context)
+        recipient = tasks[0].user.email
+        logger.debug('sending email to %r about tasks %s', recipient, ', '.join(repr(task.name) for task in tasks))
+        message = EmailMultiAlternatives(subject, text_body, None, [recipient])
+        message.attach_alternative(html_body, 'text/html')
+        return message
 
-        task.notified = True
-        task.save()
 
+def group_by_user(notifications):
+    groups = {}
+    for notification in notifications:
+        groups.setdefault(notification.task.user_id, []).append(notification)
+    return list(groups.values())
+
+
+def record_failures(Notification, notifications, now):
+    """Schedules failed notifications for a retry with exponential backoff, or dead-letters them."""
+    by_attempts = {}
+    for notification in notifications:
+        by_attempts.setdefault(notification.attempts + 1, []).append(notification.id)
+    for attempts, ids in by_attempts.items():
+        fields = {'attempts': attempts, 'claim_token': None, 'claimed_until': None}
+        if attempts >= settings.NOTIFICATION_MAX_ATTEMPTS:
+            fields['status'] = Notification.DEAD
+        else:
+            fields['available_at'] = now + datetime.timedelta(seconds=settings.NOTIFICATION_RETRY_DELAY * 2 ** (attempts - 1))
+        Notification.objects.filter(pk__in=ids).update(**fields)
 
-def run_task_notifier():
-    from .models import Task
 
-    exit = threading.Event()
+def drain_outbox(batch_size, lease=None, lags=None):
+    """Delivers the pending notifications of the outbox and returns how many were sent and how many failed.
 
-    def notify():
+    The delivery lag of every sent notification, in seconds past its task's due
+    date, is appended to ``lags`` if given.
+    """
+    from .models import Notification
+
+    builder = MessageBuilder(settings.BASE_URL)
+    lease = lease or datetime.timedelta(seconds=settings.TASK_NOTIFIER_LEASE)
+    now = timezone.now()
+    pending = (Notification.objects.filter(status=Notification.PENDING, available_at__lte=now)
+                                   .order_by('available_at', 'task__user_id', 'id'))
+    sent = failed = 0
+
+    with get_dispatcher() as dispatcher:
         while True:
-            s = exit.wait(60)
-            if s:
+            token, ids = claim_rows(pending, batch_size, lease)
+            if not ids:
                 break
-            exit.clear()
-            print(f"{datetime.datetime.now()}: sending task notifications", file=sys.stderr)
-            send_task_notifications(Task)
+            if settings.NOTIFICATION_DIGEST_WINDOW:
+                # a user's digest goes out whole, even when it runs past the end of the batch
+                ids = claim_groups(pending, token, ids, lease, 'task__user_id')
+            batch = list(Notification.objects.filter(pk__in=ids)
+                                             .select_related('task__user')
+                                             .only('attempts', 'task__name', 'task__due_date', 'task__user__email')
+                                             .order_by('available_at', 'task__user_id', 'id'))
+            # reminders of tasks whose user is gone have nobody to go to
+            orphaned = [notification.id for notification in batch if notification.task.user is None]
+            Notification.objects.filter(pk__in=orphaned).update(status=Notification.DEAD, claim_token=None, claimed_until=None)
+            batch = [notification for notification in batch if notification.task.user is not None]
+
+            if settings.NOTIFICATION_DIGEST_WINDOW:
+                groups = group_by_user(batch)
+            else:
+                groups = [[notification] for notification in batch]
+            delivered = dispatcher.send([builder.build([notification.task for notification in group]) for group in groups])
+            sent_at = timezone.now()
+            done = [notification for group, ok in zip(groups, delivered) if ok for notification in group]
+            Notification.objects.filter(pk__in=[notification.id for notification in done]).update(
+                status=Notification.SENT, sent_at=sent_at, claim_token=None, claimed_until=None)
+            if lags is not None:
+                lags.extend((sent_at - notification.task.due_date).total_seconds() for notification in done)
+            record_failures(Notification, [notification for group, ok in zip(groups, delivered) if not ok for notification in group], now)
+            sent += len(done)
+            failed += len(batch) - len(done) + len(orphaned)
+
+    return sent, failed
+
+
+def next_outbox_retry():
+    """Returns when the earliest pending notification can be (re)tried, or None if the outbox is empty."""
+    from .models import Notification
+
+    ready_at = Greatest('available_at', Coalesce('claimed_until', 'available_at'))
+    return Notification.objects.filter(status=Notification.PENDING).aggregate(at=Min(ready_at))['at']
+
+
+def pending_backlog(Task):
+    """Returns how many due tasks wait to be queued and how many notifications wait to be delivered."""
+    from .models import Notification
+
+    return {
+        'due_tasks': Task.objects.filter(notified=False, due_date__lte=timezone.now()).count(),
+        'pending_notifications': Notification.objects.filter(status=Notification.PENDING).count(),
+    }
+
+
+def send_task_notifications(Task, batch_size=None):
+    from .models import NotifierRun
+
+    batch_size = batch_size or settings.TASK_NOTIFIER_BATCH_SIZE
+    started_at = timezone.now()
+    started = time.monotonic()
+    lags = []
+
+    queued = enqueue_due_tasks(Task, timezone.now(), batch_size)
+    sent, failed = drain_outbox(batch_size, lags=lags)
 
-    threading.Thread(target=notify).start()
+    duration = time.monotonic() - started
+    backlog = pending_backlog(Task)
+    run = NotifierRun.objects.create(
+        started=started_at, duration=duration, queued=queued, sent=sent, failed=failed,
+        lag_avg=sum(lags) / len(lags) if lags else None, lag_max=max(lags, default=None),
+        backlog=sum(backlog.values()),
+    )
+    NotifierRun.objects.filter(pk__lte=run.pk - settings.NOTIFIER_RUNS_KEPT).delete()
+    logger.info('notifier run: queued=%d sent=%d failed=%d lag_avg=%s lag_max=%s backlog=%d duration=%.3fs rate=%.1f/s',
+                queued, sent, failed, run.lag_avg, run.lag_max, run.backlog, duration, sent / max(duration, 1e-6))
+    return sent
+
+
+def notifier_metrics(window=datetime.timedelta(hours=1)):
+    """Summarizes the current backlog and the notifier runs of the last ``window``."""
+    from .models import NotifierRun, Notification, Task
+
+    runs = NotifierRun.objects.filter(started__gte=timezone.now() - window)
+    recent = runs.aggregate(runs=Count('id'), queued=Sum('queued'), sent=Sum('sent'), failed=Sum('failed'),
+                            duration_avg=Avg('duration'), duration_max=Max('duration'),
+                            lag_total=Sum(F('lag_avg') * F('sent')), lag_max=Max('lag_max'))
+    lag_total = recent.pop('lag_total')
+    recent['lag_avg'] = lag_total / recent['sent'] if lag_total else None
+    last_run = NotifierRun.objects.order_by('-started').values(
+        'started', 'duration', 'queued', 'sent', 'failed', 'lag_avg', 'lag_max', 'backlog').first()
+    if last_run:
+        last_run['started'] = last_run['started'].isoformat()
+    return {
+        'backlog': dict(pending_backlog(Task), dead_notifications=Notification.objects.filter(status=Notification.DEAD).count()),
+        'last_run': last_run,
+        'window_seconds': window.total_seconds(),
+        'recent': {key: value or 0 for key, value in recent.items()},
+    }
+
+
+class TaskScheduler:
+    """Sleeps until the earliest pending due date instead of polling.
+
+    The due dates of pending tasks are kept in a min-heap. Task signals arm and
+    disarm entries, so the scheduler only touches the database when something is
+    actually due, plus a periodic resync to pick up tasks saved by other processes.
+    With a ``listener`` the scheduler also hears about tasks saved by other
+    processes right away. Besides due tasks, it wakes up for outbox retries.
+    """
+
+    def __init__(self, Task, preload=None, resync_interval=None, retry_delay=None, listener=None):
+        self.Task = Task
+        self.listener = listener
+        self.preload = preload or settings.TASK_NOTIFIER_PRELOAD
+        self.resync_interval = resync_interval or settings.TASK_NOTIFIER_RESYNC_INTERVAL
+        self.retry_delay = retry_delay or settings.TASK_NOTIFIER_RETRY_DELAY
+        self._cond = threading.Condition()
+        self._heap = []
+        # task id -> armed due date; heap entries that disagree with it are stale
+        self._armed = {}
+        # due dates later than this were left out by the last resync
+        self._horizon = None
+        # when the earliest pending outbox notification can be (re)tried
+        self._retry_at = None
+        self._next_resync = 0
+        # set when the heap changes so a computed sleep is not taken blindly
+        self._dirty = False
+        self._stopped = False
+
+    def arm(self, task_id, due_date):
+        with self._cond:
+            if self._horizon is not None and due_date > self._horizon:
+                self._armed.pop(task_id, None)
+                return
+            if self._armed.get(task_id) == due_date:
+                return
+            self._armed[task_id] = due_date
+            heapq.heappush(self._heap, (due_date, task_id))
+            self._dirty = True
+            self._cond.notify()
+
+    def disarm(self, task_id):
+        with self._cond:
+            self._armed.pop(task_id, None)
+
+    def task_changed(self, task):
+        if task.notified:
+            self.disarm(task.id)
+        else:
+            self.arm(task.id, task.due_date)
+
+    def apply(self, payload):
+        """Applies a task change published by ``publish_task_change``."""
+        task_id, *change = payload.split(' ')
+        if change and change[0] == '0':
+            self.arm(int(task_id), datetime.datetime.fromisoformat(change[1]))
+        else:
+            self.disarm(int(task_id))
+
+    def resync(self):
+        retry_at = next_outbox_retry()
+        pending = list(self.Task.objects.filter(notified=False)
+                                        .order_by('due_date')
+                                        .values_list('id', 'due_date')[:self.preload])
+        with self._cond:
+            self._armed = {task_id: due_date for task_id, due_date in pending}
+            self._heap = [(due_date, task_id) for task_id, due_date in pending]
+            heapq.heapify(self._heap)
+            self._horizon = pending[-1][1] if len(pending) == self.preload else None
+            self._retry_at = retry_at
+            self._next_resync = time.monotonic() + self.resync_interval
+
+    def next_due(self):
+        with self._cond:
+            while self._heap:
+                due_date, task_id = self._heap[0]
+                if self._armed.get(task_id) == due_date:
+                    return due_date
+                heapq.heappop(self._heap)
+            return None
+
+    def _pop_due(self, now):
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due_date, task_id = heapq.heappop(self._heap)
+                if self._armed.get(task_id) == due_date:
+                    del self._armed[task_id]
+
+    def _needs_resync(self):
+        with self._cond:
+            if time.monotonic() >= self._next_resync:
+                return True
+            # everything loaded has fired but more tasks lie past the horizon
+            return self._horizon is not None and not self._armed
+
+    def step(self):
+        """Drains if the earliest armed task is due and returns how many seconds to sleep."""
+        with self._cond:
+            self._dirty = False
+        if self._needs_resync():
+            self.resync()
+        wake_at = min(filter(None, [self.next_due(), self._retry_at]), default=None)
+        now = timezone.now()
+        until_resync = max(self._next_resync - time.monotonic(), 0)
+        if wake_at is None:
+            return until_resync
+        if wake_at > now:
+            return min((wake_at - now).total_seconds(), until_resync)
+        self._pop_due(now)
+        send_task_notifications(self.Task)
+        self._retry_at = next_outbox_retry()
+        return 0
+
+    def _wait(self, timeout):
+        if self.listener is not None:
+            for payload in self.listener.wait(timeout):
+                self.apply(payload)
+            return
+        with self._cond:
+            if not self._stopped and not self._dirty:
+                self._cond.wait(timeout)
+
+    def run(self):
+        while not self._stopped:
+            try:
+                timeout = self.step()
+            except Exception:
+                logger.exception('notifier run failed, retrying in %ss', self.retry_delay)
+                # leave the failed tasks pending and pick them up again on the next resync
+                self._next_resync = time.monotonic() + self.retry_delay
+                with self._cond:
+                    self._heap.clear()
+                    self._armed.clear()
+                    self._horizon = None
+                    self._retry_at = None
+                timeout = self.retry_delay
+            if timeout > 0:
+                self._wait(timeout)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+
+class PostgresListener:
+    """Receives the task changes published by other processes through PostgreSQL LISTEN/NOTIFY."""
+
+    def __init__(self, using='default'):
+        self.using = using
+        self._connect()
+
+    def _connect(self):
+        wrapper = connections[self.using]
+        self.connection = wrapper.get_new_connection(wrapper.get_connection_params())
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {TASK_CHANNEL}')
+
+    def wait(self, timeout):
+        import psycopg2
+
+        try:
+            if select.select([self.connection], [], [], timeout)[0]:
+                self.connection.poll()
+        except (OSError, psycopg2.Error):
+            logger.exception('lost the task change listener connection, reconnecting')
+            self._connect()
+            return []
+        payloads = [notify.payload for notify in self.connection.notifies]
+        self.connection.notifies.clear()
+        return payloads
+
+
+def get_listener(using='default'):
+    if connections[using].vendor == 'postgresql':
+        return PostgresListener(using)
+    return None
+
+
+def publish_task_change(task, deleted=False):
+    """Tells notifier schedulers in other processes that ``task`` changed (PostgreSQL only)."""
+    connection = connections[task._state.db or 'default']
+    if connection.vendor != 'postgresql':
+        return
+    if deleted:
+        payload = f'{task.id}'
+    else:
+        payload = f'{task.id} {int(task.notified)} {task.due_date.isoformat()}'
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [TASK_CHANNEL, payload])
+
+
+_scheduler = None
+
+
+def task_changed(task):
+    if _scheduler is not None:
+        _scheduler.task_changed(task)
+    publish_task_change(task)
+
+
+def task_deleted(task):
+    if _scheduler is not None:
+        _scheduler.disarm(task.id)
+    publish_task_change(task, deleted=True)
+
+
+def run_task_notifier():
+    global _scheduler
+    from .models import Task
 
+    _scheduler = TaskScheduler(Task, listener=get_listener())
+    threading.Thread(target=_scheduler.run, daemon=True).start()
+    return _scheduler
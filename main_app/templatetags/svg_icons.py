@@ -1,24 +1,50 @@
+from functools import lru_cache
+
 from django import template
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.utils.safestring import mark_safe
-from django.urls import reverse
+from django.urls import get_script_prefix, reverse
 
 register = template.Library()
 
+# Stands in for the object id when reversing, then gets cut out of the URL.
+_SENTINEL_ID = 2147483647
+
+ICONS = {
+    'update': """<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="currentColor" class="bi bi-pencil" viewBox="0 0 16 16">
+<path d="M12.146.146a.5.5 0 0 1 .708 0l3 3a.5.5 0 0 1 0 .708l-10 10a.5.5 0 0 1-.168.11l-5 2a.5.5 0 0 1-.65-.65l2-5a.5.5 0 0 1 .11-.168l10-10zM11.207 2.5 13.5 4.793 14.793 3.5 12.5 1.207 11.207 2.5zm1.586 3L10.5 3.207 4 9.707V10h.5a.5.5 0 0 1 .5.5v.5h.5a.5.5 0 0 1 .5.5v.5h.293l6.5-6.5zm-9.761 5.175-.106.106-1.528 3.821 3.821-1.528.106-.106A.5.5 0 0 1 5 12.5V12h-.5a.5.5 0 0 1-.5-.5V11h-.5a.5.5 0 0 1-.468-.325z"/>
+</svg>""",
+    'delete': """<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="currentColor" class="bi bi-x-square" viewBox="0 0 16 16">
+<path d="M14 1a1 1 0 0 1 1 1v12a1 1 0 0 1-1 1H2a1 1 0 0 1-1-1V2a1 1 0 0 1 1-1h12zM2 0a2 2 0 0 0-2 2v12a2 2 0 0 0 2 2h12a2 2 0 0 0 2-2V2a2 2 0 0 0-2-2H2z"/>
+<path d="M4.646 4.646a.5.5 0 0 1 .708 0L8 7.293l2.646-2.647a.5.5 0 0 1 .708.708L8.707 8l2.647 2.646a.5.5 0 0 1-.708.708L8 8.707l-2.646 2.647a.5.5 0 0 1-.708-.708L7.293 8 4.646 5.354a.5.5 0 0 1 0-.708z"/>
+</svg>""",
+}
+
+
+@lru_cache(maxsize=None)
+def _icon_parts(name, action, script_prefix):
+    """Splits the icon link for one model/action into the markup around the id."""
+    url = reverse(f'{name}-{action}', kwargs={f'{name}_id': _SENTINEL_ID})
+    prefix, suffix = url.split(str(_SENTINEL_ID))
+    return f'<a href="{prefix}', f'{suffix}" class="svgicon">{ICONS[action]}</a>'
+
+
+@receiver(setting_changed)
+def _clear_icon_parts(setting, **kwargs):
+    if setting == 'ROOT_URLCONF':
+        _icon_parts.cache_clear()
+
+
+def icon_link(obj, action):
+    head, tail = _icon_parts(obj._meta.model_name, action, get_script_prefix())
+    return mark_safe(f'{head}{int(obj.id)}{tail}')
+
+
 @register.simple_tag
 def update_icon(obj):
-    name = obj.__class__.__name__.lower()
-    update_url = reverse(f'{name}-update', kwargs={f'{name}_id': obj.id})
-    html = f"""<a href="{update_url}" class="svgicon"><svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="currentColor" class="bi bi-pencil" viewBox="0 0 16 16">
-<path d="M12.146.146a.5.5 0 0 1 .708 0l3 3a.5.5 0 0 1 0 .708l-10 10a.5.5 0 0 1-.168.11l-5 2a.5.5 0 0 1-.65-.65l2-5a.5.5 0 0 1 .11-.168l10-10zM11.207 2.5 13.5 4.793 14.793 3.5 12.5 1.207 11.207 2.5zm1.586 3L10.5 3.207 4 9.707V10h.5a.5.5 0 0 1 .5.5v.5h.5a.5.5 0 0 1 .5.5v.5h.293l6.5-6.5zm-9.761 5.175-.106.106-1.528 3.821 3.821-1.528.106-.106A.5.5 0 0 1 5 12.5V12h-.5a.5.5 0 0 1-.5-.5V11h-.5a.5.5 0 0 1-.468-.325z"/>
-</svg></a>"""
-    return mark_safe(html)
+    return icon_link(obj, 'update')
 
 @register.simple_tag
 def delete_icon(obj):
-    name = obj.__class__.__name__.lower()
-    delete_url = reverse(f'{name}-delete', kwargs={f'{name}_id': obj.id})
-    html = f"""<a href="{delete_url}" class="svgicon"><svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="currentColor" class="bi bi-x-square" viewBox="0 0 16 16">
-<path d="M14 1a1 1 0 0 1 1 1v12a1 1 0 0 1-1 1H2a1 1 0 0 1-1-1V2a1 1 0 0 1 1-1h12zM2 0a2 2 0 0 0-2 2v12a2 2 0 0 0 2 2h12a2 2 0 0 0 2-2V2a2 2 0 0 0-2-2H2z"/>
-<path d="M4.646 4.646a.5.5 0 0 1 .708 0L8 7.293l2.646-2.647a.5.5 0 0 1 .708.708L8.707 8l2.647 2.646a.5.5 0 0 1-.708.708L8 8.707l-2.646 2.647a.5.5 0 0 1-.708-.708L7.293 8 4.646 5.354a.5.5 0 0 1 0-.708z"/>
-</svg></a>"""
-    return mark_safe(html)
+    return icon_link(obj, 'delete')
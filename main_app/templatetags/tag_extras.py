@@ -1,23 +1,66 @@
 from django import template
-from django.utils.safestring import mark_safe
-from ..models import Tag
+from django.utils.html import format_html_join
 
 register = template.Library()
 
-def tag_list(from_obj):
-    tag_rels = from_obj.tags.through.objects.filter(**{f'{from_obj.__class__.__name__.lower()}_id': from_obj.id})
-    out = []
-    for tag_rel in tag_rels:
-        tag = Tag.objects.get(pk=tag_rel.tag_id)
-        out.append(f'<a href="{ tag.get_absolute_url() }">{ tag.name }</a>')
 
-    return ', '.join(out)
+def _tag_cache(context):
+    # Lives on the request so every template rendered for it shares the cache.
+    request = context.get('request')
+    if request is None:
+        return context.render_context.setdefault('tag_cache', {})
+    if not hasattr(request, '_tag_cache'):
+        request._tag_cache = {}
+    return request._tag_cache
 
 
+def load_tags(objects, cache=None):
+    """Fetch the tags of every object in one joined query over the through table.
+
+    Returns a dict of (model label, pk) -> list of tags. Objects already in
+    ``cache`` are not queried again.
+    """
+    cache = {} if cache is None else cache
+    by_model = {}
+    for obj in objects:
+        key = (obj._meta.label, obj.pk)
+        if key in cache:
+            continue
+        prefetched = getattr(obj, '_prefetched_objects_cache', {}).get('tags')
+        if prefetched is not None:
+            cache[key] = list(prefetched)
+            continue
+        cache[key] = []
+        by_model.setdefault(obj.__class__, []).append(obj.pk)
+
+    for model, ids in by_model.items():
+        through = model.tags.through
+        column = f'{model.__name__.lower()}_id'
+        rels = through.objects.filter(**{f'{column}__in': ids}).select_related('tag').order_by('pk')
+        for rel in rels:
+            cache[(model._meta.label, getattr(rel, column))].append(rel.tag)
+    return cache
+
+
+def tag_list(from_obj, cache=None):
+    tags = load_tags([from_obj], cache)[(from_obj._meta.label, from_obj.pk)]
+    return format_html_join(', ', '<a href="{}">{}</a>', ((tag.get_absolute_url(), tag.name) for tag in tags))
+
+
+@register.simple_tag(takes_context=True)
+def prefetch_tags(context, objects):
+    """Load the tags of a whole page of objects so later ``object_tags`` calls are free."""
+    load_tags(objects, _tag_cache(context))
+    return ''
+
+@register.simple_tag(takes_context=True)
+def object_tags(context, obj):
+    return tag_list(obj, _tag_cache(context))
+
 @register.simple_tag(takes_context=True)
 def bookmark_tags(context):
-    return mark_safe(tag_list(context['bookmark']))
+    return tag_list(context['bookmark'], _tag_cache(context))
 
 @register.simple_tag(takes_context=True)
 def task_tags(context):
-    return mark_safe(tag_list(context['task']))
+    return tag_list(context['task'], _tag_cache(context))
@@ -0,0 +1,206 @@
+import datetime
+import json
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from main_app import search
+from main_app.counters import recount
+from main_app.models import ApiToken, Bookmark, Notification, Tag, Task, UserCounters
+
+
+class ApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        cls.other = User.objects.create_user('bar', 'bar@email.com', '123456')
+        cls.token, cls.key = ApiToken.issue(cls.user, 'script')
+        cls.tag = Tag.objects.create(name='قراءة', user=cls.user)
+        cls.other_tag = Tag.objects.create(name='other', user=cls.other)
+
+    def call(self, method, kind, data=None, **extra):
+        extra.setdefault('HTTP_AUTHORIZATION', f'Token {self.key}')
+        url = reverse('api-collection', kwargs={'kind': kind})
+        if method == 'get':
+            return self.client.get(url, data, **extra)
+        return getattr(self.client, method)(url, json.dumps(data), content_type='application/json', **extra)
+
+    def results(self, *args, **kwargs):
+        response = self.call(*args, **kwargs)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['results']
+
+    def assertCountersConsistent(self):
+        counters = UserCounters.objects.get(user=self.user)
+        fresh = recount(self.user.pk)
+        for name in ('bookmarks', 'tasks', 'tags', 'overdue', 'pending_reminders'):
+            self.assertEqual(getattr(counters, name), getattr(fresh, name), name)
+
+    def test_create_bookmarks(self):
+        Bookmark.objects.create(title='saved', descr='', url='https://saved.example', user=self.user)
+        items = [{'title': f'bookmark {i}', 'url': f'https://example.com/{i}', 'tags': [self.tag.pk]} for i in range(50)]
+        items += [
+            {'title': 'no url'},
+            {'title': 'bad url', 'url': 'not a url'},
+            {'title': 'again', 'url': 'https://EXAMPLE.com/0/'},
+            {'title': 'saved', 'url': 'https://saved.example/'},
+            {'title': 'foreign tag', 'url': 'https://example.org', 'tags': [self.other_tag.pk]},
+            {'title': 'x', 'url': 'https://example.net', 'colour': 'red'},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            results = self.results('post', 'bookmarks', items)
+        self.assertLess(len(queries), 20)
+
+        self.assertEqual([r['status'] for r in results], ['created'] * 50 + ['error'] * 6)
+        self.assertIn('url', results[50]['errors'])
+        self.assertIn('url', results[51]['errors'])
+        self.assertEqual(results[52]['errors'], {'url': ['a bookmark with this URL already exists']})
+        self.assertEqual(results[53]['id'], Bookmark.objects.get(title='saved').pk)
+        self.assertIn('tags', results[54]['errors'])
+        self.assertEqual(results[55]['errors'], {'colour': ['unknown field']})
+
+        bookmark = Bookmark.objects.get(pk=results[7]['id'])
+        self.assertEqual((bookmark.title, bookmark.descr, bookmark.user), ('bookmark 7', '', self.user))
+        self.assertEqual(list(bookmark.tags.all()), [self.tag])
+        self.assertEqual(search.search(self.user, 'bookmark 7'), [bookmark])
+        self.assertCountersConsistent()
+
+    def test_create_tasks(self):
+        due = timezone.now() + datetime.timedelta(days=1)
+        results = self.results('post', 'tasks', [
+            {'name': 'task', 'priority': 2, 'due_date': due.isoformat()},
+            {'name': 'past', 'priority': 1, 'due_date': '2000-01-01T00:00:00'},
+            {'name': 'low', 'priority': 0, 'due_date': due.isoformat()},
+        ])
+        self.assertEqual([r['status'] for r in results], ['created', 'error', 'error'])
+        self.assertIn('due_date', results[1]['errors'])
+        self.assertIn('priority', results[2]['errors'])
+        task = Task.objects.get(pk=results[0]['id'])
+        self.assertEqual((task.due_date, task.notified), (due, False))
+        self.assertCountersConsistent()
+
+    def test_update(self):
+        bookmarks = [Bookmark.objects.create(title=f'b{i}', descr='', url=f'https://example.com/{i}', user=self.user) for i in range(3)]
+        foreign = Bookmark.objects.create(title='theirs', descr='', url='https://example.com', user=self.other)
+        updated = bookmarks[0].updated
+        results = self.results('patch', 'bookmarks', [
+            {'id': bookmarks[0].pk, 'title': 'renamed', 'tags': [self.tag.pk]},
+            {'id': bookmarks[1].pk, 'url': 'https://example.com/2'},
+            {'id': bookmarks[2].pk, 'url': 'https://example.com/new'},
+            {'id': foreign.pk, 'title': 'mine now'},
+            {'id': bookmarks[0].pk, 'title': 'twice'},
+        ])
+        self.assertEqual([r['status'] for r in results], ['updated', 'error', 'updated', 'not_found', 'error'])
+        bookmarks[0].refresh_from_db()
+        self.assertEqual(bookmarks[0].title, 'renamed')
+        self.assertGreater(bookmarks[0].updated, updated)
+        self.assertEqual(list(bookmarks[0].tags.all()), [self.tag])
+        self.assertEqual(Bookmark.objects.get(pk=bookmarks[1].pk).url, 'https://example.com/1')
+        self.assertEqual(Bookmark.objects.get(url_hash__isnull=False, url='https://example.com/new').pk, bookmarks[2].pk)
+        self.assertEqual(Bookmark.objects.get(pk=foreign.pk).title, 'theirs')
+        self.assertEqual(search.search(self.user, 'renamed'), [bookmarks[0]])
+
+        results = self.results('patch', 'bookmarks', [{'id': bookmarks[0].pk, 'tags': []}])
+        self.assertEqual(bookmarks[0].tags.count(), 0)
+
+    def test_rescheduling_rearms_reminder(self):
+        task = Task.objects.create(name='task', descr='', priority=1, user=self.user, due_date=timezone.now())
+        Task.objects.filter(pk=task.pk).update(notified=True)
+        recount(self.user.pk)
+        due = timezone.now() + datetime.timedelta(days=1)
+        self.results('patch', 'tasks', [{'id': task.pk, 'due_date': due.isoformat()}])
+        task.refresh_from_db()
+        self.assertFalse(task.notified)
+        self.assertCountersConsistent()
+
+    def test_delete(self):
+        bookmark = Bookmark.objects.create(title='bookmark', descr='', url='https://example.com', user=self.user)
+        bookmark.tags.add(self.tag)
+        task = Task.objects.create(name='task', descr='', priority=1, user=self.user, due_date=timezone.now())
+        Notification.objects.create(task=task)
+        foreign = Tag.objects.create(name='theirs', user=self.other)
+
+        self.assertEqual(self.results('delete', 'bookmarks', [bookmark.pk, 12345]),
+                         [{'status': 'deleted', 'id': bookmark.pk}, {'status': 'not_found', 'id': 12345}])
+        self.assertEqual(self.results('delete', 'tasks', [task.pk])[0]['status'], 'deleted')
+        self.assertEqual(self.results('delete', 'tags', [self.tag.pk, foreign.pk])[1]['status'], 'not_found')
+        self.assertFalse(Bookmark.objects.filter(pk=bookmark.pk).exists())
+        self.assertFalse(Notification.objects.exists())
+        self.assertFalse(Tag.objects.filter(pk=self.tag.pk).exists())
+        self.assertTrue(Tag.objects.filter(pk=foreign.pk).exists())
+        self.assertEqual(search.search(self.user, 'bookmark'), [])
+        self.assertCountersConsistent()
+
+    def test_list(self):
+        self.results('post', 'tags', [{'name': f'tag {i}'} for i in range(5)])
+        page = self.call('get', 'tags', {'limit': 4}).json()
+        self.assertEqual(len(page['results']), 4)
+        rest = self.call('get', 'tags', {'after': page['next'], 'limit': 4}).json()
+        self.assertEqual([row['name'] for row in rest['results']], ['tag 3', 'tag 4'])
+        self.assertIsNone(rest['next'])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.call('post', 'users', []).status_code, 404)
+        self.assertEqual(self.call('post', 'tags', {'name': 'x'}).status_code, 400)
+        self.assertEqual(self.call('post', 'tags', [{}] * 1001).status_code, 400)
+        self.assertEqual(self.call('put', 'tags', []).status_code, 405)
+        response = self.client.post(reverse('api-collection', kwargs={'kind': 'tags'}), 'not json',
+                                    content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_values(self):
+        due = timezone.now().isoformat()
+        results = self.results('post', 'tasks', [
+            {'name': 'month 13', 'priority': 1, 'due_date': '2030-13-01T00:00:00'},
+            {'name': 'huge', 'priority': 2 ** 70, 'due_date': due},
+            {'name': 'bool', 'priority': True, 'due_date': due},
+            {'name': 'bool tag', 'priority': 1, 'due_date': due, 'tags': [True]},
+        ])
+        self.assertEqual([r['status'] for r in results], ['error'] * 4)
+        self.assertEqual(results[0]['errors'], {'due_date': ['expected an ISO 8601 date and time']})
+        self.assertIn('priority', results[1]['errors'])
+        self.assertIn('priority', results[2]['errors'])
+        self.assertIn('tags', results[3]['errors'])
+
+        tag = Tag.objects.get(user=self.user)
+        results = self.results('patch', 'tags', [{'id': [1]}, [[1]], {'id': True}, {'id': 2 ** 70, 'name': 'x'}, {'id': tag.pk, 'name': 'kept'}])
+        self.assertEqual(results[:3], [{'status': 'error', 'errors': {'id': ['expected an integer']}}] * 3)
+        self.assertEqual([r['status'] for r in results[3:]], ['not_found', 'updated'])
+        results = self.results('delete', 'tags', [[1], {'id': [1]}, 2 ** 70, tag.pk])
+        self.assertEqual([r['status'] for r in results], ['error', 'error', 'not_found', 'deleted'])
+        self.assertEqual(results[0]['errors'], {'id': ['expected an integer']})
+        self.assertFalse(Tag.objects.filter(user=self.user).exists())
+
+    def test_list_bounds(self):
+        for params in ({'limit': 0}, {'limit': -1}, {'after': -1}, {'limit': 'x'}):
+            self.assertEqual(self.call('get', 'tags', params).status_code, 400, params)
+        self.assertEqual(len(self.call('get', 'tags', {'limit': 10 ** 6}).json()['results']), 1)
+
+    def test_authentication(self):
+        self.assertEqual(self.call('get', 'tags', HTTP_AUTHORIZATION='Token nope').status_code, 401)
+        self.assertEqual(self.call('get', 'tags', HTTP_AUTHORIZATION='').status_code, 401)
+        self.assertEqual(self.call('get', 'tags')
+                         .json()['results'][0]['name'], 'قراءة')
+
+    def test_session_requires_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        url = reverse('api-collection', kwargs={'kind': 'tags'})
+        self.assertEqual(client.get(url).status_code, 200)
+        response = client.post(url, '[{"name": "x"}]', content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        csrf_token = client.get(reverse('tag-create')).context['csrf_token']
+        response = client.post(url, '[{"name": "x"}]', content_type='application/json', HTTP_X_CSRFTOKEN=str(csrf_token))
+        self.assertEqual(response.status_code, 200)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('create_api_token', 'bar', stdout=out)
+        response = self.call('get', 'tags', HTTP_AUTHORIZATION=f'Token {out.getvalue().strip()}')
+        self.assertEqual([row['name'] for row in response.json()['results']], ['other'])
@@ -0,0 +1,101 @@
+import datetime
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from main_app import ics
+from main_app.models import Bookmark, CalendarFeed, Task, UserCounters
+from main_app.task_notifier import enqueue_due_tasks
+
+
+class IcsTest(TestCase):
+
+    def test_escape(self):
+        self.assertEqual(ics.escape('a; b, c\\d\r\ne'), 'a\\; b\\, c\\\\d\\ne')
+
+    def test_fold(self):
+        line = 'SUMMARY:' + 'مهمة طويلة ' * 20
+        folded = ics.fold(line)
+        parts = folded.split('\r\n')
+        self.assertEqual(parts[-1], '')
+        self.assertTrue(all(len(part.encode()) <= 75 for part in parts))
+        self.assertEqual(folded.replace('\r\n ', '')[:-2], line)
+        self.assertEqual(ics.fold('SHORT:x'), 'SHORT:x\r\n')
+
+
+class CalendarFeedTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        cls.feed = CalendarFeed.objects.create(user=cls.user)
+        cls.task = Task.objects.create(name='اجتماع, مهم', descr='سطر\nسطر', priority=12, user=cls.user,
+                                       due_date=datetime.datetime(2030, 1, 2, 3, 4, tzinfo=datetime.timezone.utc))
+
+    def url(self, token=None):
+        return reverse('task-calendar-feed', kwargs={'token': token or self.feed.token})
+
+    def test_feed(self):
+        response = self.client.get(self.url())
+        self.assertEqual(response['Content-Type'], ics.CONTENT_TYPE)
+        self.assertTrue(response.streaming)
+        self.assertIn('private', response['Cache-Control'])
+        content = b''.join(response.streaming_content).decode()
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertTrue(content.endswith('END:VCALENDAR\r\n'))
+        self.assertIn(f'UID:task-{self.task.pk}@minzam\r\n', content)
+        self.assertIn('DTSTART:20300102T030400Z\r\n', content)
+        self.assertIn('SUMMARY:اجتماع\\, مهم\r\n', content)
+        self.assertIn('DESCRIPTION:سطر\\nسطر\r\n', content)
+        self.assertIn('PRIORITY:9\r\n', content)
+        self.assertIn(f'URL:http://testserver/task/{self.task.pk}\r\n', content)
+
+    def test_unknown_token(self):
+        self.assertEqual(self.client.get(self.url('nope')).status_code, 404)
+
+    def test_conditional_get(self):
+        etag = self.client.get(self.url())['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1)
+
+        # other data does not change the feed
+        Bookmark.objects.create(title='bookmark', descr='', url='https://example.com', user=self.user)
+        self.assertEqual(self.client.get(self.url(), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.task.name = 'renamed'
+        self.task.save()
+        response = self.client.get(self.url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_task_changes_change_etag(self):
+        etags = [self.client.get(self.url())['ETag']]
+        task = Task.objects.create(name='task', descr='', priority=1, user=self.user, due_date=timezone.now())
+        etags.append(self.client.get(self.url())['ETag'])
+        enqueue_due_tasks(Task, timezone.now(), batch_size=10)
+        etags.append(self.client.get(self.url())['ETag'])
+        task.delete()
+        etags.append(self.client.get(self.url())['ETag'])
+        self.assertEqual(len(set(etags)), 4)
+
+    def test_missing_counters(self):
+        UserCounters.objects.all().delete()
+        response = self.client.get(self.url())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.client.get(self.url()).has_header('ETag'))
+
+    def test_settings_page(self):
+        other = User.objects.create_user('bar', 'bar@email.com', '123456')
+        self.client.force_login(other)
+        response = self.client.get(reverse('task-calendar'))
+        token = CalendarFeed.objects.get(user=other).token
+        self.assertContains(response, self.url(token))
+        self.client.post(reverse('task-calendar'))
+        self.assertNotEqual(CalendarFeed.objects.get(user=other).token, token)
+        self.assertEqual(self.client.get(self.url(token)).status_code, 404)
@@ -0,0 +1,95 @@
+import datetime
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from main_app.counters import get_counters, recount
+from main_app.models import Bookmark, Tag, Task, UserCounters
+from main_app.task_notifier import enqueue_due_tasks
+
+
+class UserCountersTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+
+    def assertCounters(self, **expected):
+        counters = UserCounters.objects.get(user=self.user)
+        for name, value in expected.items():
+            self.assertEqual(getattr(counters, name), value, name)
+        fresh = recount(self.user.pk)
+        for name in expected:
+            self.assertEqual(getattr(fresh, name), expected[name], f'{name} (recount)')
+
+    def create_task(self, **kwargs):
+        kwargs.setdefault('due_date', timezone.now() + datetime.timedelta(days=1))
+        return Task.objects.create(name='task', descr='', priority=1, user=self.user, **kwargs)
+
+    def test_created_and_deleted(self):
+        tag = Tag.objects.create(name='tag', user=self.user)
+        bookmark = Bookmark.objects.create(title='bookmark', descr='', url='', user=self.user)
+        task = self.create_task()
+        self.create_task(notified=True)
+        self.assertCounters(bookmarks=1, tags=1, tasks=2, pending_reminders=1, overdue=1)
+
+        tag.delete()
+        bookmark.delete()
+        task.delete()
+        self.assertCounters(bookmarks=0, tags=0, tasks=1, pending_reminders=0, overdue=1)
+
+    def test_notifier_moves_tasks_to_overdue(self):
+        for _ in range(3):
+            self.create_task(due_date=timezone.now())
+        self.create_task()
+        self.assertCounters(tasks=4, pending_reminders=4, overdue=0)
+        enqueue_due_tasks(Task, timezone.now(), batch_size=2)
+        self.assertCounters(tasks=4, pending_reminders=1, overdue=3)
+
+    def test_rescheduling_moves_task_back_to_pending(self):
+        self.create_task(due_date=timezone.now())
+        enqueue_due_tasks(Task, timezone.now(), batch_size=10)
+        task = Task.objects.get()
+        self.client.force_login(self.user)
+        due_date = timezone.localtime() + datetime.timedelta(days=2)
+        response = self.client.post(reverse('task-update', kwargs={'task_id': task.id}), {
+            'name': 'task', 'descr': 'later', 'priority': 1,
+            'due_date': due_date.strftime('%Y-%m-%d'), 'due_time': due_date.strftime('%H:%M'),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertCounters(tasks=1, pending_reminders=1, overdue=0)
+
+    def test_missing_row_is_rebuilt(self):
+        Bookmark.objects.create(title='bookmark', descr='', url='', user=self.user)
+        UserCounters.objects.all().delete()
+        self.assertEqual(get_counters(self.user).bookmarks, 1)
+        UserCounters.objects.all().delete()
+        Bookmark.objects.create(title='bookmark 2', descr='', url='', user=self.user)
+        self.assertCounters(bookmarks=2)
+
+    def test_list_views_do_not_count(self):
+        for i in range(15):
+            Bookmark.objects.create(title=f'bookmark {i}', descr='', url='', user=self.user)
+        self.client.force_login(self.user)
+        get_counters(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('bookmarks') + '?page=2')
+        self.assertEqual(response.context['paginator'].num_pages, 2)
+        self.assertEqual(len(response.context['bookmark_list']), 5)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+    def test_index_dashboard(self):
+        Tag.objects.create(name='tag', user=self.user)
+        self.create_task()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['counters'].tags, 1)
+        self.assertEqual(response.context['counters'].pending_reminders, 1)
+        self.assertContains(response, 'id="dashboard"')
+
+        self.client.logout()
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'id="dashboard"')
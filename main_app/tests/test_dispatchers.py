@@ -0,0 +1,180 @@
+import json, smtplib, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.contrib.auth.models import User
+from django.core.mail import EmailMultiAlternatives
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from main_app import dispatchers
+from main_app.dispatchers import MailDispatcher, TrustifiDispatcher
+from main_app.models import Task, Notification
+from main_app.task_notifier import send_task_notifications
+
+
+class FlakyConnection:
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.opened = 0
+        self.closed = 0
+        self.sent = []
+
+    def open(self):
+        self.opened += 1
+
+    def close(self):
+        self.closed += 1
+
+    def send_messages(self, messages):
+        if self.failures:
+            self.failures -= 1
+            raise smtplib.SMTPServerDisconnected('connection lost')
+        self.sent.extend(messages)
+        return len(messages)
+
+
+def make_messages(count):
+    return [EmailMultiAlternatives(f'subject {i}', 'body', None, [f'user{i}@email.com']) for i in range(count)]
+
+
+class MailDispatcherTest(SimpleTestCase):
+
+    def test_one_connection_per_drain(self):
+        connection = FlakyConnection(failures=0)
+        with MailDispatcher(connection) as dispatcher:
+            self.assertEqual(dispatcher.send(make_messages(3)), [True] * 3)
+            self.assertEqual(dispatcher.send(make_messages(2)), [True] * 2)
+        self.assertEqual(connection.opened, 1)
+        self.assertEqual(connection.closed, 1)
+        self.assertEqual(len(connection.sent), 5)
+
+    def test_no_connection_when_nothing_to_send(self):
+        connection = FlakyConnection(failures=0)
+        with MailDispatcher(connection) as dispatcher:
+            dispatcher.send([])
+        self.assertEqual(connection.opened, 0)
+
+    def test_reconnects_on_failure(self):
+        connection = FlakyConnection(failures=1)
+        with MailDispatcher(connection) as dispatcher:
+            self.assertEqual(dispatcher.send(make_messages(3)), [True] * 3)
+        self.assertEqual(connection.opened, 2)
+        self.assertEqual(len(connection.sent), 3)
+
+    def test_gives_up_after_retry(self):
+        connection = FlakyConnection(failures=2)
+        with MailDispatcher(connection) as dispatcher:
+            self.assertEqual(dispatcher.send(make_messages(2)), [False, True])
+        self.assertEqual([m.to for m in connection.sent], [['user1@email.com']])
+
+
+class StubTrustifiHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.requests.append((self.headers['x-trustifi-key'], payload))
+            status = server.statuses.pop(0) if server.statuses else 200
+        body = json.dumps({'status': status}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TrustifiDispatcherTest(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubTrustifiHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.statuses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/api/i/v1/email'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_dispatcher(self, **kwargs):
+        kwargs.setdefault('concurrency', 4)
+        kwargs.setdefault('timeout', 5)
+        kwargs.setdefault('max_retries', 2)
+        kwargs.setdefault('backoff', 0.01)
+        kwargs.setdefault('breaker_threshold', 10)
+        kwargs.setdefault('breaker_cooldown', 60)
+        dispatcher = TrustifiDispatcher(url=self.url, key='key', secret='secret', **kwargs)
+        self.addCleanup(dispatcher.close)
+        return dispatcher
+
+    def html_messages(self, count):
+        messages = make_messages(count)
+        for message in messages:
+            message.attach_alternative('<p>body</p>', 'text/html')
+        return messages
+
+    def test_sends_all_messages(self):
+        dispatcher = self.make_dispatcher()
+        self.assertEqual(dispatcher.send(self.html_messages(10)), [True] * 10)
+        self.assertEqual(len(self.server.requests), 10)
+        key, payload = self.server.requests[0]
+        self.assertEqual(key, 'key')
+        self.assertEqual(payload['html'], '<p>body</p>')
+
+    def test_retries_server_errors(self):
+        self.server.statuses = [500, 503]
+        dispatcher = self.make_dispatcher(concurrency=1)
+        self.assertEqual(dispatcher.send(self.html_messages(1)), [True])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.statuses = [400]
+        dispatcher = self.make_dispatcher(concurrency=1)
+        self.assertEqual(dispatcher.send(self.html_messages(2)), [False, True])
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_circuit_breaker_stops_sending(self):
+        self.server.statuses = [500] * 100
+        dispatcher = self.make_dispatcher(concurrency=1, max_retries=0, breaker_threshold=3)
+        self.assertEqual(dispatcher.send(self.html_messages(5)), [False] * 5)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_rejected_messages_leave_circuit_closed(self):
+        self.server.statuses = [400, 422] * 5
+        dispatcher = self.make_dispatcher(concurrency=1, max_retries=0, breaker_threshold=3)
+        self.assertEqual(dispatcher.send(self.html_messages(12)), [False] * 10 + [True] * 2)
+        self.assertEqual(len(self.server.requests), 12)
+        self.assertTrue(dispatcher.breaker.allow())
+
+    def test_auth_errors_open_circuit(self):
+        self.server.statuses = [401] * 100
+        dispatcher = self.make_dispatcher(concurrency=1, max_retries=0, breaker_threshold=3)
+        self.assertEqual(dispatcher.send(self.html_messages(5)), [False] * 5)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_unreachable_server(self):
+        self.url = 'http://127.0.0.1:1/api/i/v1/email'
+        dispatcher = self.make_dispatcher(concurrency=1, max_retries=1)
+        self.assertEqual(dispatcher.send(self.html_messages(1)), [False])
+
+    def test_only_delivered_tasks_are_notified(self):
+        user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        for i in range(3):
+            Task.objects.create(name=f'task {i}', descr='', priority=1, due_date=timezone.now(), user=user)
+        self.server.statuses = [200, 400, 200]
+        with override_settings(USE_TRUSTIFI=True, TRUSTIFI_URL=self.url, TRUSTIFI_CONCURRENCY=1):
+            dispatchers._trustifi_dispatcher = None
+            try:
+                send_task_notifications(Task)
+            finally:
+                dispatchers._trustifi_dispatcher.close()
+                dispatchers._trustifi_dispatcher = None
+        notifications = Notification.objects.order_by('task_id')
+        self.assertEqual([n.status for n in notifications], [Notification.SENT, Notification.PENDING, Notification.SENT])
+        self.assertEqual([n.attempts for n in notifications], [0, 1, 0])
@@ -0,0 +1,75 @@
+import csv
+import datetime
+import io
+import json
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from main_app import exporters
+from main_app.models import Bookmark, Tag, Task
+
+
+class ExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        other = User.objects.create_user('bar', 'bar@email.com', '123456')
+        cls.tags = [Tag.objects.create(name=name, user=cls.user) for name in ('قراءة', 'عمل')]
+        for i in range(5):
+            bookmark = Bookmark.objects.create(title=f'bookmark {i}', descr='line one\nline, two', url=f'https://example.com/{i}', user=cls.user)
+            bookmark.tags.set(cls.tags[:i % 3])
+        Bookmark.objects.create(title='not mine', descr='', url='https://example.org', user=other)
+        cls.task = Task.objects.create(name='مهمة', descr='', priority=2, user=cls.user,
+                                       due_date=timezone.now() + datetime.timedelta(days=1))
+        cls.task.tags.add(cls.tags[1])
+
+    def test_tags_are_loaded_per_chunk(self):
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(exporters.rows(self.user, 'bookmarks', chunk_size=2))
+        self.assertEqual([row['title'] for row in rows], [f'bookmark {i}' for i in range(5)])
+        self.assertEqual([row['tags'] for row in rows], [[], ['قراءة'], ['عمل', 'قراءة'], [], ['قراءة']])
+        self.assertEqual(sum('main_app_bookmark_tags' in query['sql'] for query in queries), 3)
+
+    def test_csv_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('export', kwargs={'kind': 'bookmarks', 'format': 'csv'}))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('minzam-bookmarks.csv', response['Content-Disposition'])
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[2]['descr'], 'line one\nline, two')
+        self.assertEqual(rows[2]['tags'], 'عمل, قراءة')
+
+    def test_ndjson_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('export', kwargs={'kind': 'tasks', 'format': 'ndjson'}))
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['name'], 'مهمة')
+        self.assertEqual(rows[0]['tags'], ['عمل'])
+        self.assertEqual(datetime.datetime.fromisoformat(rows[0]['due_date']), self.task.due_date)
+
+    def test_unknown_export(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('export', kwargs={'kind': 'users', 'format': 'csv'}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('export', kwargs={'kind': 'tags', 'format': 'xml'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_login_required(self):
+        response = self.client.get(reverse('export', kwargs={'kind': 'tags', 'format': 'csv'}))
+        self.assertEqual(response.status_code, 302)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_data', 'foo', 'tags', '--format', 'ndjson', stdout=out)
+        self.assertEqual([json.loads(line)['name'] for line in out.getvalue().splitlines()], ['قراءة', 'عمل'])
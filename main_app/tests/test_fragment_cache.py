@@ -0,0 +1,92 @@
+import datetime
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from main_app.models import Bookmark, Tag, Task
+from main_app.task_notifier import enqueue_due_tasks
+
+
+class FragmentCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        cls.other = User.objects.create_user('bar', 'bar@email.com', '123456')
+        cls.tag = Tag.objects.create(name='reading', user=cls.user)
+        cls.bookmark = Bookmark.objects.create(title='first title', descr='about', url='https://example.com', user=cls.user)
+        cls.bookmark.tags.add(cls.tag)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def get(self, url_name, **kwargs):
+        return self.client.get(reverse(url_name, kwargs=kwargs)).content.decode()
+
+    def test_list_is_served_from_cache(self):
+        self.get('bookmarks')
+        with CaptureQueriesContext(connection) as queries:
+            content = self.get('bookmarks')
+        self.assertIn('first title', content)
+        self.assertFalse(any('FROM "main_app_bookmark"' in query['sql'] for query in queries))
+
+    def test_edit_shows_up_immediately(self):
+        self.assertIn('first title', self.get('bookmarks'))
+        self.assertIn('first title', self.get('bookmark-detail', pk=self.bookmark.pk))
+        self.client.post(reverse('bookmark-update', kwargs={'bookmark_id': self.bookmark.pk}), {
+            'title': 'second title', 'descr': 'about', 'url': 'https://example.com', 'tags': [self.tag.pk],
+        })
+        self.assertIn('second title', self.get('bookmarks'))
+        self.assertIn('second title', self.get('bookmark-detail', pk=self.bookmark.pk))
+
+    def test_create_and_delete(self):
+        self.get('tags')
+        tag = Tag.objects.create(name='new tag', user=self.user)
+        self.assertIn('new tag', self.get('tags'))
+        tag.delete()
+        self.assertNotIn('new tag', self.get('tags'))
+
+    def test_tag_changes_reach_detail_pages(self):
+        self.assertIn('reading', self.get('bookmark-detail', pk=self.bookmark.pk))
+        other_tag = Tag.objects.create(name='later', user=self.user)
+        self.bookmark.tags.add(other_tag)
+        self.assertIn('later', self.get('bookmark-detail', pk=self.bookmark.pk))
+        other_tag.bookmark_set.remove(self.bookmark)
+        self.assertNotIn('later', self.get('bookmark-detail', pk=self.bookmark.pk))
+        self.tag.name = 'renamed'
+        self.tag.save()
+        self.assertIn('renamed', self.get('bookmark-detail', pk=self.bookmark.pk))
+
+    def test_users_do_not_share_fragments(self):
+        self.get('bookmarks')
+        self.client.force_login(self.other)
+        self.assertNotIn('first title', self.get('bookmarks'))
+
+    def test_pages_are_cached_separately(self):
+        for i in range(12):
+            Bookmark.objects.create(title=f'bookmark {i:02}', descr='', url='', user=self.user)
+        first = self.client.get(reverse('bookmarks')).content.decode()
+        second = self.client.get(reverse('bookmarks') + '?page=2').content.decode()
+        self.assertIn('bookmark 00', first)
+        self.assertNotIn('bookmark 00', second)
+
+    def test_past_tasks_are_marked(self):
+        task = Task.objects.create(name='task', descr='', priority=1, user=self.user,
+                                   due_date=timezone.now() + datetime.timedelta(hours=1))
+        self.assertNotIn('(مضى)', self.get('tasks'))
+        self.assertNotIn('(مضى)', self.get('task-detail', pk=task.pk))
+        # the due date passes without any write to the user's data
+        Task.objects.filter(pk=task.pk).update(due_date=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertIn('(مضى)', self.get('tasks'))
+        self.assertIn('(مضى)', self.get('task-detail', pk=task.pk))
+
+    def test_notifier_invalidates(self):
+        Task.objects.create(name='task', descr='', priority=1, user=self.user, due_date=timezone.now())
+        version = self.client.get(reverse('tasks')).context['data_version']
+        enqueue_due_tasks(Task, timezone.now(), batch_size=10)
+        self.assertNotEqual(str(self.client.get(reverse('tasks')).context['data_version']), str(version))
@@ -0,0 +1,195 @@
+import io
+import json
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+
+from main_app import importers, search
+from main_app.models import Bookmark, Tag, UserCounters
+from main_app.counters import adjust, recount
+
+NETSCAPE = '''<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>Bookmarks</H1>
+<DL><p>
+    <DT><H3 ADD_DATE="1" PERSONAL_TOOLBAR_FOLDER="true">Bookmarks bar</H3>
+    <DL><p>
+        <DT><A HREF="https://example.com/" ADD_DATE="1">Example &amp; co</A>
+        <DD>An example site
+        <DT><H3>قراءة</H3>
+        <DL><p>
+            <DT><A HREF="https://docs.djangoproject.com/" TAGS="django,docs">Django</A>
+            <DT><H3>Python</H3>
+            <DL><p>
+                <DT><A HREF="https://python.org/">Python</A>
+            </DL><p>
+        </DL><p>
+        <DT><A HREF="javascript:alert(1)">Bookmarklet</A>
+    </DL><p>
+    <DT><A HREF="https://EXAMPLE.com">Example again</A>
+</DL><p>
+'''
+
+CHROME = {
+    'checksum': 'x',
+    'roots': {
+        'bookmark_bar': {
+            'children': [
+                {'name': 'Example', 'type': 'url', 'url': 'https://example.com/'},
+                {
+                    'children': [
+                        {'name': 'Django', 'type': 'url', 'url': 'https://docs.djangoproject.com/'},
+                        {'children': [{'name': 'Python', 'type': 'url', 'url': 'https://python.org/'}],
+                         'name': 'Python', 'type': 'folder'},
+                    ],
+                    'name': 'قراءة \\ "quoted"',
+                    'type': 'folder',
+                },
+            ],
+            'name': 'Bookmarks bar',
+            'type': 'folder',
+        },
+        'other': {'children': [], 'name': 'Other bookmarks', 'type': 'folder'},
+    },
+    'version': 1,
+}
+
+FIREFOX = {
+    'guid': 'root________', 'title': '', 'root': 'placesRoot', 'children': [
+        {'guid': 'menu________', 'title': 'menu', 'root': 'bookmarksMenuFolder', 'children': [
+            {'title': 'Work', 'type': 'text/x-moz-place-container', 'children': [
+                {'title': 'Tracker', 'uri': 'https://tracker.example/?utm_source=x', 'tags': 'todo'},
+                {'title': 'Recent', 'uri': 'place:sort=8'},
+            ]},
+        ]},
+    ],
+}
+
+
+def parse(text):
+    return [(e.title, e.url, e.descr.strip(), e.folders) for e in importers.parse(io.StringIO(text))]
+
+
+class ParseTest(TestCase):
+
+    def test_netscape(self):
+        self.assertEqual(parse(NETSCAPE), [
+            ('Example & co', 'https://example.com/', 'An example site', ()),
+            ('Django', 'https://docs.djangoproject.com/', '', ('قراءة', 'django', 'docs')),
+            ('Python', 'https://python.org/', '', ('قراءة', 'Python')),
+            ('Bookmarklet', 'javascript:alert(1)', '', ()),
+            ('Example again', 'https://EXAMPLE.com', '', ()),
+        ])
+
+    def test_chrome_json(self):
+        # folder names follow their children in Chrome exports
+        self.assertEqual(parse(json.dumps(CHROME, indent=2)), [
+            ('Example', 'https://example.com/', '', ()),
+            ('Django', 'https://docs.djangoproject.com/', '', ('قراءة \\ "quoted"',)),
+            ('Python', 'https://python.org/', '', ('قراءة \\ "quoted"', 'Python')),
+        ])
+
+    def test_firefox_json(self):
+        self.assertEqual(parse(json.dumps(FIREFOX)), [
+            ('Tracker', 'https://tracker.example/?utm_source=x', '', ('Work', 'todo')),
+            ('Recent', 'place:sort=8', '', ('Work',)),
+        ])
+
+    def test_small_reads(self):
+        # every token and tag gets split across reads
+        for text in (NETSCAPE, json.dumps(CHROME)):
+            with mock.patch.object(importers, 'READ_SIZE', 7):
+                small = parse(text)
+            self.assertEqual(small, parse(text))
+
+    def test_invalid_json(self):
+        with self.assertRaises(importers.InvalidImportFile):
+            parse('{"roots": @}')
+        with self.assertRaises(importers.InvalidImportFile):
+            parse('{"roots": {"other": [')
+
+
+class ImportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+
+    def import_text(self, text, **kwargs):
+        return importers.import_bookmarks(self.user, io.BytesIO(text.encode()), **kwargs)
+
+    def test_import(self):
+        existing_tag = Tag.objects.create(name='قراءة', user=self.user)
+        Bookmark.objects.create(title='saved', descr='', url='https://python.org', user=self.user)
+        progress = []
+        result = self.import_text(NETSCAPE, chunk_size=2, progress=lambda r: progress.append(r.created))
+
+        self.assertEqual((result.read, result.created, result.skipped), (5, 2, 3))
+        self.assertEqual(progress, [2, 2, 2])
+        example = Bookmark.objects.get(url='https://example.com/')
+        self.assertEqual((example.title, example.descr), ('Example & co', 'An example site'))
+        django = Bookmark.objects.get(title='Django')
+        self.assertEqual(set(django.tags.values_list('name', flat=True)), {'قراءة', 'django', 'docs'})
+        self.assertIn(existing_tag, django.tags.all())
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(search.search(self.user, 'django'), [django])
+
+        counters = UserCounters.objects.get(user=self.user)
+        fresh = recount(self.user.pk)
+        self.assertEqual((counters.bookmarks, counters.tags), (fresh.bookmarks, fresh.tags))
+
+    def test_counts_survive_a_concurrent_import(self):
+        bulk_create = Bookmark.objects.bulk_create
+
+        def concurrent_first(objs, **kwargs):
+            # another import inserts and counts one of the URLs between the duplicate check and the insert
+            theirs = Bookmark(title='theirs', descr='', url=objs[0].url, url_hash=objs[0].url_hash, user=self.user)
+            bulk_create([theirs])
+            adjust(self.user.pk, bookmarks=1)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Bookmark.objects, 'bulk_create', side_effect=concurrent_first):
+            self.import_text(json.dumps(CHROME))
+        self.assertEqual(Bookmark.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(UserCounters.objects.get(user=self.user).bookmarks, 3)
+
+    def test_reimport_skips_everything(self):
+        self.import_text(json.dumps(CHROME))
+        result = self.import_text(json.dumps(CHROME))
+        self.assertEqual((result.created, result.skipped), (0, 3))
+        self.assertEqual(Bookmark.objects.filter(user=self.user).count(), 3)
+
+    def test_view(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('bookmark-import')).status_code, 200)
+        upload = SimpleUploadedFile('bookmarks.html', NETSCAPE.encode(), content_type='text/html')
+        response = self.client.post(reverse('bookmark-import'), {'file': upload})
+        self.assertEqual(response.context['result'].created, 3)
+        self.assertContains(response, 'id="import-result"')
+        upload = SimpleUploadedFile('bookmarks.json', b'{"roots": [', content_type='application/json')
+        response = self.client.post(reverse('bookmark-import'), {'file': upload})
+        self.assertIsNone(response.context['result'])
+        self.assertTrue(response.context['form'].errors)
+
+    @override_settings(BOOKMARK_IMPORT_MAX_SIZE=100)
+    def test_view_rejects_large_files(self):
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile('bookmarks.html', NETSCAPE.encode(), content_type='text/html')
+        response = self.client.post(reverse('bookmark-import'), {'file': upload})
+        self.assertIsNone(response.context['result'])
+        self.assertIn('import_bookmarks', str(response.context['form'].errors['file']))
+        self.assertFalse(Bookmark.objects.exists())
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as file:
+            json.dump(FIREFOX, file)
+            file.flush()
+            out = StringIO()
+            call_command('import_bookmarks', 'foo', file.name, stdout=out)
+        self.assertIn('done: 2 read, 1 created, 1 skipped', out.getvalue())
@@ -1,7 +1,9 @@
+from django.db import IntegrityError
 from django.utils import timezone
 from django.test import TestCase
+from django.contrib.auth.models import User
 
-from main_app.models import Bookmark, Task, Tag
+from main_app.models import Bookmark, Task, Tag, normalize_url, url_hash
 
 class TagModelTest(TestCase):
     @classmethod
@@ -92,3 +94,38 @@ class TaskModelTest(TestCase):
         task = Task.objects.get(id=1)
         self.assertEqual(task.get_absolute_url(), '/task/1')
 
+
+class BookmarkUrlHashTest(TestCase):
+
+    def test_normalize_url(self):
+        cases = [
+            ('HTTP://Example.COM', 'https://example.com'),
+            ('https://example.com/', 'https://example.com'),
+            ('https://example.com:443/a/', 'https://example.com/a'),
+            ('http://example.com:80/a', 'https://example.com/a'),
+            ('https://example.com:8443/a', 'https://example.com:8443/a'),
+            ('https://example.com/Path?b=2&a=1', 'https://example.com/Path?a=1&b=2'),
+            ('https://example.com/?utm_source=x&UTM_Medium=y&fbclid=z&q=1', 'https://example.com?q=1'),
+            ('https://example.com/page#section', 'https://example.com/page#section'),
+            ('ftp://user@Example.com/file', 'ftp://user@example.com/file'),
+            ('https://[::1]:8000/', 'https://[::1]:8000'),
+        ]
+        for url, normalized in cases:
+            with self.subTest(url=url):
+                self.assertEqual(normalize_url(url), normalized)
+
+    def test_empty_url_has_no_hash(self):
+        self.assertIsNone(url_hash(''))
+        user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        Bookmark.objects.create(title='a', descr='', url='', user=user)
+        Bookmark.objects.create(title='b', descr='', url='', user=user)
+
+    def test_unique_per_user(self):
+        user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        other = User.objects.create_user('bar', 'bar@email.com', '123456')
+        bookmark = Bookmark.objects.create(title='a', descr='', url='https://example.com', user=user)
+        self.assertEqual(bookmark.url_hash, url_hash('http://example.com/'))
+        Bookmark.objects.create(title='a', descr='', url='https://example.com', user=other)
+        with self.assertRaises(IntegrityError):
+            Bookmark.objects.create(title='b', descr='', url='http://EXAMPLE.com/', user=user)
+
@@ -0,0 +1,37 @@
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from main_app.models import Bookmark, Task, Tag, Notification
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'query plans are only checked on SQLite and PostgreSQL')
+class QueryPlanTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # the tables are tiny, so make sequential scans unattractive to the planner
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        self.assertIn(index_name, queryset.explain())
+
+    def test_pending_reminders(self):
+        now = timezone.now()
+        self.assertUsesIndex(Task.objects.filter(notified=False, due_date__lte=now).order_by('due_date', 'id'),
+                             'task_pending_due_idx')
+        self.assertUsesIndex(Notification.objects.filter(status=Notification.PENDING, available_at__lte=now),
+                             'notification_pending_idx')
+
+    def test_user_listings(self):
+        self.assertUsesIndex(Bookmark.objects.filter(user=self.user).order_by('title')[10:20], 'bookmark_user_title_idx')
+        self.assertUsesIndex(Task.objects.filter(user=self.user).order_by('-due_date', 'priority')[10:20], 'task_user_due_idx')
+        self.assertUsesIndex(Tag.objects.filter(user=self.user).order_by('name')[10:20], 'tag_user_name_idx')
@@ -0,0 +1,121 @@
+import datetime
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from main_app import search
+from main_app.models import Bookmark, SearchDocument, Task
+
+
+class NormalizeTest(TestCase):
+
+    def test_strips_tashkeel_and_tatweel(self):
+        self.assertEqual(search.normalize('مُحَمَّدٌ'), 'محمد')
+        self.assertEqual(search.normalize('كتـــاب'), 'كتاب')
+
+    def test_unifies_letter_variants(self):
+        self.assertEqual(search.normalize('أإآٱ'), 'اااا')
+        self.assertEqual(search.normalize('مدرسة'), 'مدرسه')
+        self.assertEqual(search.normalize('مستشفى'), 'مستشفي')
+        self.assertEqual(search.normalize('مؤتمر شاطئ'), 'موتمر شاطي')
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('Django و الـبحث: https://x.org'), ['django', 'و', 'البحث', 'https', 'x', 'org'])
+
+
+class SearchBackendMixin:
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        cls.other = User.objects.create_user('bar', 'bar@email.com', '123456')
+
+    def setUp(self):
+        # documents are indexed by the backend active when they are saved
+        self.title_match = Bookmark.objects.create(title='مكتبة الجامعة', descr='', url='', user=self.user)
+        self.body_match = Bookmark.objects.create(title='قراءة', descr='زيارة المكتبة والمَكْتَبَة', url='https://library.example', user=self.user)
+        self.task = Task.objects.create(
+            name='إعادة كتاب المكتبة', descr='قبل الموعد', priority=1,
+            due_date=timezone.now() + datetime.timedelta(days=1), user=self.user,
+        )
+        Bookmark.objects.create(title='مكتبة أخرى', descr='', url='', user=self.other)
+
+    def test_matches_normalized_text(self):
+        self.assertEqual(set(search.search(self.user, 'مكتبه')), {self.title_match})
+        self.assertEqual(set(search.search(self.user, 'المكتبة')), {self.body_match, self.task})
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(search.search(self.user, 'كتاب المكتبة'), [self.task])
+        self.assertEqual(search.search(self.user, 'كتاب الجامعة'), [])
+
+    def test_title_ranks_first(self):
+        Bookmark.objects.create(title='library', descr='', url='', user=self.user)
+        results = search.search(self.user, 'LIBRARY')
+        self.assertEqual(results[0].title, 'library')
+        self.assertEqual(results[1], self.body_match)
+        self.assertGreater(results[0].search_score, results[1].search_score)
+
+    def test_updates_and_deletes(self):
+        self.title_match.title = 'حديقة'
+        self.title_match.save()
+        self.assertEqual(search.search(self.user, 'مكتبة'), [])
+        self.assertEqual(search.search(self.user, 'حديقه'), [self.title_match])
+        self.title_match.delete()
+        self.assertEqual(search.search(self.user, 'حديقة'), [])
+        self.assertFalse(SearchDocument.objects.filter(object_id=self.title_match.pk, kind='bookmark').exists())
+
+    def test_rebuild(self):
+        call_command('rebuild_search_index', chunk_size=2, stdout=StringIO())
+        self.assertEqual(SearchDocument.objects.count(), 4)
+        self.assertEqual(search.search(self.user, 'كتاب'), [self.task])
+
+
+class FTS5SearchTest(SearchBackendMixin, TestCase):
+
+    def test_backend(self):
+        self.assertEqual(search.get_backend().name, 'fts5')
+
+    def test_deleted_user_leaves_no_fts_rows(self):
+        self.user.delete()
+        self.assertFalse(SearchDocument.objects.filter(user_id=self.user.pk).exists())
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT user_id FROM {search.FTS_TABLE}')
+            self.assertEqual(cursor.fetchall(), [(self.other.pk,)])
+
+
+@override_settings(SEARCH_BACKEND='tokens')
+class TokenSearchTest(SearchBackendMixin, TestCase):
+
+    def test_backend(self):
+        self.assertEqual(search.get_backend().name, 'tokens')
+
+
+class SearchViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        Bookmark.objects.create(title='مدرسة', descr='', url='', user=cls.user)
+
+    def test_login_required(self):
+        response = self.client.get(reverse('search'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_results(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('search'), {'q': 'المدرسة مدرسه'})
+        self.assertTemplateUsed(response, 'main_app/search.html')
+        self.assertEqual(len(response.context['results']), 0)
+        response = self.client.get(reverse('search'), {'q': 'مَدْرَسَة'})
+        self.assertEqual([r.title for r in response.context['results']], ['مدرسة'])
+        self.assertContains(response, 'إشارة مرجعية')
+
+    def test_empty_query(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['results'], [])
@@ -0,0 +1,128 @@
+import datetime
+import io
+import json
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from main_app import bulk, changes, importers
+from main_app.models import ApiToken, Bookmark, Change, Tag, Task
+from main_app.task_notifier import enqueue_due_tasks
+
+
+class SyncTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        cls.other = User.objects.create_user('bar', 'bar@email.com', '123456')
+        cls.key = ApiToken.issue(cls.user)[1]
+
+    def sync(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        response = self.client.get(reverse('sync'), params, HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def summary(self, data):
+        return [(c['kind'], c['id'], c.get('tag'), c['action']) for c in data['changes']]
+
+    def test_start_from_head(self):
+        Tag.objects.create(name='old', user=self.user)
+        head = self.sync()
+        self.assertEqual(head['changes'], [])
+        self.assertEqual(self.sync(head['next'])['changes'], [])
+        tag = Tag.objects.create(name='new', user=self.user)
+        self.assertEqual(self.summary(self.sync(head['next'])), [('tag', tag.pk, None, 'save')])
+
+    def test_saves_deletes_and_tags(self):
+        token = self.sync()['next']
+        tag = Tag.objects.create(name='tag', user=self.user)
+        bookmark = Bookmark.objects.create(title='first', descr='', url='https://example.com', user=self.user)
+        bookmark.tags.add(tag)
+        bookmark.title = 'second'
+        bookmark.save()
+        task = Task.objects.create(name='task', descr='', priority=1, user=self.user,
+                                   due_date=timezone.now() + datetime.timedelta(days=1))
+        task.tags.add(tag)
+        task_id = task.pk
+        task.delete()
+        Bookmark.objects.create(title='not mine', descr='', url='https://example.com', user=self.other)
+
+        data = self.sync(token)
+        self.assertEqual(self.summary(data), [
+            ('tag', tag.pk, None, 'save'),
+            ('bookmark_tag', bookmark.pk, tag.pk, 'add'),
+            ('bookmark', bookmark.pk, None, 'save'),
+            ('task_tag', task_id, tag.pk, 'add'),
+            ('task', task_id, None, 'delete'),
+        ])
+        self.assertEqual(data['changes'][2]['data']['title'], 'second')
+        self.assertEqual(data['changes'][2]['data']['tags'], ['tag'])
+        self.assertFalse(data['more'])
+
+        token = data['next']
+        tag.bookmark_set.remove(bookmark)
+        bookmark.tags.add(tag)
+        bookmark.tags.clear()
+        self.assertEqual(self.summary(self.sync(token)), [('bookmark_tag', bookmark.pk, tag.pk, 'remove')])
+
+    def test_paging(self):
+        token = self.sync()['next']
+        tags = [Tag.objects.create(name=f'tag {i}', user=self.user) for i in range(5)]
+        deleted = tags[1].pk
+        tags[1].delete()
+        first = self.sync(token, limit=3)
+        self.assertTrue(first['more'])
+        # tag 1 was deleted later: its save is left out and its tombstone follows
+        self.assertEqual([c['id'] for c in first['changes']], [tags[0].pk, tags[2].pk])
+        rest = self.sync(first['next'], limit=3)
+        self.assertEqual(self.summary(rest), [('tag', tags[3].pk, None, 'save'), ('tag', tags[4].pk, None, 'save'),
+                                              ('tag', deleted, None, 'delete')])
+        self.assertFalse(rest['more'])
+
+    def test_cost_follows_changes(self):
+        token = self.sync()['next']
+        Tag.objects.create(name='tag', user=self.user)
+        for i in range(50):
+            Bookmark.objects.create(title=f'other {i}', descr='', url=f'https://example.com/{i}', user=self.other)
+        with CaptureQueriesContext(connection) as queries:
+            changes.since(self.user, int(token), 100)
+        self.assertEqual(len(queries), 2)
+
+    def test_bulk_writes_are_logged(self):
+        token = self.sync()['next']
+        tag = Tag.objects.create(name='tag', user=self.user)
+        results = bulk.create(self.user, 'bookmarks', [{'title': 'b', 'url': 'https://example.com', 'tags': [tag.pk]}])
+        pk = results[0]['id']
+        bulk.update(self.user, 'bookmarks', [{'id': pk, 'tags': []}])
+        importers.import_bookmarks(self.user, io.BytesIO(json.dumps(
+            {'children': [{'title': 'Folder', 'children': [{'title': 'x', 'uri': 'https://example.org'}]}]}).encode()))
+        imported = Bookmark.objects.get(url='https://example.org')
+        task = Task.objects.create(name='task', descr='', priority=1, user=self.user, due_date=timezone.now())
+        enqueue_due_tasks(Task, timezone.now(), batch_size=10)
+        bulk.delete(self.user, 'tasks', [task.pk])
+
+        self.assertEqual(self.summary(self.sync(token)), [
+            ('tag', tag.pk, None, 'save'),
+            ('bookmark', pk, None, 'save'),
+            ('bookmark_tag', pk, tag.pk, 'remove'),
+            ('tag', Tag.objects.get(name='Folder').pk, None, 'save'),
+            ('bookmark', imported.pk, None, 'save'),
+            ('bookmark_tag', imported.pk, Tag.objects.get(name='Folder').pk, 'add'),
+            ('task', task.pk, None, 'delete'),
+        ])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(reverse('sync'), {'since': 0}).status_code, 401)
+        response = self.client.get(reverse('sync'), {'since': 'x'}, HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(response.status_code, 400)
+        for limit in (0, -1):
+            response = self.client.get(reverse('sync'), {'since': 0, 'limit': limit}, HTTP_AUTHORIZATION=f'Token {self.key}')
+            self.assertEqual(response.status_code, 400)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('sync'), {'since': 0}).status_code, 200)
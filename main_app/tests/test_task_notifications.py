@@ -1,13 +1,19 @@
 from datetime import timedelta
+from unittest import mock
 import time
 
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.conf import settings
+from django.core import mail
+from django.template import loader
+from django.db import DatabaseError, connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 
-from main_app.models import Task
-from main_app.task_notifier import send_task_notifications
+from main_app.models import Task, Notification, NotifierRun
+from main_app import task_notifier
+from main_app.task_notifier import send_task_notifications, claim_rows, enqueue_due_tasks, drain_outbox, next_outbox_retry, notifier_metrics, MessageBuilder, TaskScheduler
 
 class TaskNotifierTest(TestCase):
 
@@ -25,3 +31,267 @@ class TaskNotifierTest(TestCase):
             self.assertTrue(task.notified)
         task = Task.objects.get(id=num_of_tasks)
         self.assertFalse(task.notified)
+
+    def test_batched_drain_queries(self):
+        settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+        def drain_queries(num_of_tasks):
+            for i in range(num_of_tasks):
+                user = User.objects.create_user(f'user{num_of_tasks}-{i}', f'user{i}@email.com', '123456')
+                Task.objects.create(name=f'task {i}', descr='', priority=1, due_date=timezone.now(), user=user)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(send_task_notifications(Task, batch_size=100), num_of_tasks)
+            return len(queries)
+
+        # the number of queries depends on the number of batches, not of tasks or users
+        self.assertEqual(drain_queries(3), drain_queries(30))
+        self.assertFalse(Task.objects.filter(notified=False).exists())
+        self.assertEqual(len(mail.outbox), 33)
+
+    def test_precompiled_templates_render_like_loader(self):
+        context = {'tasks': [{'name': '<b>', 'url': 'https://example.com/task/1'}],
+                   'task_name': '<b>', 'task_url': 'https://example.com/task/1'}
+        builder = MessageBuilder('https://example.com')
+        for _ in range(2):
+            self.assertEqual(builder.render(context), (
+                loader.render_to_string('task_notification_body.txt', context),
+                loader.render_to_string('task_notification_body.html', context),
+            ))
+
+    def test_run_metrics_are_recorded(self):
+        user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        for i in range(3):
+            Task.objects.create(name=f'task {i}', descr='', priority=1, due_date=timezone.now() - timedelta(seconds=30), user=user)
+        Task.objects.create(name='later', descr='', priority=1, due_date=timezone.now() + timedelta(days=1), user=user)
+        send_task_notifications(Task)
+        run = NotifierRun.objects.get()
+        self.assertEqual((run.queued, run.sent, run.failed, run.backlog), (3, 3, 0, 0))
+        self.assertGreaterEqual(run.lag_max, 30)
+        self.assertGreaterEqual(run.lag_max, run.lag_avg)
+
+        metrics = notifier_metrics()
+        self.assertEqual(metrics['recent']['runs'], 1)
+        self.assertEqual(metrics['recent']['sent'], 3)
+        self.assertEqual(metrics['last_run']['sent'], 3)
+        self.assertEqual(metrics['backlog'], {'due_tasks': 0, 'pending_notifications': 0, 'dead_notifications': 0})
+
+
+class TaskClaimTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        for i in range(5):
+            Task.objects.create(name=f'task {i}', descr='', priority=1, due_date=timezone.now(), user=self.user)
+        self.due = Task.objects.filter(notified=False, due_date__lte=timezone.now()).order_by('due_date', 'id')
+
+    def test_workers_claim_disjoint_tasks(self):
+        lease = timedelta(minutes=5)
+        token1, ids1 = claim_rows(self.due, 3, lease)
+        token2, ids2 = claim_rows(self.due, 3, lease)
+        _, ids3 = claim_rows(self.due, 3, lease)
+        self.assertEqual(len(ids1), 3)
+        self.assertEqual(len(ids2), 2)
+        self.assertEqual(ids3, [])
+        self.assertFalse(set(ids1) & set(ids2))
+        self.assertEqual(Task.objects.filter(claim_token=token1).count(), 3)
+
+    def test_expired_lease_can_be_reclaimed(self):
+        _, ids = claim_rows(self.due, 5, timedelta(minutes=5))
+        Task.objects.filter(pk__in=ids[:2]).update(claimed_until=timezone.now() - timedelta(seconds=1))
+        _, reclaimed = claim_rows(self.due, 5, timedelta(minutes=5))
+        self.assertEqual(sorted(reclaimed), sorted(ids[:2]))
+
+    def test_claimed_tasks_are_not_queued_twice(self):
+        _, ids = claim_rows(self.due, 2, timedelta(minutes=5))
+        self.assertEqual(enqueue_due_tasks(Task, timezone.now(), 10), 3)
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertEqual(set(Task.objects.filter(notified=False).values_list('id', flat=True)), set(ids))
+
+
+class FailingDispatcher:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def send(self, messages):
+        return [False] * len(messages)
+
+
+class NotificationOutboxTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        self.task = Task.objects.create(name='task', descr='', priority=1, due_date=timezone.now(), user=self.user)
+
+    def test_due_task_is_queued_once(self):
+        self.assertEqual(enqueue_due_tasks(Task, timezone.now(), 10), 1)
+        self.assertEqual(enqueue_due_tasks(Task, timezone.now(), 10), 0)
+        self.task.refresh_from_db()
+        self.assertTrue(self.task.notified)
+        self.assertEqual(Notification.objects.get().status, Notification.PENDING)
+
+    def test_drain_marks_sent(self):
+        enqueue_due_tasks(Task, timezone.now(), 10)
+        self.assertEqual(drain_outbox(10), (1, 0))
+        notification = Notification.objects.get()
+        self.assertEqual(notification.status, Notification.SENT)
+        self.assertIsNotNone(notification.sent_at)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIsNone(next_outbox_retry())
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=2, NOTIFICATION_RETRY_DELAY=60)
+    def test_failed_delivery_is_retried_then_dead_lettered(self):
+        enqueue_due_tasks(Task, timezone.now(), 10)
+        with mock.patch('main_app.task_notifier.get_dispatcher', FailingDispatcher):
+            self.assertEqual(drain_outbox(10), (0, 1))
+            notification = Notification.objects.get()
+            self.assertEqual((notification.status, notification.attempts), (Notification.PENDING, 1))
+            self.assertGreater(notification.available_at, timezone.now() + timedelta(seconds=50))
+            self.assertEqual(next_outbox_retry(), notification.available_at)
+            # not retried before its backoff runs out
+            self.assertEqual(drain_outbox(10), (0, 0))
+            Notification.objects.update(available_at=timezone.now())
+            self.assertEqual(drain_outbox(10), (0, 1))
+        notification = Notification.objects.get()
+        self.assertEqual((notification.status, notification.attempts), (Notification.DEAD, 2))
+        self.assertIsNone(next_outbox_retry())
+
+    def test_orphaned_task_is_dead_lettered(self):
+        enqueue_due_tasks(Task, timezone.now(), 10)
+        self.user.delete()
+        self.assertEqual(drain_outbox(10), (0, 1))
+        self.assertEqual(Notification.objects.get().status, Notification.DEAD)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class TaskSchedulerTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        self.scheduler = TaskScheduler(Task, preload=10, resync_interval=300)
+        task_notifier._scheduler = self.scheduler
+
+    def tearDown(self):
+        task_notifier._scheduler = None
+
+    def create_task(self, due_date, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Task.objects.create(name='task', descr='', priority=1, due_date=due_date, user=self.user, **kwargs)
+
+    def test_sleeps_until_earliest_due_date(self):
+        later = self.create_task(timezone.now() + timedelta(hours=2))
+        sooner = self.create_task(timezone.now() + timedelta(minutes=5))
+        self.scheduler.resync()
+        self.assertEqual(self.scheduler.next_due(), sooner.due_date)
+        self.assertAlmostEqual(self.scheduler.step(), 300, delta=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            sooner.delete()
+        self.assertEqual(self.scheduler.next_due(), later.due_date)
+
+    def test_idle_scheduler_does_not_query(self):
+        self.scheduler.resync()
+        with self.assertNumQueries(0):
+            timeout = self.scheduler.step()
+        self.assertGreater(timeout, 0)
+
+    def test_saved_task_rearms_scheduler(self):
+        self.scheduler.resync()
+        task = self.create_task(timezone.now() + timedelta(minutes=1))
+        self.assertEqual(self.scheduler.next_due(), task.due_date)
+        task.due_date = timezone.now() + timedelta(minutes=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            task.save()
+        self.assertEqual(self.scheduler.next_due(), task.due_date)
+        task.notified = True
+        with self.captureOnCommitCallbacks(execute=True):
+            task.save()
+        self.assertIsNone(self.scheduler.next_due())
+
+    def test_rolled_back_task_is_not_armed(self):
+        self.scheduler.resync()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Task.objects.create(name='task', descr='', priority=1, due_date=timezone.now() + timedelta(minutes=1), user=self.user)
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+        self.assertIsNone(self.scheduler.next_due())
+
+    def test_due_task_is_notified(self):
+        settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+        self.scheduler.resync()
+        task = self.create_task(timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.scheduler.step(), 0)
+        task.refresh_from_db()
+        self.assertTrue(task.notified)
+        self.assertIsNone(self.scheduler.next_due())
+
+    def test_tasks_past_horizon_are_loaded_later(self):
+        for i in range(15):
+            self.create_task(timezone.now() + timedelta(minutes=i + 1))
+        self.scheduler.resync()
+        self.assertEqual(len(self.scheduler._armed), 10)
+        late = self.create_task(timezone.now() + timedelta(days=1))
+        self.assertNotIn(late.id, self.scheduler._armed)
+
+    def test_applies_changes_published_by_other_processes(self):
+        self.scheduler.resync()
+        due_date = timezone.now() + timedelta(minutes=1)
+        self.scheduler.apply(f'42 0 {due_date.isoformat()}')
+        self.assertEqual(self.scheduler.next_due(), due_date)
+        self.scheduler.apply('42 1 ' + due_date.isoformat())
+        self.assertIsNone(self.scheduler.next_due())
+        self.scheduler.apply(f'43 0 {due_date.isoformat()}')
+        self.scheduler.apply('43')
+        self.assertIsNone(self.scheduler.next_due())
+
+
+@override_settings(NOTIFICATION_DIGEST_WINDOW=60)
+class NotificationDigestTest(TestCase):
+
+    def setUp(self):
+        self.user1 = User.objects.create_user('foo', 'foo@email.com', '123456')
+        self.user2 = User.objects.create_user('bar', 'bar@email.com', '123456')
+
+    def create_tasks(self, user, count):
+        for i in range(count):
+            Task.objects.create(name=f'{user.username} task {i}', descr='', priority=1, due_date=timezone.now(), user=user)
+
+    def test_reminders_are_held_for_the_window(self):
+        self.create_tasks(self.user1, 2)
+        enqueue_due_tasks(Task, timezone.now(), 10)
+        self.assertEqual(drain_outbox(10), (0, 0))
+        self.assertAlmostEqual((next_outbox_retry() - timezone.now()).total_seconds(), 60, delta=5)
+
+    def test_one_email_per_user(self):
+        self.create_tasks(self.user1, 3)
+        enqueue_due_tasks(Task, timezone.now(), 10)
+        # reminders queued later join the window their user already has open
+        self.create_tasks(self.user1, 2)
+        self.create_tasks(self.user2, 1)
+        enqueue_due_tasks(Task, timezone.now(), 10)
+        self.assertEqual(Notification.objects.filter(task__user=self.user1).values('available_at').distinct().count(), 1)
+
+        Notification.objects.update(available_at=timezone.now())
+        self.assertEqual(drain_outbox(10), (6, 0))
+        self.assertEqual(len(mail.outbox), 2)
+        digest = next(message for message in mail.outbox if message.to == ['foo@email.com'])
+        self.assertIn('5', digest.subject)
+        for i in range(3):
+            self.assertIn(f'foo task {i}', digest.body)
+        single = next(message for message in mail.outbox if message.to == ['bar@email.com'])
+        self.assertIn('"bar task 0"', single.subject)
+
+    def test_digest_larger_than_a_batch(self):
+        self.create_tasks(self.user1, 7)
+        self.create_tasks(self.user2, 2)
+        enqueue_due_tasks(Task, timezone.now(), 3)
+        Notification.objects.update(available_at=timezone.now())
+        self.assertEqual(drain_outbox(3), (9, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['bar@email.com', 'foo@email.com'])
+        digest = next(message for message in mail.outbox if message.to == ['foo@email.com'])
+        self.assertIn('7', digest.subject)
@@ -0,0 +1,83 @@
+import datetime
+from django.core.cache import cache
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from main_app.models import Bookmark, Task, Tag
+
+
+class TagExtrasTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        cls.tags = [Tag.objects.create(name=f'tag {i}', user=cls.user) for i in range(40)]
+        cls.bookmarks = []
+        for i in range(5):
+            bookmark = Bookmark.objects.create(title=f'bookmark {i}', descr='', url='', user=cls.user)
+            bookmark.tags.set(cls.tags[i:i + 10])
+            cls.bookmarks.append(bookmark)
+        cls.task = Task.objects.create(name='task', descr='', priority=1, due_date=timezone.now() + datetime.timedelta(days=1), user=cls.user)
+        cls.task.tags.set(cls.tags)
+
+    def test_detail_page_tags_in_one_query(self):
+        self.client.force_login(self.user)
+        url = reverse('task-detail', kwargs={'pk': self.task.pk})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        tag_queries = [q for q in queries if 'main_app_tag' in q['sql']]
+        self.assertEqual(len(tag_queries), 1)
+        for tag in self.tags:
+            self.assertContains(response, f'<a href="{tag.get_absolute_url()}">{tag.name}</a>')
+
+    def test_list_page_tags_in_one_query(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('bookmarks'))
+        tag_queries = [q for q in queries if 'main_app_tag' in q['sql']]
+        self.assertEqual(len(tag_queries), 1)
+        for tag in self.tags[:14]:
+            self.assertContains(response, f'<a href="{tag.get_absolute_url()}">{tag.name}</a>')
+
+    def test_prefetch_tags_for_a_page(self):
+        template = Template(
+            '{% load tag_extras %}{% prefetch_tags bookmarks %}'
+            '{% for bookmark in bookmarks %}{% object_tags bookmark %}|{% endfor %}'
+        )
+        with self.assertNumQueries(1):
+            rendered = template.render(Context({'bookmarks': self.bookmarks}))
+        parts = rendered.split('|')
+        self.assertEqual(parts[0].count('<a '), 10)
+        self.assertIn('tag 0<', parts[0])
+        self.assertNotIn('tag 0<', parts[1])
+
+    def test_cached_object_not_refetched(self):
+        template = Template('{% load tag_extras %}{% object_tags bookmark %}{% object_tags bookmark %}')
+        with self.assertNumQueries(1):
+            template.render(Context({'bookmark': self.bookmarks[0]}))
+
+    def test_tag_names_are_escaped(self):
+        tag = Tag.objects.create(name='<b>x</b>', user=self.user)
+        bookmark = Bookmark.objects.create(title='escaped', descr='', url='', user=self.user)
+        bookmark.tags.add(tag)
+        rendered = Template('{% load tag_extras %}{% object_tags bookmark %}').render(Context({'bookmark': bookmark}))
+        self.assertIn('&lt;b&gt;x&lt;/b&gt;', rendered)
+
+
+class SvgIconsTest(TestCase):
+
+    def test_links_match_reverse(self):
+        template = Template('{% load svg_icons %}{% update_icon obj %}{% delete_icon obj %}')
+        for obj in (Bookmark(id=7), Task(id=1234), Tag(id=99999)):
+            name = obj._meta.model_name
+            rendered = template.render(Context({'obj': obj}))
+            self.assertIn(f'<a href="{reverse(f"{name}-update", args=[obj.id])}" class="svgicon"><svg', rendered)
+            self.assertIn(f'<a href="{reverse(f"{name}-delete", args=[obj.id])}" class="svgicon"><svg', rendered)
+            self.assertIn('bi-pencil', rendered)
+            self.assertIn('bi-x-square', rendered)
@@ -1,10 +1,13 @@
 import datetime
 from django.utils import timezone
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
 
 from main_app.models import Bookmark, Task, Tag
+from main_app.views import TagDetailView
 
 class BookmarkListViewTest(TestCase):
 
@@ -339,6 +342,36 @@ class BookmarkOpsTest(TestCase):
         self.assertEqual(updated_bookmark.descr, 'foo descr')
         self.assertEqual(updated_bookmark.url, 'https://google.com')
 
+    def test_create_deduplicates_normalized_urls(self):
+        Bookmark.objects.create(title='bookmark1', descr='description', url='http://Example.com/?utm_source=x', user=self.user1)
+        Bookmark.objects.create(title='bookmark2', descr='description', url='https://example.com', user=self.user2)
+        self.client.force_login(self.user1)
+        data = {
+            'title': 'again',
+            'descr': '',
+            'url': 'https://example.com:443/',
+            'tags': [],
+        }
+        post_response = self.client.post('/bookmark/create/', data)
+        self.assertRedirects(post_response, '/bookmark/1')
+        self.assertEqual(Bookmark.objects.filter(user=self.user1).count(), 1)
+        self.assertEqual(Bookmark.objects.get(pk=1).title, 'again')
+
+    def test_update_rejects_duplicate_url(self):
+        Bookmark.objects.create(title='bookmark1', descr='description', url='https://example.com', user=self.user1)
+        Bookmark.objects.create(title='bookmark2', descr='description', url='https://google.com', user=self.user1)
+        self.client.force_login(self.user1)
+        data = {
+            'title': 'bookmark2',
+            'descr': 'description',
+            'url': 'http://EXAMPLE.com/',
+            'tags': [],
+        }
+        response = self.client.post('/bookmark/2/update/', data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('url', response.context['form'].errors)
+        self.assertEqual(Bookmark.objects.get(pk=2).url, 'https://google.com')
+
     def test_delete(self):
         Bookmark.objects.create(title='bookmark1', descr='description', url='https://example.com', user=self.user1)
         self.client.force_login(self.user1)
@@ -478,3 +511,233 @@ class TagOpsTest(TestCase):
         post_response = self.client.post('/tag/1/delete/')
         self.assertRedirects(post_response, '/tag/')
 
+
+
+class NotifierStatsViewTest(TestCase):
+
+    def test_staff_only(self):
+        response = self.client.get(reverse('notifier-stats'))
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(User.objects.create_user('foo', 'foo@email.com', '123456'))
+        response = self.client.get(reverse('notifier-stats'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_metrics(self):
+        self.client.force_login(User.objects.create_user('admin', 'admin@email.com', '123456', is_staff=True))
+        response = self.client.get(reverse('notifier-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['backlog']['pending_notifications'], 0)
+        self.assertIsNone(response.json()['last_run'])
+
+
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        due_date = timezone.now() + datetime.timedelta(days=1)
+        for i in range(25):
+            Bookmark.objects.create(title=f'bookmark {i % 7}', descr='', url='', user=cls.user)
+            # repeated due dates and priorities exercise the id tiebreaker
+            Task.objects.create(name=f'task {i}', descr='', priority=i % 3, due_date=due_date + datetime.timedelta(hours=i % 4), user=cls.user)
+            Tag.objects.create(name=f'tag {i:02}', user=cls.user)
+
+    def assertKeysetMatchesOffset(self, url_name, list_name, queryset):
+        self.client.force_login(self.user)
+        expected = list(queryset)
+        pages = []
+        response = self.client.get(reverse(url_name) + '?cursor=')
+        while True:
+            page = response.context['page_obj']
+            self.assertTrue(page.is_keyset)
+            self.assertLessEqual(len(page), 10)
+            pages.append(list(response.context[list_name]))
+            if not page.has_next():
+                break
+            response = self.client.get(reverse(url_name) + f'?cursor={page.next_cursor}')
+        self.assertEqual([obj for page_objects in pages for obj in page_objects], expected)
+
+        # walking back from the last page gives the same pages
+        for previous_page in reversed(pages[:-1]):
+            self.assertTrue(page.has_previous())
+            response = self.client.get(reverse(url_name) + f'?cursor={page.previous_cursor}')
+            page = response.context['page_obj']
+            self.assertEqual(list(response.context[list_name]), previous_page)
+        self.assertFalse(page.has_previous())
+
+    def test_bookmarks(self):
+        self.assertKeysetMatchesOffset('bookmarks', 'bookmark_list', Bookmark.objects.order_by('title', 'id'))
+
+    def test_tasks(self):
+        self.assertKeysetMatchesOffset('tasks', 'task_list', Task.objects.order_by('-due_date', 'priority', 'id'))
+
+    def test_tags(self):
+        self.assertKeysetMatchesOffset('tags', 'tag_list', Tag.objects.order_by('name', 'id'))
+
+    def test_no_count_query(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('bookmarks') + '?cursor=')
+        cursor = response.context['page_obj'].next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('bookmarks') + f'?cursor={cursor}')
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+        self.assertContains(response, f'?cursor={response.context["page_obj"].previous_cursor}')
+
+    def test_invalid_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('bookmarks') + '?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(KEYSET_PAGINATION=True)
+    def test_enabled_by_setting(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('tags'))
+        self.assertTrue(response.context['page_obj'].is_keyset)
+
+
+class DetailViewOwnershipTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('foo', 'foo@email.com', '123456')
+        cls.other = User.objects.create_user('bar', 'bar@email.com', '123456')
+        tag = Tag.objects.create(name='tag', user=cls.owner)
+        bookmark = Bookmark.objects.create(title='bookmark', descr='', url='', user=cls.owner)
+        task = Task.objects.create(name='task', descr='', priority=1, due_date=timezone.now(), user=cls.owner)
+        cls.objects = {'bookmark-detail': bookmark, 'task-detail': task, 'tag-detail': tag}
+
+    def test_status_table(self):
+        table = [
+            (None, True, 302),
+            (self.owner, True, 200),
+            (self.other, True, 403),
+            (self.owner, False, 404),
+            (self.other, False, 404),
+        ]
+        for url_name, obj in self.objects.items():
+            for user, exists, status in table:
+                with self.subTest(url_name=url_name, user=user, exists=exists):
+                    self.client.logout()
+                    if user is not None:
+                        self.client.force_login(user)
+                    pk = obj.pk if exists else obj.pk + 1000
+                    response = self.client.get(reverse(url_name, kwargs={'pk': pk}))
+                    self.assertEqual(response.status_code, status)
+
+    def test_object_fetched_once(self):
+        self.client.force_login(self.owner)
+        for url_name, obj in self.objects.items():
+            with self.subTest(url_name=url_name):
+                lookup = f'"{obj._meta.db_table}"."id" = {obj.pk}'
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(reverse(url_name, kwargs={'pk': obj.pk}))
+                self.assertEqual(sum(lookup in q['sql'] for q in queries), 1)
+
+
+class TagDetailSectionsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        cls.tag = Tag.objects.create(name='shared', user=cls.user)
+        # same name, different tag: must not leak into the page
+        other = Tag.objects.create(name='shared', user=User.objects.create_user('bar', 'bar@email.com', '123456'))
+        stray = Bookmark.objects.create(title='stray', descr='', url='', user=other.user)
+        stray.tags.add(other)
+        cls.bookmarks = []
+        for i in range(45):
+            bookmark = Bookmark.objects.create(title=f'bookmark {i}', descr='', url='', user=cls.user)
+            bookmark.tags.add(cls.tag)
+            cls.bookmarks.append(bookmark)
+        cls.task = Task.objects.create(name='task', descr='', priority=1, due_date=timezone.now(), user=cls.user)
+        cls.task.tags.add(cls.tag)
+
+    def test_sections_are_paginated_independently(self):
+        self.client.force_login(self.user)
+        url = reverse('tag-detail', kwargs={'pk': self.tag.pk})
+        seen = []
+        response = self.client.get(url)
+        while True:
+            self.assertEqual(list(response.context['tasks']), [self.task])
+            seen.extend(response.context['bookmarks'])
+            next_url = response.context['bookmarks_pagination']['next_url']
+            if next_url is None:
+                break
+            self.assertContains(response, f'href="{next_url.replace("&", "&amp;")}"')
+            response = self.client.get(next_url)
+        self.assertEqual(seen, sorted(self.bookmarks, key=lambda b: -b.id))
+        self.assertNotIn('stray', response.content.decode())
+
+    def test_page_size_is_bounded(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('tag-detail', kwargs={'pk': self.tag.pk}))
+        self.assertEqual(len(response.context['bookmarks']), TagDetailView.paginate_by)
+
+    def test_invalid_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('tag-detail', kwargs={'pk': self.tag.pk}) + '?tasks_cursor=nope')
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('foo', 'foo@email.com', '123456')
+        cls.bookmark = Bookmark.objects.create(title='bookmark', descr='about', url='', user=cls.user)
+        cls.task = Task.objects.create(name='task', descr='', priority=1, user=cls.user,
+                                       due_date=timezone.now() + datetime.timedelta(hours=1))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in (reverse('index'), reverse('bookmarks'), reverse('tasks'), reverse('tags'),
+                    reverse('bookmark-detail', kwargs={'pk': self.bookmark.pk}),
+                    reverse('task-detail', kwargs={'pk': self.task.pk})):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.has_header('ETag'))
+                self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+    def test_304_without_rendering(self):
+        url = reverse('bookmarks')
+        response = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+        self.assertFalse(any('main_app_bookmark' in q['sql'] for q in queries))
+
+    def test_last_modified(self):
+        url = reverse('bookmarks')
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_invalidate(self):
+        url = reverse('bookmarks')
+        response = self.client.get(url)
+        self.bookmark.title = 'renamed'
+        self.bookmark.save()
+        response = self.revalidate(url, response)
+        self.assertContains(response, 'renamed')
+
+        url = reverse('tags')
+        response = self.client.get(url)
+        Bookmark.objects.get(pk=self.bookmark.pk).delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_passing_due_date_invalidates_task_pages(self):
+        url = reverse('tasks')
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Last-Modified'))
+        Task.objects.filter(pk=self.task.pk).update(due_date=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertContains(self.revalidate(url, response), '(مضى)')
+
+    def test_updated_timestamp(self):
+        before = self.bookmark.updated
+        self.bookmark.save()
+        self.assertGreater(self.bookmark.updated, before)
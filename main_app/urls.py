@@ -13,6 +13,7 @@ urlpatterns = [
     path('bookmark/', views.BookmarkListView.as_view(), name='bookmarks'),
     path('bookmark/<int:pk>', views.BookmarkDetailView.as_view(), name='bookmark-detail'),
     path('bookmark/create/', views.create_bookmark, name='bookmark-create'),
+    path('bookmark/import/', views.import_bookmark_file, name='bookmark-import'),
     path('bookmark/<int:bookmark_id>/update/', views.update_bookmark, name='bookmark-update'),
     path('bookmark/<int:bookmark_id>/delete/', views.delete_bookmark, name='bookmark-delete'),
 
@@ -21,11 +22,21 @@ urlpatterns = [
     path('task/create/', views.create_task, name='task-create'),
     path('task/<int:task_id>/update/', views.update_task, name='task-update'),
     path('task/<int:task_id>/delete/', views.delete_task, name='task-delete'),
+    path('task/calendar/', views.task_calendar, name='task-calendar'),
+    path('calendar/<str:token>.ics', views.calendar_feed, name='task-calendar-feed'),
     
     path('tag/', views.TagListView.as_view(), name='tags'),
     path('tag/<int:pk>', views.TagDetailView.as_view(), name='tag-detail'),
     path('tag/create/', views.create_tag, name='tag-create'),
     path('tag/<int:tag_id>/update/', views.update_tag, name='tag-update'),
     path('tag/<int:tag_id>/delete/', views.delete_tag, name='tag-delete'),
+
+    path('search/', views.search, name='search'),
+    path('export/<str:kind>.<str:format>', views.export, name='export'),
+
+    path('api/<str:kind>/', views.api_collection, name='api-collection'),
+    path('sync/', views.sync, name='sync'),
+
+    path('notifier/stats/', views.notifier_stats, name='notifier-stats'),
     
 ]
@@ -1,33 +1,138 @@
+import hashlib
+import json
+import logging
 from datetime import datetime
+from pathlib import Path
 from django.http.response import HttpResponseRedirect
 from django.utils import timezone
 from django.shortcuts import render, get_object_or_404
 from django.views import generic
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
 from django.urls import reverse
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.db import transaction
 from django.urls import reverse_lazy
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ValidationError, PermissionDenied
 
-from .models import Bookmark, Task, Tag
-from .forms import BookmarkForm, TaskForm, TagForm, UserRegistrationForm
+from .models import ApiToken, Bookmark, CalendarFeed, Task, Tag, UserCounters, api_key_hash, new_feed_token, url_hash
+from .forms import BookmarkForm, BookmarkImportForm, TaskForm, TagForm, UserRegistrationForm
+from .counters import get_counters, request_counters
+from .pagination import CountedPaginator, KeysetPaginator, InvalidCursor
+from .task_notifier import notifier_metrics
+from . import search as search_index
+from .importers import InvalidImportFile, import_bookmarks
+from . import bulk, changes, exporters, ics
 
+logger = logging.getLogger(__name__)
 
+
+def _code_digest():
+    """A digest of the templates and the code that renders pages: the same in every worker of a release."""
+    app = Path(__file__).resolve().parent
+    digest = hashlib.md5()
+    for path in sorted([*app.glob('templates/**/*.*'), *app.glob('templatetags/*.py'), Path(__file__).resolve()]):
+        digest.update(f'{path.relative_to(app)}\0'.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+# a release may render pages differently, so validators from the previous one must not match
+_ETAG_SALT = _code_digest()
+
+
+def next_due_date(user, now):
+    """The user's next upcoming due date, after which task pages mark one more task as past."""
+    return (Task.objects.filter(user=user, due_date__gt=now)
+            .order_by('due_date').values_list('due_date', flat=True).first())
+
+
+def user_data_etag(request, *args, **kwargs):
+    """ETag of every page that only shows the user's data: changes whenever any of it does."""
+    if not request.user.is_authenticated:
+        return None
+    version = request_counters(request).version
+    return hashlib.md5(f'{_ETAG_SALT}:{request.user.pk}:{version}'.encode()).hexdigest()
+
+
+def user_data_last_modified(request, *args, **kwargs):
+    if not request.user.is_authenticated:
+        return None
+    return request_counters(request).modified
+
+
+def task_data_etag(request, *args, **kwargs):
+    """Like user_data_etag, but also changes when a due date passes."""
+    etag = user_data_etag(request)
+    if etag is None:
+        return None
+    return f'{etag}:{next_due_date(request.user, timezone.now())}'
+
+
+user_data_condition = condition(etag_func=user_data_etag, last_modified_func=user_data_last_modified)
+# no Last-Modified: a passing due date changes the page without changing the data
+task_data_condition = condition(etag_func=task_data_etag)
+
+
+@user_data_condition
 def index(request):
-    return render(request, 'index.html')
+    context = {}
+    if request.user.is_authenticated:
+        context['counters'] = request_counters(request)
+    return render(request, 'index.html', context=context)
+
+
+class KeysetPaginationMixin:
+    """Opt-in keyset pagination for list views, enabled by KEYSET_PAGINATION or a ?cursor= parameter."""
 
+    keyset_ordering = None
 
-class BookmarkListView(LoginRequiredMixin, generic.ListView):
+    def paginate_queryset(self, queryset, page_size):
+        if not (settings.KEYSET_PAGINATION or 'cursor' in self.request.GET):
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, self.keyset_ordering, page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+
+class CountedPaginationMixin:
+    """Takes the paginator's count from the user's counters instead of a COUNT(*) query."""
+
+    counter = None
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        count = getattr(request_counters(self.request), self.counter)
+        return CountedPaginator(queryset, per_page, count, orphans=orphans,
+                                allow_empty_first_page=allow_empty_first_page, **kwargs)
+
+
+@method_decorator(user_data_condition, name='get')
+class BookmarkListView(LoginRequiredMixin, KeysetPaginationMixin, CountedPaginationMixin, generic.ListView):
     model = Bookmark
     paginate_by = 10
+    counter = 'bookmarks'
+    keyset_ordering = ['title']
 
     def get_queryset(self):
         return Bookmark.objects.filter(user=self.request.user).order_by('title')
 
 
-class TaskListView(LoginRequiredMixin, generic.ListView):
+@method_decorator(task_data_condition, name='get')
+class TaskListView(LoginRequiredMixin, KeysetPaginationMixin, CountedPaginationMixin, generic.ListView):
     model = Task
     paginate_by = 10
+    counter = 'tasks'
+    keyset_ordering = ['-due_date', 'priority']
 
     def get_queryset(self):
         return Task.objects.filter(user=self.request.user).order_by('-due_date', 'priority')
@@ -35,58 +140,101 @@ class TaskListView(LoginRequiredMixin, generic.ListView):
     def get_context_data(self, *, object_list=None, **kwargs):
         context = {}
         context['now'] = timezone.now()
+        # the cached list marks past tasks, so it is only valid until the next due date passes
+        context['next_due_date'] = next_due_date(self.request.user, context['now'])
         return super().get_context_data(**context)
 
 
-class TagListView(LoginRequiredMixin, generic.ListView):
+@method_decorator(user_data_condition, name='get')
+class TagListView(LoginRequiredMixin, KeysetPaginationMixin, CountedPaginationMixin, generic.ListView):
     model = Tag
     paginate_by = 10
+    counter = 'tags'
+    keyset_ordering = ['name']
 
     def get_queryset(self):
         return Tag.objects.filter(user=self.request.user).order_by('name')
 
 
-class BookmarkDetailView(LoginRequiredMixin, UserPassesTestMixin, generic.DetailView):
-    model = Bookmark
+class OwnedObjectMixin(LoginRequiredMixin):
+    """Fetches the object through a user-scoped queryset: 404 if it does not exist, 403 if it is someone else's."""
 
-    def test_func(self):
-        return self.request.user == self.get_object().user
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
 
+    def get_object(self, queryset=None):
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            # only a miss pays for telling the two cases apart
+            if self.model.objects.filter(pk=self.kwargs.get(self.pk_url_kwarg)).exists():
+                raise PermissionDenied
+            raise
 
-class TaskDetailView(LoginRequiredMixin, UserPassesTestMixin, generic.DetailView):
-    model = Task
 
-    def test_func(self):
-        return self.request.user == self.get_object().user
+@method_decorator(user_data_condition, name='get')
+class BookmarkDetailView(OwnedObjectMixin, generic.DetailView):
+    model = Bookmark
+
+
+@method_decorator(task_data_condition, name='get')
+class TaskDetailView(OwnedObjectMixin, generic.DetailView):
+    model = Task
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = {}
         context['now'] = timezone.now()
+        context['past_due'] = self.object.due_date < context['now']
         return super().get_context_data(**context)
 
 
-class TagDetailView(LoginRequiredMixin, UserPassesTestMixin, generic.DetailView):
+@method_decorator(user_data_condition, name='get')
+class TagDetailView(OwnedObjectMixin, generic.DetailView):
     model = Tag
 
-    def test_func(self):
-        return self.request.user == self.get_object().user
+    paginate_by = 20
+
+    def section(self, name, queryset):
+        """Pages one section of the tag page on its own ?<name>_cursor= parameter, newest first."""
+        param = f'{name}_cursor'
+        paginator = KeysetPaginator(queryset, ['-id'], self.paginate_by)
+        try:
+            page = paginator.page(self.request.GET.get(param))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+
+        def url(cursor):
+            if cursor is None:
+                return None
+            query = self.request.GET.copy()
+            query[param] = cursor
+            return f'{self.request.path}?{query.urlencode()}'
+
+        return page, {'previous_url': url(page.previous_cursor), 'next_url': url(page.next_cursor)}
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['bookmarks'] = Bookmark.objects.filter(user=self.request.user, tags__name=self.object.name)
-        context['tasks'] = Task.objects.filter(user=self.request.user, tags__name=self.object.name)
+        # tags=<tag> joins on the through table's tag_id instead of matching tag names
+        bookmarks = Bookmark.objects.filter(user=self.request.user, tags=self.object).only('id', 'title')
+        tasks = Task.objects.filter(user=self.request.user, tags=self.object).only('id', 'name')
+        context['bookmarks'], context['bookmarks_pagination'] = self.section('bookmarks', bookmarks)
+        context['tasks'], context['tasks_pagination'] = self.section('tasks', tasks)
         return context
 
 
 @login_required
+@transaction.atomic
 def create_bookmark(request):
 
     if request.method == 'POST':
         form = BookmarkForm(data=request.POST)
         if form.is_valid():
+            # an indexed point lookup; the unique (user, url_hash) constraint settles concurrent submits
             bookmark = Bookmark.objects.get_or_create(
-                                            url=form.cleaned_data['url'],
-                                            user=request.user)[0]
+                                            url_hash=url_hash(form.cleaned_data['url']),
+                                            user=request.user,
+                                            defaults={'url': form.cleaned_data['url']})[0]
+            bookmark.url = form.cleaned_data['url']
             bookmark.title = form.cleaned_data['title']
             bookmark.descr = form.cleaned_data['descr']
             bookmark.tags.set(form.cleaned_data['tags'])
@@ -103,6 +251,33 @@ def create_bookmark(request):
     return render(request, 'bookmark_form.html', context=context)
 
 
+@login_required
+def import_bookmark_file(request):
+    # not atomic: the import commits chunk by chunk, so a large file does not hold one long transaction.
+    # It still runs inside the request, so the form caps the file size (BOOKMARK_IMPORT_MAX_SIZE)
+    result = None
+    if request.method == 'POST':
+        form = BookmarkImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                result = import_bookmarks(
+                    request.user, form.cleaned_data['file'],
+                    progress=lambda progress: logger.debug('importing bookmarks for %s: %s', request.user, progress),
+                )
+            except InvalidImportFile:
+                form.add_error('file', 'تعذرت قراءة الملف')
+    else:
+        form = BookmarkImportForm()
+
+    context = {
+        'form': form,
+        'result': result,
+        'max_size_mb': settings.BOOKMARK_IMPORT_MAX_SIZE // (1024 * 1024),
+    }
+
+    return render(request, 'bookmark_import.html', context=context)
+
+
 class BookmarkData(dict):
     def getlist(self, name):
         if name == 'tags':
@@ -110,6 +285,7 @@ class BookmarkData(dict):
 
 
 @login_required
+@transaction.atomic
 def update_bookmark(request, bookmark_id):
 
     bookmark = get_object_or_404(Bookmark, pk=bookmark_id, user=request.user)
@@ -120,9 +296,14 @@ def update_bookmark(request, bookmark_id):
             bookmark.title = form.cleaned_data['title']
             bookmark.descr = form.cleaned_data['descr']
             bookmark.url = form.cleaned_data['url']
-            bookmark.tags.set(form.cleaned_data['tags'])
-            bookmark.save()
-            return HttpResponseRedirect(reverse('bookmark-detail', kwargs={'pk': bookmark.id}))
+            duplicate = (Bookmark.objects.filter(user=request.user, url_hash=url_hash(bookmark.url))
+                         .exclude(pk=bookmark.pk).first())
+            if duplicate is not None:
+                form.add_error('url', f'هذا الرابط محفوظ مسبقًا في «{duplicate.title}»')
+            else:
+                bookmark.tags.set(form.cleaned_data['tags'])
+                bookmark.save()
+                return HttpResponseRedirect(reverse('bookmark-detail', kwargs={'pk': bookmark.id}))
 
     else:
         data = BookmarkData({
@@ -141,6 +322,7 @@ def update_bookmark(request, bookmark_id):
 
 
 @login_required
+@transaction.atomic
 def delete_bookmark(request, bookmark_id):
 
     bookmark = get_object_or_404(Bookmark, pk=bookmark_id, user=request.user)
@@ -157,6 +339,7 @@ def delete_bookmark(request, bookmark_id):
 
 
 @login_required
+@transaction.atomic
 def create_task(request):
 
     if request.method == 'POST':
@@ -193,6 +376,7 @@ class TaskData(dict):
 
 
 @login_required
+@transaction.atomic
 def update_task(request, task_id):
 
     task = get_object_or_404(Task, pk=task_id, user=request.user)
@@ -204,8 +388,8 @@ def update_task(request, task_id):
             task.descr = form.cleaned_data['descr']
             task.priority = form.cleaned_data['priority']
             new_due_date = timezone.make_aware(datetime.combine(form.cleaned_data['due_date'], form.cleaned_data['due_time']))
-            # FIXME: resending emails for the same tasks doesn't seem to work sometimes even though notified is updated - race condition?
-            task.notifed = new_due_date <= task.due_date
+            if new_due_date != task.due_date:
+                task.notified = False
             task.due_date = new_due_date
             task.tags.set(form.cleaned_data['tags'])
             try:
@@ -235,6 +419,7 @@ def update_task(request, task_id):
 
 
 @login_required
+@transaction.atomic
 def delete_task(request, task_id):
 
     task = get_object_or_404(Task, pk=task_id, user=request.user)
@@ -251,6 +436,7 @@ def delete_task(request, task_id):
 
 
 @login_required
+@transaction.atomic
 def create_tag(request):
 
     if request.method == 'POST':
@@ -270,6 +456,7 @@ def create_tag(request):
 
 
 @login_required
+@transaction.atomic
 def update_tag(request, tag_id):
 
     tag = get_object_or_404(Tag, pk=tag_id, user=request.user)
@@ -293,6 +480,7 @@ def update_tag(request, tag_id):
 
 
 @login_required
+@transaction.atomic
 def delete_tag(request, tag_id):
 
     tag = get_object_or_404(Tag, pk=tag_id, user=request.user)
@@ -312,3 +500,159 @@ class SignUpView(generic.CreateView):
     form_class = UserRegistrationForm
     success_url = reverse_lazy('login')
     template_name = 'registration/signup.html'
+
+
+@staff_member_required
+def notifier_stats(request):
+    return JsonResponse(notifier_metrics())
+
+
+@login_required
+def search(request):
+    query = request.GET.get('q', '').strip()
+    context = {
+        'query': query,
+        'results': search_index.search(request.user, query) if query else [],
+    }
+    return render(request, 'main_app/search.html', context=context)
+
+
+@login_required
+def export(request, kind, format):
+    if kind not in exporters.KINDS or format not in exporters.FORMATS:
+        raise Http404('Unknown export')
+    # rows are read and sent a chunk at a time while the response streams
+    response = StreamingHttpResponse(
+        exporters.export_lines(request.user, kind, format),
+        content_type=exporters.FORMATS[format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="minzam-{kind}.{format}"'
+    return response
+
+
+def calendar_feed_etag(request, token):
+    """ETag of a calendar feed: changes only with the user's tasks, and is the same in every process."""
+    task_version = (UserCounters.objects.filter(user__calendar_feed__token=token)
+                    .values_list('user_id', 'task_version').first())
+    if task_version is None:
+        return None
+    return hashlib.md5(f'{ics.FORMAT_VERSION}:{task_version[0]}:{task_version[1]}'.encode()).hexdigest()
+
+
+@condition(etag_func=calendar_feed_etag)
+def calendar_feed(request, token):
+    # no session here: the token in the URL is what calendar apps authenticate with
+    feed = get_object_or_404(CalendarFeed.objects.select_related('user'), token=token)
+    # without a counters row there was no ETag; build it so that the next poll has one
+    get_counters(feed.user)
+    root = request.build_absolute_uri('/')[:-1]
+    response = StreamingHttpResponse(
+        ics.feed_lines(feed.user, lambda pk: root + reverse('task-detail', args=[pk])),
+        content_type=ics.CONTENT_TYPE,
+    )
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+def task_calendar(request):
+    feed = CalendarFeed.objects.get_or_create(user=request.user)[0]
+    if request.method == 'POST':
+        # a new token cuts off every calendar app subscribed with the old URL
+        feed.token = new_feed_token()
+        feed.save(update_fields=['token'])
+        return HttpResponseRedirect(reverse('task-calendar'))
+
+    context = {
+        'feed_url': request.build_absolute_uri(reverse('task-calendar-feed', kwargs={'token': feed.token})),
+    }
+
+    return render(request, 'task_calendar.html', context=context)
+
+
+def api_user(request):
+    """The user of an API request: the owner of its token, or else the session's user with a valid CSRF token.
+
+    Returns the user and None, or None and a response refusing the request.
+    """
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if header.startswith('Token '):
+        token = ApiToken.objects.select_related('user').filter(key_hash=api_key_hash(header[6:].strip())).first()
+        if token is None or not token.user.is_active:
+            return None, JsonResponse({'error': 'invalid token'}, status=401)
+        return token.user, None
+    if not request.user.is_authenticated:
+        return None, JsonResponse({'error': 'authentication required'}, status=401)
+    # the view is csrf_exempt for token clients; session clients still need the CSRF token
+    rejected = CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+    if rejected is not None:
+        return None, JsonResponse({'error': 'CSRF check failed'}, status=403)
+    return request.user, None
+
+
+API_WRITES = {
+    'POST': bulk.create,
+    'PATCH': bulk.update,
+    'DELETE': bulk.delete,
+}
+
+
+@csrf_exempt
+def api_collection(request, kind):
+    """GET pages through the user's objects by id; POST, PATCH and DELETE apply a JSON array of items in bulk."""
+    if kind not in bulk.KINDS:
+        return JsonResponse({'error': 'unknown collection'}, status=404)
+    if request.method != 'GET' and request.method not in API_WRITES:
+        return JsonResponse({'error': 'method not allowed'}, status=405)
+    user, refused = api_user(request)
+    if refused is not None:
+        return refused
+
+    if request.method == 'GET':
+        try:
+            after = int(request.GET.get('after', 0))
+            limit = int(request.GET.get('limit', 100))
+            if after < 0 or limit < 1:
+                raise ValueError
+        except ValueError:
+            return JsonResponse({'error': 'after must be an integer of at least 0, limit of at least 1'}, status=400)
+        limit = min(limit, bulk.MAX_BATCH)
+        rows = exporters.page(user, kind, after, limit)
+        return JsonResponse({'results': rows, 'next': rows[-1]['id'] if len(rows) == limit else None})
+
+    try:
+        items = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'invalid JSON'}, status=400)
+    try:
+        results = API_WRITES[request.method](user, kind, items)
+    except bulk.BatchError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'results': results})
+
+
+@csrf_exempt
+def sync(request):
+    """Changes to the user's data after ?since=<token>, oldest first, with tombstones for deletions.
+
+    Without a token, returns the current one: a client fetches everything
+    through the API after that, then syncs from it.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'method not allowed'}, status=405)
+    user, refused = api_user(request)
+    if refused is not None:
+        return refused
+    if 'since' not in request.GET:
+        return JsonResponse({'changes': [], 'next': str(changes.head(user)), 'more': False})
+    try:
+        since = int(request.GET['since'])
+        limit = int(request.GET.get('limit', 500))
+        # with no changes per page, a client would ask for the same page forever
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'error': 'since must be an integer, limit one of at least 1'}, status=400)
+    limit = min(limit, bulk.MAX_BATCH)
+    result, token, more = changes.since(user, since, limit)
+    return JsonResponse({'changes': result, 'next': str(token), 'more': more})
@@ -58,6 +58,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'main_app.context_processors.data_version',
             ],
         },
     },
@@ -127,6 +128,35 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = '/'
 
+# Page the bookmark, task and tag lists by cursor instead of by page number, which keeps deep
+# pages as cheap as the first one but drops the page count
+KEYSET_PAGINATION = os.getenv('KEYSET_PAGINATION', 'false').lower() in ('1', 'true', 'yes')
+
+# Largest bookmark file, in bytes, imported through the web page; larger ones are imported
+# with `manage.py import_bookmarks`, which runs outside the request and reports its progress
+BOOKMARK_IMPORT_MAX_SIZE = int(os.getenv('BOOKMARK_IMPORT_MAX_SIZE', 5 * 1024 * 1024))
+
+# Search index backend: 'postgres', 'fts5', 'tokens' or 'auto' for the best one the database
+# supports; run manage.py rebuild_search_index after changing it
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'auto')
+
+# Cache for rendered page fragments: 'locmem' (per process), 'file' (CACHE_LOCATION is a
+# directory) or 'redis' (CACHE_LOCATION is a redis:// URL, needs the django-redis package)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHES = {
+    'default': {
+        'BACKEND': {
+            'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+            'file': 'django.core.cache.backends.filebased.FileBasedCache',
+            'redis': 'django_redis.cache.RedisCache',
+        }[CACHE_BACKEND],
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache') if CACHE_BACKEND == 'file' else ''),
+    },
+}
+
+# Seconds a rendered list or detail fragment is kept; edits invalidate it right away
+FRAGMENT_CACHE_TIMEOUT = int(os.getenv('FRAGMENT_CACHE_TIMEOUT', 600))
+
 EMAIL_USE_TLS = True
 EMAIL_PORT = 587
 EMAIL_HOST = os.getenv('DJANGO_EMAIL_HOST')
@@ -138,9 +168,58 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend' if DEBUG else '
 USE_TRUSTIFI = False if os.getenv('USE_TRUSTIFI', 'false').lower() == 'false' or DEBUG else True
 TRUSTIFI_KEY = os.getenv('TRUSTIFI_KEY')
 TRUSTIFI_SECRET = os.getenv('TRUSTIFI_SECRET')
+TRUSTIFI_URL = os.getenv('TRUSTIFI_URL', 'https://be.trustifi.com/api/i/v1/email')
+# How many emails are sent to Trustifi at the same time
+TRUSTIFI_CONCURRENCY = int(os.getenv('TRUSTIFI_CONCURRENCY', 8))
+# Seconds to wait for Trustifi to answer a single request
+TRUSTIFI_TIMEOUT = float(os.getenv('TRUSTIFI_TIMEOUT', 10))
+TRUSTIFI_MAX_RETRIES = int(os.getenv('TRUSTIFI_MAX_RETRIES', 3))
+# Base delay in seconds of the exponential backoff between retries
+TRUSTIFI_BACKOFF = float(os.getenv('TRUSTIFI_BACKOFF', 0.5))
+# Consecutive failures after which sending stops for TRUSTIFI_BREAKER_COOLDOWN seconds
+TRUSTIFI_BREAKER_THRESHOLD = int(os.getenv('TRUSTIFI_BREAKER_THRESHOLD', 10))
+TRUSTIFI_BREAKER_COOLDOWN = int(os.getenv('TRUSTIFI_BREAKER_COOLDOWN', 60))
+
+# Run the task notifier inside the web process instead of the separate `manage.py run_notifier` worker
+TASK_NOTIFIER_IN_PROCESS = os.getenv('TASK_NOTIFIER_IN_PROCESS', str(DEBUG)).lower() == 'true'
+# How many of the earliest pending due dates the task notifier keeps in memory
+TASK_NOTIFIER_PRELOAD = int(os.getenv('TASK_NOTIFIER_PRELOAD', 1000))
+# Seconds between full reloads of pending tasks, to pick up tasks saved by other processes
+TASK_NOTIFIER_RESYNC_INTERVAL = int(os.getenv('TASK_NOTIFIER_RESYNC_INTERVAL', 300))
+# Seconds to wait before retrying after a failed notification run
+TASK_NOTIFIER_RETRY_DELAY = int(os.getenv('TASK_NOTIFIER_RETRY_DELAY', 60))
+# How many due tasks the task notifier loads and marks as notified at a time
+TASK_NOTIFIER_BATCH_SIZE = int(os.getenv('TASK_NOTIFIER_BATCH_SIZE', 500))
+# Seconds a notifier worker holds its claim on due tasks before other workers may retry them
+TASK_NOTIFIER_LEASE = int(os.getenv('TASK_NOTIFIER_LEASE', 300))
+# Delivery attempts after which a notification is dead-lettered
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 5))
+# Seconds before the first retry of a failed notification, doubled on every further attempt
+NOTIFICATION_RETRY_DELAY = int(os.getenv('NOTIFICATION_RETRY_DELAY', 60))
+# Seconds a user's reminders are held back so that reminders coming due meanwhile go out in
+# the same digest email; 0 sends every reminder on its own as soon as it is due
+NOTIFICATION_DIGEST_WINDOW = int(os.getenv('NOTIFICATION_DIGEST_WINDOW', 0))
+# How many notifier runs are kept for the metrics of `manage.py notifier_stats`
+NOTIFIER_RUNS_KEPT = int(os.getenv('NOTIFIER_RUNS_KEPT', 1000))
 
 BASE_URL = 'http://127.0.0.1:8000' if DEBUG else 'https://minzam.herokuapp.com'
 
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'main_app': {
+            'handlers': ['console'],
+            'level': os.getenv('MINZAM_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
 # Heroku: Update database configuration from $DATABASE_URL.
 import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)
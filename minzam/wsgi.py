@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 from main_app.task_notifier import run_task_notifier
@@ -17,4 +18,6 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'minzam.settings')
 
 application = get_wsgi_application()
 
-run_task_notifier()
+# In production the notifier runs in its own worker process (see Procfile)
+if settings.TASK_NOTIFIER_IN_PROCESS:
+    run_task_notifier()